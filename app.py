@@ -7,6 +7,7 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from functools import partial
 from pathlib import Path
 import sys
 import warnings
@@ -20,8 +21,9 @@ sys.path.insert(0, str(Path(__file__).parent))
 from src.csv_parser import parse_portfolio_csv
 from src.risk_calculator import calculate_cluster_risks
 from src.visualizer import create_visualizations
-from src.export import export_to_calc
-from src.database import save_to_history, get_history, delete_analysis, clear_all_history, vacuum_database, get_history_timeseries
+from src.export import get_export
+from src.snapshot_codec import risk_fingerprint
+from src.database import save_to_history, get_history, delete_analyses, clear_all_history, vacuum_database, get_history_timeseries, get_history_timeline, get_history_timeline_labels
 from src.diagnostics import get_diagnostics, reset_diagnostics
 
 # Seiten-Konfiguration
@@ -140,6 +142,11 @@ with st.sidebar:
         1, 90, 30,
         help="Nach Ablauf werden ETF-Detail-Dateien und API-Caches neu geladen. 1 = täglich, 30 = monatlich, 90 = quartalsweise."
     )
+    full_holdings = st.checkbox(
+        "Vollständige Holdings",
+        value=False,
+        help="Für ETF-Detail-Dateien mit kompletter Bestandsliste (tausende Holdings). ETFs werden einmal je Datei-Version kompiliert und danach schnell aggregiert."
+    )
     
     # Risk-Berechnung frühzeitig ausführen (für ETF-Auflösungs-Anzeige)
     if effective_file and 'portfolio_data' in st.session_state:
@@ -148,6 +155,8 @@ with st.sidebar:
             risk_data_early = calculate_cluster_risks(
                 st.session_state['portfolio_data'],
                 etf_update_interval_days=etf_update_interval_days,
+                incremental=True,
+                full_holdings=full_holdings,
             )
             st.session_state['risk_data'] = risk_data_early
         except Exception:
@@ -190,6 +199,12 @@ with st.sidebar:
         step=5,
         help="Anzahl der Positionen, die in der Treemap angezeigt werden (größere Werte können unübersichtlich werden)"
     )
+    treemap_hierarchy = st.checkbox(
+        "Treemap gruppiert (Anlageklasse → Sektor → Position)",
+        value=False,
+        help="Einzelpositionen serverseitig gruppieren; kleine Knoten werden je Gruppe zu 'Sonstige' zusammengefasst. "
+             "Bei sehr großen Portfolios automatisch aktiv."
+    )
     max_positions_pie = st.slider(
         "Max. Positionen in Pie Chart", 
         min_value=5, 
@@ -344,6 +359,8 @@ else:
                 risk_data = calculate_cluster_risks(
                     portfolio_data,
                     etf_update_interval_days=etf_update_interval_days,
+                    incremental=True,
+                    full_holdings=full_holdings,
                 )
                 st.session_state['risk_data'] = risk_data
                 st.success("✅ Klumpenrisiken erfolgreich berechnet!")
@@ -517,33 +534,41 @@ else:
         
         risk_data_positions = risk_data.copy()
         risk_data_positions['positions'] = positions_filtered
-        create_visualizations(risk_data_positions, "positions", max_treemap=max_positions_treemap, max_pie=max_positions_pie, max_bar=max_positions_bar, risk_thresholds=risk_thresholds)
+        create_visualizations(risk_data_positions, "positions", max_treemap=max_positions_treemap, max_pie=max_positions_pie, max_bar=max_positions_bar, risk_thresholds=risk_thresholds, treemap_lod=True if treemap_hierarchy else None)
     
     with tab6:
         st.subheader("Detaillierte Daten")
         
-        # Export-Buttons
-        col1, col2 = st.columns(2)
+        # Export-Buttons (Dateien werden erst beim Klick erzeugt und pro Ergebnis gecacht)
+        export_fingerprint = risk_fingerprint(risk_data)
+        col1, col2, col3 = st.columns(3)
         with col1:
-            xlsx_data = export_to_calc(risk_data, format='xlsx')
             st.download_button(
                 label="📥 Excel (.xlsx)",
-                data=xlsx_data,
+                data=partial(get_export, risk_data, 'xlsx', export_fingerprint),
                 file_name="portfolio_klumpenrisiko.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True
             )
         
         with col2:
-            ods_data = export_to_calc(risk_data, format='ods')
             st.download_button(
                 label="📥 LibreOffice (.ods)",
-                data=ods_data,
+                data=partial(get_export, risk_data, 'ods', export_fingerprint),
                 file_name="portfolio_klumpenrisiko.ods",
                 mime="application/vnd.oasis.opendocument.spreadsheet",
                 use_container_width=True
             )
         
+        with col3:
+            st.download_button(
+                label="📦 CSV (.zip)",
+                data=partial(get_export, risk_data, 'csv', export_fingerprint),
+                file_name="portfolio_klumpenrisiko_csv.zip",
+                mime="application/zip",
+                use_container_width=True
+            )
+        
         # Daten-Tabellen anzeigen
         st.markdown("---")
         
@@ -615,10 +640,7 @@ else:
                         type="primary",
                         use_container_width=True
                     ):
-                        deleted_count = 0
-                        for analysis_id in selected_ids:
-                            if delete_analysis(int(analysis_id)):
-                                deleted_count += 1
+                        deleted_count = delete_analyses(int(analysis_id) for analysis_id in selected_ids)
                         
                         # Nach Löschen: VACUUM um Speicherplatz freizugeben
                         vacuum_database()
@@ -626,7 +648,8 @@ else:
                         st.rerun()
             
             # Verlaufs-Charts (nur wenn >= 2 Einträge)
-            timeseries = get_history_timeseries()
+            # Lange Historien auf Tages-/Wochen-/Monatswerte reduzieren (begrenzte Punktzahl)
+            timeseries = get_history_timeseries(resolution='auto')
             if timeseries is not None:
                 
                 # Expander 1: Portfolio-Verlauf
@@ -748,6 +771,34 @@ else:
                             legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
                         )
                         st.plotly_chart(fig_sector, use_container_width=True, key="hist_sector")
+                
+                # Expander 3: Verlauf einer einzelnen Position (inkl. ETF-Durchschau)
+                with st.expander("🔍 Positions-Verlauf"):
+                    position_labels = get_history_timeline_labels('positions')
+                    
+                    if position_labels:
+                        selected_position = st.selectbox(
+                            "Position",
+                            position_labels,
+                            key="hist_position_select"
+                        )
+                        position_df = get_history_timeline(selected_position, 'positions')
+                        
+                        fig_position = px.line(
+                            position_df,
+                            x='timestamp',
+                            y='pct',
+                            markers=True,
+                            hover_data={'value': ':,.2f'}
+                        )
+                        fig_position.update_layout(
+                            title=f"{selected_position} – Anteil am Portfolio",
+                            xaxis_title="Datum",
+                            yaxis_title="Anteil (%)",
+                            height=350,
+                            margin=dict(t=40, l=10, r=10, b=10)
+                        )
+                        st.plotly_chart(fig_position, use_container_width=True, key="hist_position")
             
             # Statistiken
             st.markdown("---")
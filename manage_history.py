@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Historie Management Tool
+Verwalte die Analyse-Historie (data/history.db)
+"""
+
+import sys
+from pathlib import Path
+
+# Sicherstellen, dass src importiert werden kann
+sys.path.insert(0, str(Path(__file__).parent))
+
+from src.database import get_history, backfill_history_rollups, vacuum_database
+
+
+def show_stats():
+    """Zeige Historie-Statistiken"""
+    history = get_history()
+    
+    print("\n📊 Analyse-Historie")
+    print("=" * 50)
+    print(f"Gespeicherte Analysen: {len(history)}")
+    if not history.empty:
+        print(f"Älteste Analyse: {history['Datum'].iloc[-1]}")
+        print(f"Neueste Analyse: {history['Datum'].iloc[0]}")
+
+
+def backfill_rollups():
+    """Berechne Chart-Rollups für alle bestehenden Analysen neu"""
+    count = backfill_history_rollups()
+    print(f"\n✅ Rollups für {count} Analyse(n) berechnet")
+
+
+def vacuum():
+    """Komprimiere die Datenbank"""
+    if vacuum_database():
+        print("\n✅ Datenbank komprimiert")
+    else:
+        print("\n❌ VACUUM fehlgeschlagen")
+
+
+def main():
+    """Hauptfunktion"""
+    
+    if len(sys.argv) < 2:
+        print("""
+Historie Management Tool
+
+Verwendung:
+    python manage_history.py <command>
+
+Befehle:
+    stats               Zeige Historie-Statistiken
+    backfill            Berechne Rollups (Top-5, Währungen, Sektoren) für bestehende Analysen
+    vacuum              Komprimiere die Datenbank
+
+Beispiele:
+    python manage_history.py stats
+    python manage_history.py backfill
+        """)
+        return
+    
+    command = sys.argv[1].lower()
+    
+    if command == 'stats':
+        show_stats()
+    
+    elif command == 'backfill':
+        backfill_rollups()
+    
+    elif command == 'vacuum':
+        vacuum()
+    
+    else:
+        print(f"❌ Unbekannter Befehl: {command}")
+        print("Nutze 'python manage_history.py' ohne Argumente für Hilfe")
+
+
+if __name__ == "__main__":
+    main()
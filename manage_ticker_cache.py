@@ -91,6 +91,46 @@ def fetch_ticker(ticker: str):
     print(f"✅ {ticker} → {sector}")
 
 
+def prefetch_tickers(args: list):
+    """Hole Sektoren für viele Ticker parallel (Batch) und fülle den Cache"""
+    workers = 8
+    force = False
+    tickers = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--workers' and i + 1 < len(args):
+            workers = int(args[i + 1])
+            i += 2
+            continue
+        if arg == '--force':
+            force = True
+        elif arg.startswith('@'):
+            # Ticker-Liste aus Datei (ein Ticker pro Zeile, # = Kommentar)
+            with open(arg[1:], 'r', encoding='utf-8') as f:
+                tickers.extend(
+                    line.strip() for line in f if line.strip() and not line.startswith('#')
+                )
+        else:
+            tickers.extend(t for t in arg.split(',') if t.strip())
+        i += 1
+    
+    if not tickers:
+        print("❌ Fehler: Mindestens ein Ticker erforderlich")
+        return
+    
+    mapper = get_mapper()
+    print(f"\n🔍 Hole Sektoren für {len(tickers)} Ticker ({workers} parallel)...")
+    details = mapper.fetch_sectors(tickers, use_cache=not force, max_workers=workers)
+    
+    for ticker, info in details.items():
+        seconds = f"{info['seconds']:.2f}s" if info['seconds'] is not None else '-'
+        print(f"{ticker:15} → {info['sector']:25} ({info['source']}, {seconds})")
+    
+    fetched = sum(1 for info in details.values() if info['source'] != 'cache')
+    print(f"\n✅ {len(details)} Ticker, davon {fetched} neu abgefragt")
+
+
 def main():
     """Hauptfunktion"""
     
@@ -108,6 +148,8 @@ Befehle:
     remove <TICKER>     Entferne Ticker
     clear               Lösche kompletten Cache
     fetch <TICKER>      Hole Sektor von API (force refresh)
+    prefetch <TICKER...|@DATEI> [--workers N] [--force]
+                        Hole Sektoren für viele Ticker parallel
 
 Beispiele:
     python manage_ticker_cache.py stats
@@ -115,6 +157,8 @@ Beispiele:
     python manage_ticker_cache.py add AAPL Technology
     python manage_ticker_cache.py remove AAPL
     python manage_ticker_cache.py fetch TSLA
+    python manage_ticker_cache.py prefetch AAPL MSFT NVDA --workers 4
+    python manage_ticker_cache.py prefetch @tickers.txt
         """)
         return
     
@@ -152,6 +196,9 @@ Beispiele:
         ticker = sys.argv[2]
         fetch_ticker(ticker)
     
+    elif command == 'prefetch':
+        prefetch_tickers(sys.argv[2:])
+    
     else:
         print(f"❌ Unbekannter Befehl: {command}")
         print("Nutze 'python manage_ticker_cache.py' ohne Argumente für Hilfe")
@@ -4,6 +4,8 @@ Parst die CSV-Exporte aus PP (viel einfacher als XML!)
 """
 
 import logging
+import re
+import numpy as np
 import pandas as pd
 from typing import Dict, List
 from datetime import datetime
@@ -12,6 +14,19 @@ from .diagnostics import get_diagnostics
 
 logger = logging.getLogger(__name__)
 
+# Schlüsselwörter zur Typ-Erkennung (Name bzw. Symbol, Großschreibung)
+_ETF_KEYWORDS = [
+    'ETF', 'ETC', 'UCITS', 'INDEX FUND', 'TRACKER',
+    'ISHARES', 'ISHSIII', 'ISHS', 'EUNL', 'XEON', 'XGDU',
+    'VANGUARD', 'XTRACKERS', 'LYXOR', 'AMUNDI',
+    'SPDR', 'INVESCO', 'WISDOMTREE', 'FRANKLIN',
+    'MSCI WORLD', 'MSCI EM', 'MSCI EUROPE',
+    'S&P 500', 'NASDAQ', 'DAX', 'STOXX',
+]
+_MONEY_MARKET_KEYWORDS = ['LIQUIDITÄT', 'TAGESGELD', 'OVERNIGHT', 'MONEY MARKET', 'GELDMARKT', 'CASH FUND']
+_COMMODITY_KEYWORDS = ['GOLD', 'SILVER', 'COMMODITY']
+_BOND_KEYWORDS = ['BOND', 'ANLEIHE']
+
 
 def parse_portfolio_csv(filepath: str) -> Dict:
     """
@@ -47,35 +62,66 @@ def parse_portfolio_csv(filepath: str) -> Dict:
         'parse_date': datetime.now().isoformat()
     }
     
-    # Zeilen durchgehen
-    for idx, row in df.iterrows():
-        # Überspringe Summen-Zeilen
-        if pd.isna(row['Name']) or 'Summe' in str(row['Name']):
+    # Spaltenweise statt iterrows(): bei großen Exporten (mehrere tausend Zeilen) deutlich schneller
+    # Überspringe Summen-Zeilen
+    name_raw = df['Name']
+    df = df[name_raw.notna() & ~name_raw.map(str).str.contains('Summe', regex=False)]
+    
+    names = df['Name'].map(str).str.strip()
+    names_lower = names.str.lower()
+    
+    # Prüfe ob es Cash ist (kein Bestand, nur Marktwert)
+    bestand = df['Bestand'].map(str).str.strip()
+    
+    # Prüfe Notiz-Feld für spezielle Marker
+    notiz = _text_column(df, 'Notiz').str.upper()
+    
+    # Cash-Erkennung: Leerer Bestand ODER Name enthält "Konto" ODER Notiz="CASH"/"GELDMARKT"
+    is_cash = ((bestand == '') | (bestand == '""') |
+               names_lower.str.contains('konto', regex=False) |
+               names_lower.str.contains('cash', regex=False) |
+               notiz.isin(['CASH', 'GELDMARKT', 'TAGESGELD']))
+    
+    # Marktwert parsen (Format: "2.279,86"), Bestand mit Dezimalkomma
+    values, value_ok = _parse_float_column(
+        df['Marktwert'].map(str).str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    )
+    shares, shares_ok = _parse_float_column(bestand.str.replace(',', '.', regex=False))
+    # Nicht parsebare Zeilen überspringen (Wertpapiere brauchen zusätzlich einen gültigen Bestand)
+    keep = value_ok & (is_cash.to_numpy() | shares_ok)
+    
+    # Symbol/Ticker und ISIN (falls vorhanden)
+    symbols = _text_column(df, 'Symbol')
+    isins = _text_column(df, 'ISIN')
+    
+    # Währung aus Kurs-Feld extrahieren (Format: "USD 269,48" oder "148,314")
+    kurs = df['Kurs'].map(str).str.strip()
+    currency_part = kurs.str.split(' ', n=1).str[0].str.strip()
+    has_currency = (kurs.str.contains(' ', regex=False) &
+                    (currency_part.str.len() == 3) & currency_part.str.isupper())
+    currencies = currency_part.where(has_currency, 'EUR')
+    
+    # Typ bestimmen; Override: Falls Notiz "CASH" oder "GELDMARKT" enthält -> als Cash behandeln
+    sec_types = _determine_security_types(names, symbols)
+    sec_types = sec_types.where(~notiz.str.contains('CASH|GELDMARKT|TAGESGELD'), 'Cash')
+    
+    # Sektor/Branche aus CSV auslesen (Priorität 1) – je eindeutigem Wert nur einmal normalisieren
+    if sector_column and sector_column in df.columns:
+        sector_raw = _text_column(df, sector_column)
+        sector_map = {v: _normalize_sector_name(v) for v in sector_raw.unique() if v}
+        sectors = [sector_map[v] if v else None for v in sector_raw.tolist()]
+    else:
+        sectors = [None] * len(df)
+    
+    rows = zip(
+        keep.tolist(), is_cash.tolist(), names.tolist(), values.tolist(), shares.tolist(),
+        symbols.tolist(), isins.tolist(), currencies.tolist(), sec_types.tolist(), sectors,
+    )
+    for row_ok, row_is_cash, name, value, row_shares, symbol, isin, currency, sec_type, sector in rows:
+        if not row_ok:
             continue
         
-        name = str(row['Name']).strip()
-        
-        # Prüfe ob es Cash ist (kein Bestand, nur Marktwert)
-        bestand_str = str(row['Bestand']).strip()
-        
-        # Prüfe Notiz-Feld für spezielle Marker
-        notiz = ''
-        if 'Notiz' in row and pd.notna(row['Notiz']):
-            notiz = str(row['Notiz']).strip().upper()
-        
-        # Cash-Erkennung: Leerer Bestand ODER Name enthält "Konto" ODER Notiz="CASH"/"GELDMARKT"
-        is_cash = (not bestand_str or bestand_str == '' or bestand_str == '""' or 
-                   'konto' in name.lower() or 'cash' in name.lower() or
-                   notiz in ['CASH', 'GELDMARKT', 'TAGESGELD'])
-        
-        if is_cash:
-            # Das ist ein Cash-Konto
-            marktwert_str = str(row['Marktwert']).replace('.', '').replace(',', '.')
-            try:
-                value = float(marktwert_str)
-            except:
-                continue
-            
+        if row_is_cash:
             portfolio_data['positions'].append({
                 'name': name,
                 'isin': '',
@@ -88,91 +134,33 @@ def parse_portfolio_csv(filepath: str) -> Dict:
                 'portfolio': 'Cash',
                 'sector_from_pp': None
             })
-            logger.debug("Cash-Position: %s = €%.2f", name, value)
+            continue
         
-        else:
-            # Das ist ein Wertpapier
-            try:
-                shares = float(bestand_str.replace(',', '.'))
-            except:
-                continue
-            
-            # Marktwert parsen (Format: "2.279,86")
-            marktwert_str = str(row['Marktwert']).replace('.', '').replace(',', '.')
-            try:
-                value = float(marktwert_str)
-            except:
-                continue
-            
-            # Symbol/Ticker
-            symbol = str(row['Symbol']).strip() if pd.notna(row['Symbol']) else ''
-            
-            # ISIN (falls vorhanden)
-            isin = ''
-            if 'ISIN' in row and pd.notna(row['ISIN']):
-                isin = str(row['ISIN']).strip()
-            
-            # Währung aus Kurs-Feld extrahieren (Format: "USD 269,48" oder "148,314")
-            kurs_str = str(row['Kurs']).strip()
-            currency = 'EUR'  # Default
-            if ' ' in kurs_str:
-                # Format: "USD 269,48"
-                currency_part = kurs_str.split(' ')[0].strip()
-                if len(currency_part) == 3 and currency_part.isupper():
-                    currency = currency_part
-            
-            # Prüfe Notiz-Feld für spezielle Marker
-            notiz = ''
-            if 'Notiz' in row and pd.notna(row['Notiz']):
-                notiz = str(row['Notiz']).strip().upper()
-            
-            # Typ bestimmen
-            sec_type = _determine_security_type(name, symbol)
-            
-            # Override: Falls Notiz "CASH" oder "GELDMARKT" enthält -> als Cash behandeln
-            if notiz and any(keyword in notiz for keyword in ['CASH', 'GELDMARKT', 'TAGESGELD']):
-                sec_type = 'Cash'
-                logger.debug("Notiz-Override: %s -> Cash (Notiz: %s)", name, notiz)
-            
-            # Sektor/Branche aus CSV auslesen (Priorität 1) – nutzt flexibel erkannte Spalte
-            sector = None
-            if sector_column and sector_column in row.index and pd.notna(row.get(sector_column)):
-                sector_value = str(row[sector_column]).strip()
-                if sector_value and sector_value != '':
-                    sector = _normalize_sector_name(sector_value)
-                    logger.debug("Branche aus CSV: %s -> %s (Original: %s)", name, sector, sector_value)
-            
-            # Fallback: Sektor aus Ticker ableiten (nur für Aktien, nicht für ETFs)
-            if not sector and sec_type == 'Stock':
-                sector = _get_sector_from_ticker(symbol)
-                if sector:
-                    logger.debug("Branche aus Ticker: %s (%s) -> %s", name, symbol, sector)
-                else:
-                    logger.debug("Keine Branche gefunden für %s (Ticker: %s, kein Mapping)", name, symbol)
-                    # Diagnose: Keine Branche gefunden
-                    diagnostics = get_diagnostics()
-                    diagnostics.add_warning(
-                        'Branchen',
-                        f'Keine Branche für Aktie "{name}" gefunden',
-                        f'Ticker: {symbol if symbol else "nicht vorhanden"}. Die Aktie wird unter "Unknown" kategorisiert.'
-                    )
-            
-            portfolio_data['positions'].append({
-                'name': name,
-                'isin': isin,  # ISIN aus CSV
-                'wkn': '',
-                'type': sec_type,
-                'currency': currency,  # Währung aus Kurs-Feld extrahiert
-                'ticker_symbol': symbol,
-                'shares': shares,
-                'value': value,
-                'portfolio': 'Portfolio',
-                'sector_from_pp': sector  # Sektor aus Ticker-Mapping
-            })
-            price_per_share = value / shares if shares else 0.0
-            logger.debug("Position: %s (%s, %s, %s, %s) = %s × €%.2f = €%.2f",
-                         name, sec_type, currency, sector, isin[:10] if isin else 'no ISIN',
-                         shares, price_per_share, value)
+        # Fallback: Sektor aus Ticker ableiten (nur für Aktien, nicht für ETFs)
+        if not sector and sec_type == 'Stock':
+            sector = _get_sector_from_ticker(symbol)
+            if not sector:
+                logger.debug("Keine Branche gefunden für %s (Ticker: %s, kein Mapping)", name, symbol)
+                # Diagnose: Keine Branche gefunden
+                diagnostics = get_diagnostics()
+                diagnostics.add_warning(
+                    'Branchen',
+                    f'Keine Branche für Aktie "{name}" gefunden',
+                    f'Ticker: {symbol if symbol else "nicht vorhanden"}. Die Aktie wird unter "Unknown" kategorisiert.'
+                )
+        
+        portfolio_data['positions'].append({
+            'name': name,
+            'isin': isin,  # ISIN aus CSV
+            'wkn': '',
+            'type': sec_type,
+            'currency': currency,  # Währung aus Kurs-Feld extrahiert
+            'ticker_symbol': symbol,
+            'shares': row_shares,
+            'value': value,
+            'portfolio': 'Portfolio',
+            'sector_from_pp': sector  # Sektor aus CSV oder Ticker-Mapping
+        })
     
     # Statistiken
     portfolio_data['total_positions'] = len(portfolio_data['positions'])
@@ -186,6 +174,38 @@ def parse_portfolio_csv(filepath: str) -> Dict:
     return portfolio_data
 
 
+def _text_column(df: pd.DataFrame, column: str) -> pd.Series:
+    """Spalte als getrimmte Strings; fehlende Spalte oder leere Zellen → ''"""
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    col = df[column]
+    return col.map(str).str.strip().where(col.notna(), '')
+
+
+def _parse_float_column(strings: pd.Series) -> tuple:
+    """
+    Wandelt eine String-Spalte wie float() um.
+    
+    Returns:
+        (values: np.ndarray, ok: np.ndarray[bool]) – nicht konvertierbare Werte sind NaN mit ok=False
+    """
+    raw = strings.to_numpy(dtype=object)
+    try:
+        return raw.astype(np.float64), np.ones(len(raw), dtype=bool)
+    except (TypeError, ValueError):
+        pass
+    # Langsamer Pfad nur wenn mindestens ein Wert nicht konvertierbar ist
+    values = np.full(len(raw), np.nan)
+    ok = np.zeros(len(raw), dtype=bool)
+    for i, s in enumerate(raw):
+        try:
+            values[i] = float(s)
+            ok[i] = True
+        except (TypeError, ValueError):
+            continue
+    return values, ok
+
+
 def _find_sector_column(column_names: List[str]) -> str:
     """
     Ermittelt die Branchen/Sektor-Spalte flexibel aus den CSV-Spaltennamen.
@@ -223,29 +243,44 @@ def _determine_security_type(name: str, symbol: str) -> str:
     symbol_upper = symbol.upper() if symbol else ''
 
     # ETF-Erkennung zuerst (inkl. XEON, XGDU – Typ aus ETF-Details)
-    etf_keywords = [
-        'ETF', 'ETC', 'UCITS', 'INDEX FUND', 'TRACKER',
-        'ISHARES', 'ISHSIII', 'ISHS', 'EUNL', 'XEON', 'XGDU',
-        'VANGUARD', 'XTRACKERS', 'LYXOR', 'AMUNDI',
-        'SPDR', 'INVESCO', 'WISDOMTREE', 'FRANKLIN',
-        'MSCI WORLD', 'MSCI EM', 'MSCI EUROPE',
-        'S&P 500', 'NASDAQ', 'DAX', 'STOXX',
-    ]
-    if any(keyword in name_upper or keyword in symbol_upper for keyword in etf_keywords):
+    if any(keyword in name_upper or keyword in symbol_upper for keyword in _ETF_KEYWORDS):
         return 'ETF'
 
     # Reine Cash-Konten (keine Wertpapiere)
-    money_market_keywords = ['LIQUIDITÄT', 'TAGESGELD', 'OVERNIGHT', 'MONEY MARKET', 'GELDMARKT', 'CASH FUND']
-    if any(keyword in name_upper for keyword in money_market_keywords):
+    if any(keyword in name_upper for keyword in _MONEY_MARKET_KEYWORDS):
         return 'Cash'
 
-    if 'GOLD' in name_upper or 'SILVER' in name_upper or 'COMMODITY' in name_upper:
+    if any(keyword in name_upper for keyword in _COMMODITY_KEYWORDS):
         return 'Commodity'
-    if 'BOND' in name_upper or 'ANLEIHE' in name_upper:
+    if any(keyword in name_upper for keyword in _BOND_KEYWORDS):
         return 'Bond'
     return 'Stock'
 
 
+def _keyword_pattern(keywords: List[str]) -> str:
+    """Regex, die auf einen der Begriffe (als Teilstring) passt"""
+    return '|'.join(re.escape(k) for k in keywords)
+
+
+def _determine_security_types(names: pd.Series, symbols: pd.Series) -> pd.Series:
+    """Spaltenweise Variante von _determine_security_type (gleiche Reihenfolge der Regeln)"""
+    names_upper = names.str.upper()
+    symbols_upper = symbols.str.upper()
+    etf_pattern = _keyword_pattern(_ETF_KEYWORDS)
+    conditions = [
+        names_upper.str.contains(etf_pattern) | symbols_upper.str.contains(etf_pattern),
+        names_upper.str.contains(_keyword_pattern(_MONEY_MARKET_KEYWORDS)),
+        names_upper.str.contains(_keyword_pattern(_COMMODITY_KEYWORDS)),
+        names_upper.str.contains(_keyword_pattern(_BOND_KEYWORDS)),
+    ]
+    types = np.select(
+        [c.to_numpy(dtype=bool) for c in conditions],
+        ['ETF', 'Cash', 'Commodity', 'Bond'],
+        default='Stock',
+    )
+    return pd.Series(types, index=names.index, dtype=object)
+
+
 def _get_sector_from_ticker(ticker: str) -> str:
     """
     Gibt den Sektor für einen Ticker zurück.
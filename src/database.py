@@ -5,10 +5,156 @@ Verwaltet Historie der Portfolio-Analysen
 
 import sqlite3
 import json
+import threading
 import pandas as pd
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional
+
+from .snapshot_codec import (
+    SNAPSHOT_FORMAT, DELTA_FORMAT,
+    frame_payload, frame_digest, encode_frame, decode_frame, encode_delta, decode_delta,
+)
+from .security_master import normalize_isin, normalize_position_name
+
+
+# Label-Spalte je Risiko-Dimension (erste Spalte der DataFrames aus calculate_cluster_risks)
+LABEL_COLUMNS = {
+    'asset_class': 'Anlageklasse',
+    'sector': 'Sektor',
+    'currency': 'Währung',
+    'currency_with_commodities': 'Währung',
+    'country': 'Land',
+    'positions': 'Position',
+}
+
+# Schema-Version (PRAGMA user_version)
+SCHEMA_VERSION = 5
+
+# Dimensionen, die als Delta zum vorherigen Snapshot gespeichert werden
+_DELTA_DIMENSIONS = ('positions',)
+# Maximale Länge einer Delta-Kette, danach wieder vollständiger Snapshot
+_MAX_DELTA_DEPTH = 16
+
+# Dekodierte Snapshots im Speicher (Basis für das nächste Delta, wiederholtes Lesen)
+_FRAME_CACHE_SIZE = 32
+
+# Dimensionen mit Chart-Rollups
+_ROLLUP_DIMENSIONS = ('asset_class', 'currency', 'sector', 'positions')
+
+# Rollups für die Verlaufs-Charts: Währungen Top 4 + "Sonstige", Sektoren Top 5 + "Sonstige",
+# Anlageklassen vollständig, Positionen als Top-5-Summe – je Snapshot
+_ROLLUP_INSERT = """
+    INSERT INTO history_rollups (snapshot_id, bucket, pct, column_order)
+    SELECT snapshot_id, bucket, SUM(pct), MIN(column_order)
+    FROM (
+        SELECT
+            v.snapshot_id,
+            CASE
+                WHEN :dimension = 'currency' AND v.rank >= 4 THEN 'Sonstige'
+                WHEN :dimension = 'sector' AND v.rank >= 5 THEN 'Sonstige'
+                WHEN :dimension = 'positions' THEN 'Top-5'
+                ELSE v.label
+            END AS bucket,
+            v.pct,
+            CASE WHEN :dimension = 'asset_class' THEN v.rowid ELSE v.rank END AS column_order
+        FROM risk_values v
+        WHERE v.snapshot_id = :snapshot_id
+          AND (:dimension IN ('asset_class', 'currency', 'sector')
+               OR (:dimension = 'positions' AND v.rank < 5))
+    )
+    GROUP BY snapshot_id, bucket
+"""
+
+# Downsampling der Zeitreihen: letzte Analyse je Periode
+RESOLUTIONS = {
+    'day': 'D',
+    'week': 'W',
+    'month': 'M',
+}
+
+# Pragmas je Verbindung: WAL erlaubt Lesen parallel zum Schreiben (mehrere Streamlit-Sessions)
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",   # ~16 MB Page-Cache
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+# Größe des Statement-Caches von sqlite3 (vorbereitete Statements pro Verbindung)
+_STATEMENT_CACHE_SIZE = 256
+
+
+def label_key(dimension: str, label: str, isin: Optional[str] = None) -> str:
+    """
+    Normalisierter Suchschlüssel eines Labels (Index-Spalte risk_values.label_key)
+    
+    Positionen über ihre ISIN (wie die Aggregation im Security Master), ohne ISIN über
+    den normalisierten Namen ("Apple Inc." -> "apple"); sonst nur Kleinschreibung und
+    Leerzeichen.
+    """
+    if dimension == 'positions':
+        return normalize_isin(isin) or normalize_position_name(str(label))
+    return ' '.join(str(label).lower().split())
+
+
+_RISK_VALUE_INSERT = """
+    INSERT INTO risk_values (snapshot_id, label, value, pct, rank, label_key)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def _risk_value_rows(snapshot_id: int, dimension: str, df: pd.DataFrame) -> List[tuple]:
+    """
+    Zeilen (snapshot_id, label, value, pct, rank, label_key) eines Snapshots für die normalisierte Tabelle.
+    
+    Zeilen bleiben in gespeicherter Reihenfolge (rowid); rank ist die Position nach
+    Anteil absteigend (stabil, 0-basiert) innerhalb der Dimension.
+    """
+    entries = df.to_dict('records')
+    label_col = LABEL_COLUMNS[dimension]
+    order = sorted(range(len(entries)), key=lambda i: entries[i].get('Anteil (%)', 0), reverse=True)
+    ranks = {i: rank for rank, i in enumerate(order)}
+    rows = []
+    for i, entry in enumerate(entries):
+        label = str(entry.get(label_col, 'Unknown'))
+        rows.append((
+            snapshot_id,
+            label,
+            entry.get('Wert (€)'),
+            entry.get('Anteil (%)', 0),
+            ranks[i],
+            label_key(dimension, label, entry.get('ISIN')),
+        ))
+    return rows
+
+
+class _FrameCache:
+    """Kleiner LRU-Cache digest -> DataFrame (thread-sicher)"""
+    
+    def __init__(self, max_entries: int = _FRAME_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, digest: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            df = self._entries.get(digest)
+            if df is not None:
+                self._entries.move_to_end(digest)
+            return df
+    
+    def put(self, digest: str, df: pd.DataFrame):
+        with self._lock:
+            self._entries[digest] = df
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
 
 class HistoryDatabase:
@@ -19,13 +165,38 @@ class HistoryDatabase:
     def __init__(self, db_path: str = "data/history.db"):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Eine Verbindung pro Thread (sqlite3-Verbindungen sind nicht thread-übergreifend nutzbar)
+        self._local = threading.local()
+        self._frame_cache = _FrameCache()
         self._init_database()
     
+    def connection(self) -> sqlite3.Connection:
+        """
+        Wiederverwendbare Verbindung des aktuellen Threads
+        
+        Als Context-Manager (with db.connection() as conn) wird wie bei sqlite3.connect
+        committet bzw. zurückgerollt, die Verbindung bleibt aber offen.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, cached_statements=_STATEMENT_CACHE_SIZE)
+            for pragma in _CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+    
+    def close(self):
+        """Schließt die Verbindung des aktuellen Threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
     def _init_database(self):
         """
         Initialisiert die Datenbank-Struktur
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             
             # Analysen-Tabelle
@@ -48,21 +219,269 @@ class HistoryDatabase:
             """)
             
             conn.commit()
+            
+            self._migrate(conn)
+    
+    def _migrate(self, conn: sqlite3.Connection):
+        """
+        Bringt das Schema auf SCHEMA_VERSION (PRAGMA user_version)
+        
+        Bisherige Versionen:
+        v1: Normalisierte Tabelle risk_values je Analyse
+        v2: DataFrames als komprimierte, spaltenweise BLOBs (snapshot_dimensions)
+        v3: Beim Speichern berechnete Chart-Rollups (history_rollups)
+        v4: risk_values.label_key mit Index für Timeline-Abfragen
+        v5: Inhaltsadressierte Snapshots – identische DataFrames werden einmal gespeichert
+            (snapshot_blobs, Zuordnung über analysis_snapshots), Positionen als Delta zum
+            vorherigen Snapshot. risk_values und history_rollups hängen am Snapshot (snapshot_id).
+        
+        Ältere Datenbanken (v0–v4) werden direkt nach v5 überführt: Snapshots aus
+        snapshot_dimensions bzw. dem alten JSON werden neu abgelegt, die JSON-Spalte bleibt.
+        
+        Die gesamte Migration läuft in einer Transaktion (BEGIN IMMEDIATE): schlägt sie fehl,
+        bleibt die Datenbank unverändert auf der alten Version.
+        """
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        
+        conn.commit()
+        # Ohne explizite Transaktion liefen DROP/CREATE im Autocommit
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Nach der Sperre erneut lesen (paralleler Prozess könnte migriert haben)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 5:
+                self._migrate_to_v5(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    
+    def _migrate_to_v5(self, conn: sqlite3.Connection):
+        """Schema v5 (Teil von _migrate, läuft in dessen Transaktion)"""
+        previous = self._load_previous_snapshots(conn)
+        
+        for trigger in ('trg_analyses_delete_values', 'trg_analyses_delete_snapshots',
+                        'trg_analyses_delete_rollups'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        for table in ('risk_values', 'snapshot_dimensions', 'history_rollups'):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot_blobs (
+                id INTEGER PRIMARY KEY,
+                digest TEXT NOT NULL UNIQUE,
+                dimension TEXT NOT NULL,
+                format TEXT NOT NULL,
+                base_id INTEGER,
+                depth INTEGER NOT NULL,
+                data BLOB NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_snapshot_blobs_base
+            ON snapshot_blobs(base_id)
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_snapshots (
+                analysis_id INTEGER NOT NULL,
+                dimension TEXT NOT NULL,
+                snapshot_id INTEGER NOT NULL,
+                PRIMARY KEY (analysis_id, dimension)
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_analysis_snapshots_snapshot
+            ON analysis_snapshots(snapshot_id)
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS risk_values (
+                snapshot_id INTEGER NOT NULL,
+                label TEXT NOT NULL,
+                value REAL,
+                pct REAL NOT NULL,
+                rank INTEGER NOT NULL,
+                label_key TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_risk_values_key
+            ON risk_values(snapshot_id, label_key)
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS history_rollups (
+                snapshot_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                pct REAL NOT NULL,
+                column_order INTEGER NOT NULL,
+                PRIMARY KEY (snapshot_id, bucket)
+            )
+        """)
+        # Beim Löschen einer Analyse deren Snapshot-Zuordnung mitlöschen
+        # (nicht mehr referenzierte Snapshots entfernt _collect_garbage)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_analyses_delete_snapshot_refs
+            AFTER DELETE ON analyses
+            BEGIN
+                DELETE FROM analysis_snapshots WHERE analysis_id = OLD.id;
+            END
+        """)
+        
+        for analysis_id, frames in previous:
+            self._store_snapshots(conn, analysis_id, frames)
+    
+    @staticmethod
+    def _load_previous_snapshots(conn: sqlite3.Connection) -> List[tuple]:
+        """
+        DataFrames aller Analysen aus einem Schema vor v5
+        
+        Returns:
+            Liste (analysis_id, {dimension: DataFrame}) nach ID
+        """
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        blobs: Dict[int, Dict[str, pd.DataFrame]] = {}
+        if 'snapshot_dimensions' in tables:
+            for analysis_id, dimension, fmt, data in conn.execute(
+                "SELECT analysis_id, dimension, format, data FROM snapshot_dimensions"
+            ):
+                if fmt == SNAPSHOT_FORMAT:
+                    blobs.setdefault(analysis_id, {})[dimension] = decode_frame(data)
+        
+        previous = []
+        for analysis_id, risk_data_json in conn.execute("SELECT id, risk_data FROM analyses ORDER BY id").fetchall():
+            try:
+                risk_data = json.loads(risk_data_json)
+            except (TypeError, ValueError):
+                continue
+            frames = blobs.get(analysis_id)
+            if frames is None:
+                # Altes Format: DataFrames als Record-Listen im JSON
+                frames = {
+                    dimension: pd.DataFrame(risk_data[dimension])
+                    for dimension in LABEL_COLUMNS if isinstance(risk_data.get(dimension), list)
+                }
+            previous.append((analysis_id, frames))
+        return previous
+    
+    def _store_snapshots(self, conn: sqlite3.Connection, analysis_id: int,
+                         frames: Dict[str, pd.DataFrame]):
+        """
+        Legt die DataFrames einer Analyse inhaltsadressiert ab
+        
+        Bereits vorhandene Snapshots (gleicher digest) werden nur referenziert. Neue
+        Positions-Snapshots werden als Delta zum Snapshot der vorherigen Analyse gespeichert,
+        wenn das kleiner ist. risk_values und Rollups entstehen nur für neue Snapshots.
+        """
+        for dimension, df in frames.items():
+            payload = frame_payload(df)
+            digest = frame_digest(payload, dimension)
+            
+            row = conn.execute("SELECT id FROM snapshot_blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is not None:
+                snapshot_id = row[0]
+            else:
+                fmt, base_id, depth = SNAPSHOT_FORMAT, None, 0
+                data = encode_frame(df, payload)
+                if dimension in _DELTA_DIMENSIONS:
+                    base = conn.execute("""
+                        SELECT b.id, b.depth
+                        FROM analysis_snapshots s
+                        JOIN snapshot_blobs b ON b.id = s.snapshot_id
+                        WHERE s.dimension = ? AND s.analysis_id < ?
+                        ORDER BY s.analysis_id DESC
+                        LIMIT 1
+                    """, (dimension, analysis_id)).fetchone()
+                    if base is not None and base[1] < _MAX_DELTA_DEPTH:
+                        delta = encode_delta(df, self._load_frame(conn, base[0]))
+                        if delta is not None and len(delta) < len(data):
+                            fmt, base_id, depth, data = DELTA_FORMAT, base[0], base[1] + 1, delta
+                
+                snapshot_id = conn.execute("""
+                    INSERT INTO snapshot_blobs (digest, dimension, format, base_id, depth, data)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (digest, dimension, fmt, base_id, depth, data)).lastrowid
+                # Basis für das Delta der nächsten Analyse (inhaltsadressiert, daher auch
+                # nach Rollback/ID-Neuvergabe korrekt)
+                self._frame_cache.put(digest, df.copy())
+                
+                if dimension in LABEL_COLUMNS:
+                    # Normalisierte Werte für schnelle Zeitreihen-Abfragen
+                    conn.executemany(_RISK_VALUE_INSERT, _risk_value_rows(snapshot_id, dimension, df))
+                if dimension in _ROLLUP_DIMENSIONS:
+                    # Chart-Rollups einmalig beim Speichern berechnen
+                    conn.execute(_ROLLUP_INSERT, {'dimension': dimension, 'snapshot_id': snapshot_id})
+            
+            conn.execute(
+                "INSERT INTO analysis_snapshots VALUES (?, ?, ?)",
+                (analysis_id, dimension, snapshot_id)
+            )
+    
+    def _load_frame(self, conn: sqlite3.Connection, snapshot_id: int) -> Optional[pd.DataFrame]:
+        """Dekodiert einen Snapshot (Delta-Ketten über die Basis-Snapshots)"""
+        row = conn.execute(
+            "SELECT digest, format, base_id, data FROM snapshot_blobs WHERE id = ?", (snapshot_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        digest, fmt, base_id, data = row
+        df = self._frame_cache.get(digest)
+        if df is not None:
+            return df.copy()
+        if fmt == SNAPSHOT_FORMAT:
+            df = decode_frame(data)
+        elif fmt == DELTA_FORMAT:
+            df = decode_delta(data, self._load_frame(conn, base_id))
+        else:
+            raise ValueError(f"Unbekanntes Snapshot-Format: {fmt}")
+        self._frame_cache.put(digest, df)
+        return df.copy()
+    
+    @staticmethod
+    def _collect_garbage(conn: sqlite3.Connection):
+        """Entfernt Snapshots ohne Analyse, die auch keinem Delta als Basis dienen"""
+        while True:
+            cursor = conn.execute("""
+                DELETE FROM snapshot_blobs
+                WHERE id NOT IN (SELECT snapshot_id FROM analysis_snapshots)
+                  AND id NOT IN (SELECT base_id FROM snapshot_blobs WHERE base_id IS NOT NULL)
+            """)
+            if cursor.rowcount <= 0:
+                break
+        conn.execute("DELETE FROM risk_values WHERE snapshot_id NOT IN (SELECT id FROM snapshot_blobs)")
+        conn.execute("DELETE FROM history_rollups WHERE snapshot_id NOT IN (SELECT id FROM snapshot_blobs)")
+    
+    def backfill_rollups(self) -> int:
+        """
+        Berechnet die Rollups aller gespeicherten Snapshots neu
+        
+        Returns:
+            Anzahl Analysen mit Rollups
+        """
+        with self.connection() as conn:
+            conn.execute("DELETE FROM history_rollups")
+            placeholders = ', '.join('?' * len(_ROLLUP_DIMENSIONS))
+            for snapshot_id, dimension in conn.execute(
+                f"SELECT id, dimension FROM snapshot_blobs WHERE dimension IN ({placeholders})",
+                _ROLLUP_DIMENSIONS
+            ).fetchall():
+                conn.execute(_ROLLUP_INSERT, {'dimension': dimension, 'snapshot_id': snapshot_id})
+            return conn.execute("""
+                SELECT COUNT(DISTINCT s.analysis_id)
+                FROM analysis_snapshots s
+                JOIN history_rollups r ON r.snapshot_id = s.snapshot_id
+            """).fetchone()[0]
     
     def save_analysis(self, portfolio_data: Dict, risk_data: Dict):
         """
         Speichert eine Analyse in der Historie
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             
-            # Risk-Data als JSON serialisieren (DataFrames -> Dict)
-            risk_data_serialized = {}
-            for key, value in risk_data.items():
-                if isinstance(value, pd.DataFrame):
-                    risk_data_serialized[key] = value.to_dict('records')
-                else:
-                    risk_data_serialized[key] = value
+            # DataFrames als kompakte Snapshots, übrige Werte (total_value, etf_resolution, ...) als JSON
+            frames = {key: value for key, value in risk_data.items() if isinstance(value, pd.DataFrame)}
+            risk_data_meta = {key: value for key, value in risk_data.items() if key not in frames}
             
             cursor.execute("""
                 INSERT INTO analyses (
@@ -76,10 +495,72 @@ class HistoryDatabase:
                 portfolio_data['total_positions'],
                 portfolio_data['etf_count'],
                 portfolio_data['stock_count'],
-                json.dumps(risk_data_serialized)
+                json.dumps(risk_data_meta)
             ))
+            analysis_id = cursor.lastrowid
+            
+            self._store_snapshots(conn, analysis_id, frames)
             
             conn.commit()
+            return analysis_id
+    
+    def get_analysis_dimension(self, analysis_id: int, dimension: str) -> Optional[pd.DataFrame]:
+        """
+        Lädt eine einzelne Dimension (z.B. 'positions') einer gespeicherten Analyse
+        
+        Dekodiert nur den Snapshot dieser Dimension; alte Analysen werden aus dem JSON gelesen.
+        
+        Returns:
+            DataFrame oder None wenn Analyse/Dimension nicht vorhanden
+        """
+        with self.connection() as conn:
+            row = conn.execute("""
+                SELECT snapshot_id FROM analysis_snapshots
+                WHERE analysis_id = ? AND dimension = ?
+            """, (analysis_id, dimension)).fetchone()
+            if row is not None:
+                return self._load_frame(conn, row[0])
+            
+            legacy = self._load_legacy_risk_data(conn, analysis_id)
+        
+        if legacy is None or not isinstance(legacy.get(dimension), list):
+            return None
+        return pd.DataFrame(legacy[dimension])
+    
+    def get_analysis(self, analysis_id: int) -> Optional[Dict]:
+        """
+        Lädt die vollständigen Risk-Daten einer gespeicherten Analyse
+        
+        Returns:
+            Dict wie von calculate_cluster_risks (DataFrames + übrige Werte) oder None
+        """
+        with self.connection() as conn:
+            risk_data = self._load_legacy_risk_data(conn, analysis_id)
+            if risk_data is None:
+                return None
+            snapshots = conn.execute("""
+                SELECT dimension, snapshot_id FROM analysis_snapshots
+                WHERE analysis_id = ?
+            """, (analysis_id,)).fetchall()
+            
+            if snapshots:
+                for dimension, snapshot_id in snapshots:
+                    risk_data[dimension] = self._load_frame(conn, snapshot_id)
+                return risk_data
+        
+        # Altes Format: DataFrames als Record-Listen im JSON
+        for dimension in LABEL_COLUMNS:
+            if isinstance(risk_data.get(dimension), list):
+                risk_data[dimension] = pd.DataFrame(risk_data[dimension])
+        return risk_data
+    
+    @staticmethod
+    def _load_legacy_risk_data(conn: sqlite3.Connection, analysis_id: int) -> Optional[Dict]:
+        """JSON-Spalte risk_data einer Analyse (bei neuen Analysen nur Nicht-DataFrame-Werte)"""
+        row = conn.execute("SELECT risk_data FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
     
     def get_all_analyses(self) -> pd.DataFrame:
         """
@@ -88,7 +569,7 @@ class HistoryDatabase:
         Returns:
             DataFrame mit Analyse-Übersicht
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             query = """
                 SELECT 
                     id,
@@ -124,17 +605,53 @@ class HistoryDatabase:
             
             return df
     
-    def get_timeline_data(self, category: str = 'total_value') -> pd.DataFrame:
+    def delete_analyses(self, analysis_ids: Iterable[int]) -> int:
+        """
+        Löscht mehrere Analysen in einer Transaktion
+        
+        Returns:
+            Anzahl gelöschter Analysen
+        """
+        ids = [(int(analysis_id),) for analysis_id in analysis_ids]
+        if not ids:
+            return 0
+        with self.connection() as conn:
+            # rowcount summiert über alle IDs (ohne die per Trigger gelöschten Detailzeilen)
+            cursor = conn.executemany("DELETE FROM analyses WHERE id = ?", ids)
+            deleted = cursor.rowcount
+            self._collect_garbage(conn)
+        return deleted
+    
+    def clear(self):
+        """Löscht alle Analysen"""
+        with self.connection() as conn:
+            conn.execute("DELETE FROM analyses")
+            self._collect_garbage(conn)
+    
+    def vacuum(self):
+        """Gibt gelöschten Speicherplatz frei (außerhalb einer Transaktion)"""
+        conn = self.connection()
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    def get_timeline_data(self, category: str = 'total_value', dimension: str = 'positions') -> pd.DataFrame:
         """
         Holt Zeitreihen-Daten für Verlaufsdiagramme
         
         Args:
-            category: 'total_value' oder spezifische Position
+            category: 'total_value' oder Label einer Dimension, z.B. Position "Apple Inc"
+                      (inkl. Durchschau aller ETFs) oder Sektor "Technology"
+            dimension: Dimension des Labels ('positions', 'sector', 'currency', ...)
         
         Returns:
-            DataFrame mit Zeitreihen
+            DataFrame mit Zeitreihen (timestamp, value; für Labels zusätzlich pct).
+            Analysen ohne das Label erscheinen mit 0.
+        
+        Das Label wird über den Schlüssel seines neuesten Vorkommens gesucht (bei Positionen
+        die ISIN). Zeilen älterer Snapshots ohne ISIN zählen nur bei gleichem Label.
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             if category == 'total_value':
                 query = """
                     SELECT timestamp, total_value as value
@@ -143,13 +660,74 @@ class HistoryDatabase:
                 """
                 df = pd.read_sql_query(query, conn)
             else:
-                # TODO: Implementiere für spezifische Positionen
-                df = pd.DataFrame()
+                key = self._category_key(conn, dimension, category)
+                name_key = label_key(dimension, category)
+                # Index-Lookup (snapshot_id, label_key) je Analyse statt JSON-Scan
+                query = """
+                    SELECT
+                        a.timestamp,
+                        COALESCE(SUM(v.value), 0) AS value,
+                        COALESCE(SUM(v.pct), 0) AS pct
+                    FROM analyses a
+                    LEFT JOIN analysis_snapshots s
+                        ON s.analysis_id = a.id AND s.dimension = ?
+                    LEFT JOIN risk_values v
+                        ON v.snapshot_id = s.snapshot_id
+                       AND (v.label_key = ? OR (v.label_key = ? AND v.label = ?))
+                    GROUP BY a.id
+                    ORDER BY a.timestamp, a.id
+                """
+                df = pd.read_sql_query(query, conn, params=(dimension, key, name_key, category))
             
             if not df.empty:
                 df['timestamp'] = pd.to_datetime(df['timestamp'])
             
             return df
+    
+    @staticmethod
+    def _category_key(conn: sqlite3.Connection, dimension: str, category: str) -> str:
+        """label_key des neuesten Vorkommens eines Labels (Fallback: label_key ohne ISIN)"""
+        row = conn.execute("""
+            SELECT v.label_key
+            FROM risk_values v
+            JOIN analysis_snapshots s ON s.snapshot_id = v.snapshot_id
+            WHERE s.dimension = ? AND v.label = ?
+            ORDER BY s.analysis_id DESC
+            LIMIT 1
+        """, (dimension, category)).fetchone()
+        return row[0] if row is not None else label_key(dimension, category)
+    
+    def get_timeline_labels(self, dimension: str = 'positions') -> List[str]:
+        """
+        Labels einer Dimension aus der Historie (für Auswahllisten)
+        
+        Returns:
+            Anzeigenamen, nach Anteil in der neuesten Analyse mit dem Label absteigend;
+            je Schlüssel (bei Positionen die ISIN) und je Anzeigename nur einmal
+        """
+        with self.connection() as conn:
+            # Jeder Snapshot einmal, nach seiner neuesten Analyse sortiert
+            rows = conn.execute("""
+                SELECT v.label, v.label_key
+                FROM (
+                    SELECT s.snapshot_id, MAX(a.timestamp) AS last_timestamp, MAX(a.id) AS last_id
+                    FROM analysis_snapshots s
+                    JOIN analyses a ON a.id = s.analysis_id
+                    WHERE s.dimension = ?
+                    GROUP BY s.snapshot_id
+                ) d
+                JOIN risk_values v ON v.snapshot_id = d.snapshot_id
+                ORDER BY d.last_timestamp DESC, d.last_id DESC, v.pct DESC
+            """, (dimension,)).fetchall()
+        
+        labels = {}
+        seen = set()
+        for label, key in rows:
+            if key in labels or label in seen:
+                continue
+            labels[key] = label
+            seen.add(label)
+        return list(labels.values())
 
 
 # Globale Datenbank-Instanz
@@ -160,7 +738,41 @@ def save_to_history(portfolio_data: Dict, risk_data: Dict):
     """
     Convenience-Funktion zum Speichern in der Historie
     """
-    _db.save_analysis(portfolio_data, risk_data)
+    return _db.save_analysis(portfolio_data, risk_data)
+
+
+def get_history_snapshot(analysis_id: int, dimension: Optional[str] = None):
+    """
+    Convenience-Funktion zum Laden einer gespeicherten Analyse
+    
+    Args:
+        analysis_id: ID der Analyse
+        dimension: Nur diese Dimension laden (z.B. 'sector'); None = alle Risk-Daten
+    """
+    if dimension is None:
+        return _db.get_analysis(analysis_id)
+    return _db.get_analysis_dimension(analysis_id, dimension)
+
+
+def backfill_history_rollups() -> int:
+    """
+    Convenience-Funktion: Rollups für bestehende Analysen neu berechnen
+    """
+    return _db.backfill_rollups()
+
+
+def get_history_timeline(category: str = 'total_value', dimension: str = 'positions') -> pd.DataFrame:
+    """
+    Convenience-Funktion: Verlauf des Gesamtwerts oder eines Labels (siehe get_timeline_data)
+    """
+    return _db.get_timeline_data(category, dimension)
+
+
+def get_history_timeline_labels(dimension: str = 'positions') -> List[str]:
+    """
+    Convenience-Funktion: Labels einer Dimension für die Verlaufs-Auswahl
+    """
+    return _db.get_timeline_labels(dimension)
 
 
 def get_history() -> pd.DataFrame:
@@ -170,96 +782,69 @@ def get_history() -> pd.DataFrame:
     return _db.get_all_analyses()
 
 
-def get_history_timeseries() -> Optional[Dict]:
+def get_history_timeseries(resolution: Optional[str] = None, max_points: int = 200) -> Optional[Dict]:
     """
     Lädt alle Historie-Einträge und extrahiert strukturierte Zeitreihen-Daten
     für Charts (Portfolio-Wert, Anlageklassen, Währungen, Top-5-Konzentration).
     
+    Liest die beim Speichern berechneten Rollups (history_rollups): Währungen Top 4,
+    Sektoren Top 5 (+ "Sonstige"), Top-5-Konzentration. Spaltenreihenfolge wie bisher:
+    Währungen/Sektoren nach Rang, Anlageklassen in gespeicherter Reihenfolge.
+    
+    Args:
+        resolution: None = jede Analyse, 'day'/'week'/'month' = letzte Analyse je Periode,
+                    'auto' = feinste Auflösung mit höchstens max_points Punkten
+        max_points: Obergrenze für 'auto'
+    
     Returns:
         Dict mit Zeitreihen-DataFrames oder None wenn < 2 Einträge
     """
     try:
-        with sqlite3.connect(_db.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT timestamp, total_value, risk_data
+        with _db.connection() as conn:
+            analyses = pd.read_sql_query("""
+                SELECT id, timestamp, total_value
                 FROM analyses
-                ORDER BY timestamp ASC
-            """)
-            rows = cursor.fetchall()
-        
-        if len(rows) < 2:
-            return None
-        
-        # Datenstrukturen vorbereiten
-        timestamps = []
-        total_values = []
-        top5_concentrations = []
-        asset_class_rows = []
-        currency_rows = []
-        sector_rows = []
-        
-        for timestamp_str, total_value, risk_data_json in rows:
-            timestamp = pd.to_datetime(timestamp_str)
-            timestamps.append(timestamp)
-            total_values.append(total_value)
-            
-            risk_data = json.loads(risk_data_json)
+                ORDER BY timestamp ASC, id ASC
+            """, conn)
             
-            # Top-5 Konzentration aus positions
-            positions = risk_data.get('positions', [])
-            # Sortiere nach Anteil (%) absteigend
-            positions_sorted = sorted(positions, key=lambda x: x.get('Anteil (%)', 0), reverse=True)
-            top5_sum = sum(p.get('Anteil (%)', 0) for p in positions_sorted[:5])
-            top5_concentrations.append(top5_sum)
+            if len(analyses) < 2:
+                return None
             
-            # Anlageklassen
-            asset_row = {'timestamp': timestamp}
-            for entry in risk_data.get('asset_class', []):
-                name = entry.get('Anlageklasse', 'Unknown')
-                asset_row[name] = entry.get('Anteil (%)', 0)
-            asset_class_rows.append(asset_row)
+            analyses = _downsample(analyses, resolution, max_points)
             
-            # Währungen (Top 4 + Sonstige)
-            currency_entries = risk_data.get('currency', [])
-            currency_sorted = sorted(currency_entries, key=lambda x: x.get('Anteil (%)', 0), reverse=True)
-            currency_row = {'timestamp': timestamp}
-            for i, entry in enumerate(currency_sorted):
-                name = entry.get('Währung', 'Unknown')
-                if i < 4:
-                    currency_row[name] = entry.get('Anteil (%)', 0)
-                else:
-                    currency_row['Sonstige'] = currency_row.get('Sonstige', 0) + entry.get('Anteil (%)', 0)
-            currency_rows.append(currency_row)
-            
-            # Sektoren (Top 5 + Sonstige)
-            sector_entries = risk_data.get('sector', [])
-            sector_sorted = sorted(sector_entries, key=lambda x: x.get('Anteil (%)', 0), reverse=True)
-            sector_row = {'timestamp': timestamp}
-            for i, entry in enumerate(sector_sorted):
-                name = entry.get('Sektor', 'Unknown')
-                if i < 5:
-                    sector_row[name] = entry.get('Anteil (%)', 0)
-                else:
-                    sector_row['Sonstige'] = sector_row.get('Sonstige', 0) + entry.get('Anteil (%)', 0)
-            sector_rows.append(sector_row)
+            values = pd.read_sql_query("""
+                SELECT s.analysis_id, s.dimension, r.bucket, r.pct
+                FROM analyses a
+                JOIN analysis_snapshots s ON s.analysis_id = a.id
+                JOIN history_rollups r ON r.snapshot_id = s.snapshot_id
+                WHERE s.dimension IN ('asset_class', 'currency', 'sector', 'positions')
+                ORDER BY a.timestamp ASC, a.id, s.dimension, r.column_order
+            """, conn)
+        
+        values = values[values['analysis_id'].isin(analyses['id'])]
+        timestamps = pd.to_datetime(analyses['timestamp'])
         
-        # DataFrames erstellen
+        # Top-5 Konzentration aus positions
+        top5 = values[values['dimension'] == 'positions'].set_index('analysis_id')['pct']
         portfolio_df = pd.DataFrame({
-            'timestamp': timestamps,
-            'Gesamt-Wert (€)': total_values,
-            'Top-5 Konzentration (%)': top5_concentrations
+            'timestamp': timestamps.to_numpy(),
+            'Gesamt-Wert (€)': analyses['total_value'].to_numpy(),
+            'Top-5 Konzentration (%)': analyses['id'].map(top5).fillna(0).to_numpy()
         })
         
-        asset_class_df = pd.DataFrame(asset_class_rows).fillna(0)
-        currency_df = pd.DataFrame(currency_rows).fillna(0)
-        sector_df = pd.DataFrame(sector_rows).fillna(0)
+        def _pivot(dimension: str) -> pd.DataFrame:
+            """Breites Format: eine Zeile pro Analyse, eine Spalte pro Label (Reihenfolge des Auftretens)"""
+            dim = values[values['dimension'] == dimension]
+            wide = dim.pivot(index='analysis_id', columns='bucket', values='pct')
+            wide = wide.reindex(index=analyses['id'], columns=pd.unique(dim['bucket']))
+            wide.insert(0, 'timestamp', timestamps.to_numpy())
+            return wide.reset_index(drop=True).rename_axis(columns=None).fillna(0)
         
         return {
             'portfolio': portfolio_df,
-            'asset_class': asset_class_df,
-            'currency': currency_df,
-            'sector': sector_df
+            'asset_class': _pivot('asset_class'),
+            'currency': _pivot('currency'),
+            'sector': _pivot('sector')
         }
     
     except Exception as e:
@@ -267,6 +852,29 @@ def get_history_timeseries() -> Optional[Dict]:
         return None
 
 
+def _downsample(analyses: pd.DataFrame, resolution: Optional[str], max_points: int) -> pd.DataFrame:
+    """Reduziert auf die letzte Analyse je Tag/Woche/Monat (analyses nach Zeit sortiert)"""
+    if resolution is None:
+        return analyses
+    
+    if resolution == 'auto':
+        if len(analyses) <= max_points:
+            return analyses
+        candidates = list(RESOLUTIONS)
+    elif resolution in RESOLUTIONS:
+        candidates = [resolution]
+    else:
+        raise ValueError(f"Unbekannte Auflösung: {resolution}")
+    
+    timestamps = pd.to_datetime(analyses['timestamp'])
+    for name in candidates:
+        periods = timestamps.dt.to_period(RESOLUTIONS[name])
+        sampled = analyses[~periods.duplicated(keep='last')]
+        if len(sampled) <= max_points or resolution != 'auto':
+            break
+    return sampled.reset_index(drop=True)
+
+
 def delete_analysis(analysis_id: int) -> bool:
     """
     Löscht eine Analyse aus der Historie
@@ -277,15 +885,24 @@ def delete_analysis(analysis_id: int) -> bool:
     Returns:
         True wenn erfolgreich gelöscht, False sonst
     """
+    return delete_analyses([analysis_id]) > 0
+
+
+def delete_analyses(analysis_ids: Iterable[int]) -> int:
+    """
+    Löscht mehrere Analysen aus der Historie (eine Transaktion)
+    
+    Args:
+        analysis_ids: IDs der zu löschenden Analysen
+        
+    Returns:
+        Anzahl gelöschter Analysen (0 bei Fehler)
+    """
     try:
-        with sqlite3.connect(_db.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM analyses WHERE id = ?", (analysis_id,))
-            conn.commit()
-            return cursor.rowcount > 0
+        return _db.delete_analyses(analysis_ids)
     except Exception as e:
-        print(f"Fehler beim Löschen der Analyse {analysis_id}: {e}")
-        return False
+        print(f"Fehler beim Löschen der Analysen: {e}")
+        return 0
 
 
 def clear_all_history() -> bool:
@@ -296,14 +913,10 @@ def clear_all_history() -> bool:
         True wenn erfolgreich, False sonst
     """
     try:
-        with sqlite3.connect(_db.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM analyses")
-            conn.commit()
-            # VACUUM um Speicherplatz freizugeben
-            cursor.execute("VACUUM")
-            conn.commit()
-            return True
+        _db.clear()
+        # VACUUM um Speicherplatz freizugeben
+        _db.vacuum()
+        return True
     except Exception as e:
         print(f"Fehler beim Löschen aller Analysen: {e}")
         return False
@@ -317,11 +930,8 @@ def vacuum_database() -> bool:
         True wenn erfolgreich, False sonst
     """
     try:
-        with sqlite3.connect(_db.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("VACUUM")
-            conn.commit()
-            return True
+        _db.vacuum()
+        return True
     except Exception as e:
         print(f"Fehler beim VACUUM: {e}")
         return False
@@ -10,6 +10,28 @@ import yfinance as yf
 from pathlib import Path
 import json
 from datetime import datetime
+from .openfigi_client import get_openfigi_client
+
+
+# Bekannte Mappings (manuell gepflegt für häufige ETFs)
+_KNOWN_ISIN_TICKERS = {
+    # iShares
+    'IE00B4L5Y983': 'EUNL.DE',  # iShares Core MSCI World UCITS ETF
+    'IE00B4L5YC18': 'EIMI.DE',  # iShares MSCI Emerging Markets
+    'IE00B3RBWM25': 'VWRL.L',   # Vanguard FTSE All-World
+    'IE00BK5BQT80': 'VWCE.DE',  # Vanguard FTSE All-World (Acc)
+    'IE00B8GKDB10': 'VHYL.L',   # Vanguard FTSE All-World High Dividend Yield
+    'IE00B4X9L533': 'HMWO.DE',  # HSBC MSCI World
+    'IE00BZ56RG20': 'XDWD.DE',  # Xtrackers MSCI World
+    'LU1681045370': 'GERD.DE',  # Amundi MSCI Germany
+    'LU0274208692': 'DBXD.DE',  # Xtrackers DAX UCITS ETF
+    'IE00B4L5YX21': 'IQQH.DE',  # iShares MSCI Japan
+    'LU0328475792': 'DBXJ.DE',  # Xtrackers MSCI Japan
+    'IE00B14X4M10': 'EUNA.DE',  # iShares MSCI North America
+    'IE00B53SZB19': 'CSNDX.L',  # iShares NASDAQ 100
+    'IE00B3XXRP09': 'VUSA.L',   # Vanguard S&P 500
+    'IE00B5BMR087': 'CSPX.L',   # iShares Core S&P 500
+}
 
 
 class ETFDataFetcher:
@@ -200,59 +222,44 @@ class ETFDataFetcher:
         """
         Konvertiert ISIN zu Yahoo Finance Ticker
         """
-        # Bekannte Mappings (manuell gepflegt für häufige ETFs)
-        isin_to_ticker_map = {
-            # iShares
-            'IE00B4L5Y983': 'EUNL.DE',  # iShares Core MSCI World UCITS ETF
-            'IE00B4L5YC18': 'EIMI.DE',  # iShares MSCI Emerging Markets
-            'IE00B3RBWM25': 'VWRL.L',   # Vanguard FTSE All-World
-            'IE00BK5BQT80': 'VWCE.DE',  # Vanguard FTSE All-World (Acc)
-            'IE00B8GKDB10': 'VHYL.L',   # Vanguard FTSE All-World High Dividend Yield
-            'IE00B4X9L533': 'HMWO.DE',  # HSBC MSCI World
-            'IE00BZ56RG20': 'XDWD.DE',  # Xtrackers MSCI World
-            'LU1681045370': 'GERD.DE',  # Amundi MSCI Germany
-            'LU0274208692': 'DBXD.DE',  # Xtrackers DAX UCITS ETF
-            'IE00B4L5YX21': 'IQQH.DE',  # iShares MSCI Japan
-            'LU0328475792': 'DBXJ.DE',  # Xtrackers MSCI Japan
-            'IE00B14X4M10': 'EUNA.DE',  # iShares MSCI North America
-            'IE00B53SZB19': 'CSNDX.L',  # iShares NASDAQ 100
-            'IE00B3XXRP09': 'VUSA.L',   # Vanguard S&P 500
-            'IE00B5BMR087': 'CSPX.L',   # iShares Core S&P 500
-        }
-        
         # 1. Prüfe ob in Map
-        if isin in isin_to_ticker_map:
-            return isin_to_ticker_map[isin]
+        if isin in _KNOWN_ISIN_TICKERS:
+            return _KNOWN_ISIN_TICKERS[isin]
         
         # 2. Versuche OpenFIGI API (kostenlos, offiziell für ISIN→Ticker Mapping)
-        try:
-            openfigi_url = "https://api.openfigi.com/v3/mapping"
-            headers = {'Content-Type': 'application/json'}
-            payload = [{"idType": "ID_ISIN", "idValue": isin}]
+        #    Gebündelter Client: nach prefetch_isin_tickers() meist ein Cache-Treffer
+        figi_data = get_openfigi_client().map_job({"idType": "ID_ISIN", "idValue": isin})
+        if figi_data is None:
+            print(f"  OpenFIGI lookup failed for {isin}")
+        for item in figi_data or []:
+            # Suche nach Yahoo Finance kompatiblen Tickern
+            ticker = item.get('ticker')
+            exchange = item.get('exchCode')
             
-            response = requests.post(openfigi_url, json=payload, headers=headers, timeout=5)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data and len(data) > 0 and 'data' in data[0]:
-                    for item in data[0]['data']:
-                        # Suche nach Yahoo Finance kompatiblen Tickern
-                        ticker = item.get('ticker')
-                        exchange = item.get('exchCode')
-                        
-                        if ticker and exchange:
-                            # Konvertiere Exchange zu Yahoo-Suffix
-                            yahoo_suffix = self._exchange_to_yahoo_suffix(exchange)
-                            if yahoo_suffix:
-                                yahoo_ticker = f"{ticker}.{yahoo_suffix}" if yahoo_suffix else ticker
-                                print(f"  ✅ Found via OpenFIGI: {isin} → {yahoo_ticker}")
-                                return yahoo_ticker
-        except Exception as e:
-            print(f"  OpenFIGI lookup failed: {str(e)}")
+            if ticker and exchange:
+                # Konvertiere Exchange zu Yahoo-Suffix
+                yahoo_suffix = self._exchange_to_yahoo_suffix(exchange)
+                if yahoo_suffix:
+                    yahoo_ticker = f"{ticker}.{yahoo_suffix}" if yahoo_suffix else ticker
+                    print(f"  ✅ Found via OpenFIGI: {isin} → {yahoo_ticker}")
+                    return yahoo_ticker
         
         print(f"  ⚠️  No ticker found for ISIN {isin} - add to manual mapping")
         return None
     
+    def prefetch_isin_tickers(self, isins: List[str]):
+        """
+        Löst ISIN→Ticker für mehrere ETFs vorab gebündelt über OpenFIGI auf
+        (eine Anfrage pro 100 ISINs); spätere _isin_to_ticker()-Aufrufe nutzen den Cache.
+        """
+        jobs = [
+            {"idType": "ID_ISIN", "idValue": isin}
+            for isin in dict.fromkeys(isins)
+            if isin and isin not in _KNOWN_ISIN_TICKERS
+        ]
+        if jobs:
+            get_openfigi_client().map_jobs(jobs)
+    
     def _exchange_to_yahoo_suffix(self, exchange_code: str) -> Optional[str]:
         """
         Konvertiert Exchange-Codes zu Yahoo Finance Suffixen
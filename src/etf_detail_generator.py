@@ -8,13 +8,24 @@ from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 import re
 import csv
+import time
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from .diagnostics import get_diagnostics
 from .etf_currency_mapping import COUNTRY_TO_CURRENCY, derive_currency_allocation as _derive_currency_allocation
-from .etf_details_parser import ETFDetailsParser
+from .etf_details_parser import get_metadata_index, read_etf_metadata
 from .etf_detail_writer import save_etf_detail_file
+from .morningstar_fetcher import get_etf_details_from_morningstar
+from .refresh_engine import TransientRefreshError, backoff_delay, get_rate_limiter, run_jobs
+
+
+def _is_transient_request_error(error: requests.exceptions.RequestException) -> bool:
+    """Verbindungsfehler, Timeouts, HTTP 429 und 5xx – ein späterer Versuch kann gelingen"""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    status = getattr(error.response, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
 
 
 class JustETFScraper:
@@ -35,6 +46,26 @@ class JustETFScraper:
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.9,de;q=0.8',
         })
+        self.rate_limiter = get_rate_limiter('justetf')
+        # Scheiterte der letzte fetch_etf_data-Aufruf an einem vorübergehenden Netzwerkfehler?
+        self.last_error_transient = False
+    
+    def _get(self, url: str, headers: Optional[Dict] = None, timeout: int = 15,
+             max_retries: int = 2) -> requests.Response:
+        """GET mit Token-Bucket (justETF) und Wiederholung mit Jitter bei Verbindungsfehlern, 429 und 5xx"""
+        for attempt in range(max_retries + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=timeout)
+            except requests.exceptions.RequestException:
+                if attempt == max_retries:
+                    raise
+                continue
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < max_retries:
+                continue
+            return response
     
     def fetch_etf_data(self, isin: str) -> Optional[Dict]:
         """
@@ -46,10 +77,11 @@ class JustETFScraper:
         Returns:
             Dict mit name, metadata, holdings, countries, sectors oder None
         """
+        self.last_error_transient = False
         try:
             # Hauptseite laden (setzt Cookies für AJAX-Calls)
             url = f"{self.BASE_URL}?isin={isin}"
-            response = self.session.get(url, timeout=15)
+            response = self._get(url, timeout=15)
             response.raise_for_status()
             
             soup = BeautifulSoup(response.content, 'html.parser')
@@ -100,6 +132,7 @@ class JustETFScraper:
             
         except requests.exceptions.RequestException as e:
             print(f"  justETF: Netzwerkfehler für {isin}: {e}")
+            self.last_error_transient = _is_transient_request_error(e)
             return None
         except Exception as e:
             print(f"  justETF: Fehler beim Parsen für {isin}: {e}")
@@ -291,7 +324,7 @@ class JustETFScraper:
                 'Referer': f'{self.BASE_URL}?isin={isin}',
             }
             
-            response = self.session.get(url, headers=headers, timeout=10)
+            response = self._get(url, headers=headers, timeout=10)
             
             if response.status_code != 200:
                 return None
@@ -327,7 +360,7 @@ class JustETFScraper:
                 'Referer': f'{self.BASE_URL}?isin={isin}',
             }
             
-            response = self.session.get(url, headers=headers, timeout=10)
+            response = self._get(url, headers=headers, timeout=10)
             
             if response.status_code != 200:
                 return None
@@ -436,7 +469,8 @@ def generate_etf_detail_file(
     etf_type: str = 'Stock',
     region: str = '',
     proxy_isin: str = '',
-    output_dir: str = 'data/etf_details'
+    output_dir: str = 'data/etf_details',
+    raise_transient: bool = False
 ) -> Tuple[bool, str, Optional[Dict]]:
     """
     Generiert eine ETF-Detail-CSV-Datei durch Scraping von justETF.
@@ -452,6 +486,9 @@ def generate_etf_detail_file(
         region: Region (z.B. "World", "USA", "Europe")
         proxy_isin: Proxy-ISIN für Swap-ETFs (physischer ETF auf denselben Index)
         output_dir: Ausgabeverzeichnis
+        raise_transient: Bei vorübergehenden Netzwerkfehlern (429, 5xx, Timeout)
+                         TransientRefreshError werfen statt (False, ...) zu liefern,
+                         damit die Refresh-Engine den Job wiederholt
         
     Returns:
         Tuple von (Erfolg, Statusmeldung, gescrapte Daten)
@@ -476,6 +513,8 @@ def generate_etf_detail_file(
     
     if not own_data:
         msg = f"Keine Daten von justETF für ISIN {isin} erhalten"
+        if raise_transient and scraper.last_error_transient:
+            raise TransientRefreshError(msg)
         diagnostics.add_warning('ETF-Daten', msg, 
             'Mögliche Ursachen: ISIN ungültig oder justETF nicht erreichbar.')
         return False, msg, None
@@ -528,6 +567,8 @@ def generate_etf_detail_file(
         
         if not proxy_data:
             msg = f"Keine Daten von justETF für Proxy-ISIN {scrape_isin} erhalten"
+            if raise_transient and scraper.last_error_transient:
+                raise TransientRefreshError(msg)
             diagnostics.add_warning('ETF-Daten', msg,
                 'Die Proxy-ISIN konnte nicht aufgelöst werden. Prüfe die ISIN.')
             return False, msg, own_data
@@ -772,6 +813,9 @@ def get_etf_detail_status(etf_details_dir: str = 'data/etf_details') -> List[Dic
     """
     Listet alle vorhandenen ETF-Detail-Dateien mit ihrem Aktualitätsstatus.
     
+    Liest nur die Metadaten über den On-Disk-Index (get_metadata_index): unveränderte
+    Dateien kosten ein stat(), geänderte nur den Metadaten-Block.
+    
     Returns:
         Liste von Dicts mit: ticker, isin, name, type, last_updated, days_old, is_stale
     """
@@ -779,67 +823,18 @@ def get_etf_detail_status(etf_details_dir: str = 'data/etf_details') -> List[Dic
     if not details_path.exists():
         return []
     
+    index = get_metadata_index(etf_details_dir)
+    metadata_by_ticker = index.scan()
     results = []
     
-    for csv_file in sorted(details_path.glob('*.csv')):
-        ticker = csv_file.stem
+    for ticker in sorted(set(metadata_by_ticker) | set(index.errors)):
+        csv_file = details_path / f"{ticker}.csv"
         
-        try:
-            parser = ETFDetailsParser(etf_details_dir=etf_details_dir)
-            etf = parser.parse_etf_file(ticker)
-            if etf is None:
-                raise ValueError(f"ETFDetailsParser konnte {ticker}.csv nicht lesen")
-
-            meta = etf.get('metadata', {})
-            isin = meta.get('isin', '')
-            name = meta.get('name', '')
-            etf_type = meta.get('type', 'Stock')
-            index_name = meta.get('index', '')
-            region = meta.get('region', '')
-            last_updated = meta.get('last_updated', '')
-            source = meta.get('source', '')
-            proxy_isin = meta.get('proxy_isin', '')
-
-            # Source bestimmen: auto, proxy, manual
-            if proxy_isin:
-                data_source = 'proxy'
-            elif source and ('auto' in source.lower() or 'justetf' in source.lower()):
-                data_source = 'auto'
-            else:
-                data_source = 'manual'
-
-            # Alter berechnen
-            days_old = None
-            is_stale = False
-            if last_updated:
-                try:
-                    updated_date = datetime.strptime(last_updated, '%Y-%m-%d')
-                    days_old = (datetime.now() - updated_date).days
-                    is_stale = days_old > 30
-                except ValueError:
-                    pass
-
-            results.append({
-                'ticker': ticker,
-                'isin': isin,
-                'name': name,
-                'type': etf_type,
-                'index': index_name,
-                'region': region,
-                'last_updated': last_updated,
-                'days_old': days_old,
-                'is_stale': is_stale,
-                'source': source,
-                'data_source': data_source,
-                'proxy_isin': proxy_isin,
-                'file': str(csv_file),
-            })
-            
-        except Exception as e:
+        if ticker in index.errors:
             results.append({
                 'ticker': ticker,
                 'isin': '',
-                'name': f'Fehler: {e}',
+                'name': f'Fehler: {index.errors[ticker]}',
                 'type': '',
                 'region': '',
                 'last_updated': '',
@@ -847,20 +842,70 @@ def get_etf_detail_status(etf_details_dir: str = 'data/etf_details') -> List[Dic
                 'is_stale': True,
                 'file': str(csv_file),
             })
+            continue
+        
+        meta = metadata_by_ticker[ticker]
+        isin = meta.get('ISIN', '')
+        name = meta.get('Name', '')
+        etf_type = meta.get('Type', 'Stock')
+        index_name = meta.get('Index', '')
+        region = meta.get('Region', '')
+        last_updated = meta.get('Last Updated', '')
+        source = meta.get('Source', '')
+        proxy_isin = meta.get('Proxy ISIN', '')
+
+        # Source bestimmen: auto, proxy, manual
+        if proxy_isin:
+            data_source = 'proxy'
+        elif source and ('auto' in source.lower() or 'justetf' in source.lower()):
+            data_source = 'auto'
+        else:
+            data_source = 'manual'
+
+        # Alter berechnen
+        days_old = None
+        is_stale = False
+        if last_updated:
+            try:
+                updated_date = datetime.strptime(last_updated, '%Y-%m-%d')
+                days_old = (datetime.now() - updated_date).days
+                is_stale = days_old > 30
+            except ValueError:
+                pass
+
+        results.append({
+            'ticker': ticker,
+            'isin': isin,
+            'name': name,
+            'type': etf_type,
+            'index': index_name,
+            'region': region,
+            'last_updated': last_updated,
+            'days_old': days_old,
+            'is_stale': is_stale,
+            'source': source,
+            'data_source': data_source,
+            'proxy_isin': proxy_isin,
+            'file': str(csv_file),
+        })
     
     return results
 
 
-def update_etf_detail_file(ticker: str, etf_details_dir: str = 'data/etf_details') -> Tuple[bool, str]:
+def update_etf_detail_file(ticker: str, etf_details_dir: str = 'data/etf_details',
+                           raise_transient: bool = False) -> Tuple[bool, str]:
     """
     Aktualisiert eine bestehende ETF-Detail-Datei durch erneutes Scraping.
     Übernimmt ISIN, Typ, Region und Proxy-ISIN aus der bestehenden Datei.
     
     Manuelle Dateien (Source ohne 'justETF'/'auto') werden NICHT aktualisiert.
+    Von Morningstar stammende Dateien werden wieder über Morningstar geholt
+    (justETF-Scraping als Fallback), alle übrigen über justETF.
     
     Args:
         ticker: Ticker-Symbol der zu aktualisierenden Datei
         etf_details_dir: Verzeichnis der Detail-Dateien
+        raise_transient: Siehe generate_etf_detail_file
         
     Returns:
         Tuple von (Erfolg, Statusmeldung)
@@ -871,16 +916,13 @@ def update_etf_detail_file(ticker: str, etf_details_dir: str = 'data/etf_details
         return False, f"Datei {filepath} existiert nicht"
     
     try:
-        parser = ETFDetailsParser(etf_details_dir=etf_details_dir)
-        etf = parser.parse_etf_file(ticker)
-        if etf is None:
-            return False, f"ETFDetailsParser konnte {ticker}.csv nicht lesen"
-        meta = etf.get('metadata', {})
-        isin = meta.get('isin', '')
-        etf_type = meta.get('type', 'Stock')
-        region = meta.get('region', '')
-        source = meta.get('source', '')
-        proxy_isin = meta.get('proxy_isin', '')
+        # Nur der Metadaten-Block wird benötigt
+        meta = read_etf_metadata(filepath)
+        isin = meta.get('ISIN', '')
+        etf_type = meta.get('Type', 'Stock')
+        region = meta.get('Region', '')
+        source = meta.get('Source', '')
+        proxy_isin = meta.get('Proxy ISIN', '')
         if not isin:
             return False, f"Keine ISIN in {filepath} gefunden"
         is_auto = source and ('auto' in source.lower() or 'justetf' in source.lower() or 'proxy' in source.lower())
@@ -889,6 +931,12 @@ def update_etf_detail_file(ticker: str, etf_details_dir: str = 'data/etf_details
     except Exception as e:
         return False, f"Fehler beim Lesen von {filepath}: {e}"
     
+    if 'morningstar' in source.lower() and not proxy_isin:
+        ms_details = get_etf_details_from_morningstar(isin)
+        if ms_details:
+            save_etf_detail_file(ms_details, ticker, source_label=source, etf_details_dir=etf_details_dir)
+            return True, f"ETF-Detail-Datei aktualisiert (Morningstar): {filepath}"
+    
     # Neu generieren mit bestehenden Metadaten
     success, msg, _ = generate_etf_detail_file(
         isin=isin,
@@ -896,7 +944,8 @@ def update_etf_detail_file(ticker: str, etf_details_dir: str = 'data/etf_details
         etf_type=etf_type,
         region=region,
         proxy_isin=proxy_isin,
-        output_dir=etf_details_dir
+        output_dir=etf_details_dir,
+        raise_transient=raise_transient
     )
     
     return success, msg
@@ -905,21 +954,24 @@ def update_etf_detail_file(ticker: str, etf_details_dir: str = 'data/etf_details
 def batch_update_etf_details(
     etf_details_dir: str = 'data/etf_details',
     only_stale: bool = True,
-    progress_callback=None
+    progress_callback=None,
+    max_concurrency: int = 4
 ) -> List[Dict]:
     """
     Aktualisiert mehrere ETF-Detail-Dateien auf einmal.
     
+    Die Dateien werden nebenläufig aktualisiert (refresh_engine). Das Tempo begrenzen
+    die Token-Buckets je Quelle (justETF, Morningstar), nicht feste Pausen.
+    
     Args:
         etf_details_dir: Verzeichnis der Detail-Dateien
         only_stale: Nur veraltete Dateien (>30 Tage) aktualisieren
-        progress_callback: Optional - Callback(current, total, ticker) für Fortschritt
+        progress_callback: Optional - Callback(done, total, ticker) nach jeder fertigen Datei
+        max_concurrency: Höchstzahl gleichzeitig aktualisierter Dateien
         
     Returns:
         Liste von Ergebnis-Dicts: {ticker, success, message}
     """
-    import time
-    
     status_list = get_etf_detail_status(etf_details_dir)
     
     # Manuelle Dateien aus Batch-Update ausschließen
@@ -933,27 +985,24 @@ def batch_update_etf_details(
     if not to_update:
         return []
     
-    results = []
+    def update(job: Dict) -> Dict:
+        # Vorübergehende Netzwerkfehler als Ausnahme → run_jobs wiederholt mit Backoff
+        success, msg = update_etf_detail_file(job['key'], etf_details_dir, raise_transient=True)
+        return {'success': success, 'message': msg}
     
-    for i, etf_info in enumerate(to_update):
-        ticker = etf_info['ticker']
-        
-        if progress_callback:
-            progress_callback(i, len(to_update), ticker)
-        
-        success, msg = update_etf_detail_file(ticker, etf_details_dir)
-        
-        results.append({
-            'ticker': ticker,
-            'name': etf_info['name'],
-            'success': success,
-            'message': msg
-        })
-        
-        # Rate Limiting: 2 Sekunden Pause zwischen Requests
-        if i < len(to_update) - 1:
-            time.sleep(2)
+    outcomes = run_jobs(
+        [{'key': etf_info['ticker']} for etf_info in to_update],
+        update,
+        max_concurrency=max_concurrency,
+        progress_callback=progress_callback
+    )
     
-    return results
-
-
+    return [
+        {
+            'ticker': etf_info['ticker'],
+            'name': etf_info['name'],
+            'success': outcome['success'],
+            'message': outcome['message']
+        }
+        for etf_info, outcome in zip(to_update, outcomes)
+    ]
@@ -0,0 +1,157 @@
+"""
+ETF Detail Sidecar
+Kompilierte Binärfassung einer ETF-Detail-CSV (<ticker>.csv.bin) für schnelles Laden
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .snapshot_codec import decode_columns, frame_payload
+
+# Aufbau: Magic, 4 Byte Header-Länge, JSON-Header, Tabellen (je ein frame_payload)
+_MAGIC = b'ETFD'
+_VERSION = 1
+_HEADER_LENGTH = struct.Struct('<I')
+
+SIDECAR_SUFFIX = '.bin'
+
+# Listen im geparsten ETF-Dict; name/weight immer vorhanden, übrige Schlüssel optional
+_TABLES = ('country_allocation', 'sector_allocation', 'currency_allocation', 'holdings')
+_REQUIRED_KEYS = ('name', 'weight')
+# Werden beim Laden gesetzt, nicht gespeichert
+_RUNTIME_KEYS = ('ticker', 'file')
+
+
+def sidecar_path(csv_path) -> Path:
+    """Pfad der Sidecar-Datei zu einer ETF-Detail-CSV"""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.name + SIDECAR_SUFFIX)
+
+
+def _table_frame(rows: List[Dict]) -> Tuple[pd.DataFrame, List[str]]:
+    """Liste von Dicts als DataFrame (+ optionale Schlüssel); fehlende optionale Schlüssel werden zu None"""
+    optional = []
+    for row in rows:
+        for key in row:
+            if key not in _REQUIRED_KEYS and key not in optional:
+                optional.append(key)
+    data = {
+        'name': pd.Series([row['name'] for row in rows], dtype=object),
+        'weight': pd.Series([row['weight'] for row in rows], dtype='float64'),
+    }
+    for key in optional:
+        data[key] = pd.Series([row.get(key) for row in rows], dtype=object)
+    return pd.DataFrame(data), optional
+
+
+def _table_rows(columns: Dict, optional: List[str], sparse: List[str]) -> List[Dict]:
+    """Gegenstück zu _table_frame; Schlüssel aus sparse werden bei None entfernt"""
+    keys = tuple(_REQUIRED_KEYS) + tuple(optional)
+    rows = [dict(zip(keys, values)) for values in zip(*(columns[key].tolist() for key in keys))]
+    for key in sparse:
+        for i in np.flatnonzero(columns[key] == None).tolist():  # noqa: E711 (elementweise)
+            del rows[i][key]
+    return rows
+
+
+def write_sidecar(csv_path, signature: Tuple[int, int], etf: Dict) -> Path:
+    """
+    Schreibt die Sidecar-Datei eines geparsten ETF-Dicts (siehe ETFDetailsParser)
+
+    Args:
+        csv_path: Pfad der zugehörigen CSV
+        signature: (mtime in ns, Größe) der CSV, aus der etf geparst wurde
+        etf: Geparstes ETF-Dict
+
+    Returns:
+        Pfad der Sidecar-Datei
+    """
+    path = sidecar_path(csv_path)
+    scalars = {
+        key: value for key, value in etf.items()
+        if key not in _TABLES and key not in _RUNTIME_KEYS
+    }
+    tables = {}
+    payloads = []
+    offset = 0
+    for name in _TABLES:
+        df, optional = _table_frame(etf.get(name) or [])
+        payload = frame_payload(df)
+        sparse = [key for key in optional if df[key].isna().any()]
+        tables[name] = {'offset': offset, 'nbytes': len(payload), 'optional': optional, 'sparse': sparse}
+        payloads.append(payload)
+        offset += len(payload)
+
+    header = json.dumps({
+        'version': _VERSION,
+        'signature': list(signature),
+        'scalars': scalars,
+        'tables': tables,
+    }, ensure_ascii=False).encode('utf-8')
+
+    # Eindeutiger Temp-Name: parallele Schreiber überschreiben sich nicht gegenseitig
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for payload in payloads:
+                f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def read_sidecar(csv_path, signature: Tuple[int, int]) -> Optional[Dict]:
+    """
+    Lädt ein ETF-Dict aus der Sidecar-Datei (memory-mapped)
+
+    Returns:
+        ETF-Dict ohne 'ticker'/'file' oder None, wenn keine gültige Sidecar-Datei zur
+        aktuellen CSV-Fassung (signature) existiert
+    """
+    path = sidecar_path(csv_path)
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None  # z.B. leere Datei
+        try:
+            if mm[:len(_MAGIC)] != _MAGIC:
+                return None
+            (header_length,) = _HEADER_LENGTH.unpack_from(mm, len(_MAGIC))
+            body_start = len(_MAGIC) + _HEADER_LENGTH.size + header_length
+            header = json.loads(mm[len(_MAGIC) + _HEADER_LENGTH.size:body_start].decode('utf-8'))
+            if header.get('version') != _VERSION or tuple(header.get('signature', ())) != tuple(signature):
+                return None
+
+            etf = dict(header['scalars'])
+            view = memoryview(mm)
+            try:
+                for name, table in header['tables'].items():
+                    start = body_start + table['offset']
+                    columns = decode_columns(view[start:start + table['nbytes']])
+                    etf[name] = _table_rows(columns, table['optional'], table['sparse'])
+            finally:
+                view.release()
+            return etf
+        except (ValueError, KeyError, struct.error):
+            return None
+        finally:
+            mm.close()
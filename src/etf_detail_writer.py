@@ -4,12 +4,18 @@ Speichert ETF-Details (von Morningstar oder Fetcher) im einheitlichen CSV-Format
 """
 
 import csv
+import threading
 from pathlib import Path
 from typing import Dict, List
 from datetime import datetime
 
+from .etf_details_parser import compile_etf_detail_file, invalidate_etf_detail_cache, update_etf_metadata_index
+from .security_master import get_security_master
 from .etf_currency_mapping import COUNTRY_TO_CURRENCY, derive_currency_allocation as _derive_currency_allocation
 
+# Schützt die ISIN-Ticker-Map (Read-Modify-Write) bei paralleler ETF-Auflösung
+_map_lock = threading.Lock()
+
 
 def _derive_currency_from_holdings(holdings: List[Dict]) -> List[Dict]:
     """Leitet Währungs-Allokation aus Holdings ab (falls country_allocation fehlt)."""
@@ -164,12 +170,25 @@ def save_etf_detail_file(
             writer.writerow(['Other Holdings', f'{other_weight * 100:.2f}', 'Mixed', 'Diversified', 'Mixed', ''])
         f.write('\n')
 
+    # Geparste Fassung im Parser-Cache verwerfen, auch wenn mtime-Auflösung grob ist
+    invalidate_etf_detail_cache(filepath)
+    update_etf_metadata_index(filepath)
+    # Kompilierte Fassung für schnelles Laden (siehe etf_detail_sidecar)
+    compile_etf_detail_file(filepath)
+    # Holdings im Security Master registrieren (ISIN bzw. Name -> Wertpapier-ID)
+    get_security_master().register_holdings(holdings)
+
     _update_isin_ticker_map(isin, ticker, name)
     return filepath
 
 
 def _update_isin_ticker_map(isin: str, ticker: str, name: str) -> None:
     """Aktualisiert die ISIN-Ticker-Map (fügt hinzu oder aktualisiert)."""
+    with _map_lock:
+        _write_isin_ticker_map_entry(isin, ticker, name)
+
+
+def _write_isin_ticker_map_entry(isin: str, ticker: str, name: str) -> None:
     map_path = Path('data/etf_isin_ticker_map.csv')
     map_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -3,13 +3,305 @@ ETF Details Parser
 Parst die neuen ETF-Detail-CSV-Dateien mit Metadata, Holdings, Sektor-, Länder- und Währungsverteilung
 """
 
+import copy
 import csv
 import io
+import json
+import os
+import tempfile
+import threading
 import pandas as pd
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from datetime import datetime, timedelta
 from .diagnostics import get_diagnostics
+from .etf_detail_sidecar import read_sidecar, write_sidecar
+
+try:
+    import fcntl
+except ImportError:  # Windows: nur prozessinterne Sperre
+    fcntl = None
+
+
+def _file_signature(filepath: Path) -> Optional[Tuple[int, int]]:
+    """(mtime in ns, Größe) einer Datei oder None wenn sie nicht existiert"""
+    try:
+        stat = filepath.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _ParsedFileCache:
+    """
+    LRU-Cache für geparste ETF-Detail-Dateien.
+    
+    Schlüssel ist der absolute Pfad; ein Eintrag gilt nur, solange (mtime, Größe)
+    der Datei unverändert sind. Wird von allen Parser-Instanzen geteilt.
+    """
+    
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, path: str, signature: Tuple[int, int]) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != signature:
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+    
+    def put(self, path: str, signature: Tuple[int, int], data: Dict):
+        with self._lock:
+            self._entries[path] = (signature, data)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, path: str):
+        with self._lock:
+            self._entries.pop(path, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_file_cache = _ParsedFileCache()
+
+
+def invalidate_etf_detail_cache(filepath):
+    """Entfernt eine ETF-Detail-Datei aus dem Parser-Cache (z.B. nach dem Schreiben)"""
+    _file_cache.invalidate(os.path.abspath(filepath))
+
+
+def compile_etf_detail_file(filepath) -> bool:
+    """
+    Parst eine ETF-Detail-CSV und schreibt ihre Sidecar-Datei (<ticker>.csv.bin)
+    
+    Returns:
+        True wenn die Sidecar-Datei geschrieben wurde
+    """
+    filepath = Path(filepath)
+    parser = ETFDetailsParser(etf_details_dir=str(filepath.parent))
+    signature = _file_signature(filepath)
+    if signature is None:
+        return False
+    etf = parser._read_etf_file(filepath.stem, filepath)
+    return parser._write_sidecar(filepath, signature, etf)
+
+
+# Section-Header der Metadaten (Format A / Format B, siehe _split_sections)
+_METADATA_HEADERS = ('# ETF Metadata', 'METADATA')
+_OTHER_SECTION_HEADERS = (
+    '# Country Allocation', 'COUNTRY_ALLOCATION',
+    '# Sector Allocation', 'SECTOR_ALLOCATION',
+    '# Currency Allocation', 'CURRENCY_ALLOCATION',
+    '# Top Holdings', 'TOP_HOLDINGS',
+)
+
+# Dateiname des Metadaten-Index im jeweiligen ETF-Detail-Verzeichnis
+_METADATA_INDEX_FILE = '.index.json'
+_METADATA_INDEX_VERSION = 1
+
+
+def read_etf_metadata(filepath) -> Dict[str, str]:
+    """
+    Liest nur den Metadaten-Block einer ETF-Detail-Datei (bis zur ersten Allokations-Section)
+    
+    Returns:
+        Rohe Schlüssel/Werte wie in der Datei (z.B. 'ISIN', 'Name', 'Last Updated', 'Source')
+    """
+    metadata = {}
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(_OTHER_SECTION_HEADERS):
+                break
+            if not line or line.startswith('#') or line in _METADATA_HEADERS:
+                continue
+            if ',' in line:
+                key, value = line.split(',', 1)
+                metadata[key.strip()] = value.strip()
+    return metadata
+
+
+class ETFMetadataIndex:
+    """
+    On-Disk-Index ticker -> Metadaten einer ETF-Detail-Datei (.index.json im Verzeichnis)
+    
+    Ein Eintrag gilt, solange (mtime, Größe) der Datei unverändert sind; sonst wird nur der
+    Metadaten-Block neu gelesen (read_etf_metadata). save_etf_detail_file aktualisiert den
+    Index direkt nach dem Schreiben.
+    
+    Lesen, Aktualisieren und Schreiben des Index laufen unter einer Sperre (Thread-Lock plus
+    flock auf .index.json.lock, wo verfügbar); hat ein anderer Prozess den Index inzwischen
+    geschrieben, wird er vorher neu geladen.
+    """
+    
+    def __init__(self, etf_details_dir: str = "data/etf_details"):
+        self.etf_details_dir = Path(etf_details_dir)
+        self.index_path = self.etf_details_dir / _METADATA_INDEX_FILE
+        self._entries: Optional[Dict[str, Dict]] = None
+        # Signatur der Index-Datei beim letzten Laden/Speichern
+        self._index_signature: Optional[Tuple[int, int]] = None
+        # Beim letzten scan() nicht lesbare Dateien: ticker -> Fehlermeldung
+        self.errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def _locked(self):
+        """Sperre für Read-Modify-Write des Index (Threads und, wo möglich, Prozesse)"""
+        with self._lock:
+            lock_file = None
+            if fcntl is not None:
+                try:
+                    lock_file = open(self.index_path.with_name(self.index_path.name + '.lock'), 'a')
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                except OSError:
+                    # z.B. Verzeichnis fehlt oder ist schreibgeschützt: ohne Dateisperre weiter
+                    if lock_file is not None:
+                        lock_file.close()
+                    lock_file = None
+            try:
+                yield
+            finally:
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+    
+    def _load(self) -> Dict[str, Dict]:
+        signature = _file_signature(self.index_path)
+        if self._entries is None or signature != self._index_signature:
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') != _METADATA_INDEX_VERSION:
+                    raise ValueError('veraltete Index-Version')
+                self._entries = data.get('files', {})
+            except (OSError, ValueError):
+                self._entries = {}
+            self._index_signature = signature
+        return self._entries
+    
+    def _save(self):
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.index_path.parent, prefix=f"{self.index_path.name}.", suffix='.tmp'
+            )
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': _METADATA_INDEX_VERSION, 'files': self._entries},
+                          f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+            self._index_signature = _file_signature(self.index_path)
+        except OSError as e:
+            print(f"⚠️  Metadaten-Index konnte nicht gespeichert werden: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _refresh_entry(self, entries: Dict[str, Dict], ticker: str, filepath: Path) -> Tuple[Optional[Dict], bool]:
+        """Liefert (Metadaten, geändert); liest den Header nur bei geänderter Datei"""
+        signature = _file_signature(filepath)
+        if signature is None:
+            return None, entries.pop(ticker, None) is not None
+        entry = entries.get(ticker)
+        if entry is not None and tuple(entry['signature']) == signature:
+            return entry['metadata'], False
+        metadata = read_etf_metadata(filepath)
+        entries[ticker] = {'signature': list(signature), 'metadata': metadata}
+        return metadata, True
+    
+    def get(self, ticker: str) -> Optional[Dict[str, str]]:
+        """Metadaten einer Datei (rohe Schlüssel) oder None wenn sie nicht existiert"""
+        with self._locked():
+            entries = self._load()
+            metadata, changed = self._refresh_entry(entries, ticker, self.etf_details_dir / f"{ticker}.csv")
+            if changed:
+                self._save()
+            return metadata
+    
+    def scan(self) -> Dict[str, Dict[str, str]]:
+        """
+        Metadaten aller ETF-Detail-Dateien (ticker -> rohe Schlüssel), sortiert nach Ticker
+        
+        Unveränderte Dateien kosten nur ein stat(); nicht lesbare Dateien fehlen im Ergebnis
+        und sind über errors abrufbar.
+        """
+        result = {}
+        errors = {}
+        with self._locked():
+            entries = self._load()
+            changed = False
+            tickers = set()
+            for csv_file in sorted(self.etf_details_dir.glob('*.csv')):
+                ticker = csv_file.stem
+                tickers.add(ticker)
+                try:
+                    metadata, entry_changed = self._refresh_entry(entries, ticker, csv_file)
+                except (OSError, UnicodeDecodeError) as e:
+                    errors[ticker] = str(e)
+                    changed = entries.pop(ticker, None) is not None or changed
+                    continue
+                changed = changed or entry_changed
+                if metadata is not None:
+                    result[ticker] = metadata
+            for ticker in set(entries) - tickers:
+                del entries[ticker]
+                changed = True
+            if changed:
+                self._save()
+            self.errors = errors
+        return result
+    
+    def update(self, filepath):
+        """Eintrag einer (neu geschriebenen) Datei sofort aktualisieren"""
+        filepath = Path(filepath)
+        with self._locked():
+            entries = self._load()
+            entries.pop(filepath.stem, None)
+            self._refresh_entry(entries, filepath.stem, filepath)
+            self._save()
+
+
+_metadata_indexes: Dict[str, ETFMetadataIndex] = {}
+_metadata_indexes_lock = threading.Lock()
+
+
+def get_metadata_index(etf_details_dir: str = "data/etf_details") -> ETFMetadataIndex:
+    """Metadaten-Index eines Verzeichnisses (eine Instanz pro Verzeichnis)"""
+    key = os.path.abspath(etf_details_dir)
+    with _metadata_indexes_lock:
+        if key not in _metadata_indexes:
+            _metadata_indexes[key] = ETFMetadataIndex(etf_details_dir)
+        return _metadata_indexes[key]
+
+
+def update_etf_metadata_index(filepath):
+    """Metadaten-Index nach dem Schreiben einer ETF-Detail-Datei aktualisieren"""
+    filepath = Path(filepath)
+    get_metadata_index(str(filepath.parent)).update(filepath)
+
+
+def _copy_parsed(etf: Dict) -> Dict:
+    """
+    Unabhängige Kopie eines (gecachten) geparsten ETF-Dicts
+    
+    Tabellen sind Listen flacher Dicts mit unveränderlichen Werten (str, float, None), daher
+    genügt es, Listen und Zeilen zu kopieren – ein Bruchteil der Zeit von copy.deepcopy.
+    """
+    copied = {}
+    for key, value in etf.items():
+        if isinstance(value, list):
+            value = [dict(row) if isinstance(row, dict) else copy.deepcopy(row) for row in value]
+        elif isinstance(value, (dict, set)):
+            value = copy.deepcopy(value)
+        copied[key] = value
+    return copied
 
 
 class ETFDetailsParser:
@@ -23,6 +315,9 @@ class ETFDetailsParser:
         """
         Parst eine ETF-Detail-Datei
         
+        Bereits geparste Dateien kommen aus dem Cache, solange sich mtime und
+        Größe nicht geändert haben.
+        
         Args:
             ticker: Ticker-Symbol des ETFs (z.B. "AEEM", "EUNL")
             
@@ -36,51 +331,14 @@ class ETFDetailsParser:
             return None
         
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Parse Sections
-            sections = self._split_sections(content)
-            
-            # Metadata
-            metadata = self._parse_metadata(sections.get('metadata', ''))
-            
-            # Country Allocation
-            country_allocation = self._parse_allocation(sections.get('country', ''))
-            
-            # Sector Allocation
-            sector_allocation = self._parse_allocation(sections.get('sector', ''))
-            
-            # Currency Allocation (optional)
-            currency_allocation = self._parse_allocation(sections.get('currency', ''))
-            
-            # Top Holdings
-            holdings = self._parse_holdings(sections.get('holdings', ''))
+            etf = self._load_cached(ticker, filepath)
             
             # Prüfe "Last Updated" Datum und warne wenn veraltet
-            last_updated = metadata.get('Last Updated')
-            if last_updated:
-                self._check_data_freshness(ticker, metadata.get('Name'), last_updated)
+            if etf['last_updated']:
+                self._check_data_freshness(ticker, etf['name'], etf['last_updated'])
             
-            return {
-                'ticker': ticker,
-                'isin': metadata.get('ISIN'),
-                'name': metadata.get('Name'),
-                'type': metadata.get('Type', 'Stock'),
-                'index': metadata.get('Index', ''),
-                'region': metadata.get('Region'),
-                'currency': metadata.get('Currency'),
-                'ter': metadata.get('TER'),
-                'last_updated': last_updated,
-                'proxy_isin': metadata.get('Proxy ISIN', ''),
-                'data_source': metadata.get('Source', ''),
-                'country_allocation': country_allocation,
-                'sector_allocation': sector_allocation,
-                'currency_allocation': currency_allocation,
-                'holdings': holdings,
-                'source': 'etf_details_csv',
-                'file': str(filepath)
-            }
+            # Kopie: Änderungen des Aufrufers dürfen den Cache nicht verfälschen
+            return _copy_parsed(etf)
         
         except Exception as e:
             print(f"❌ Fehler beim Parsen von {filepath}: {e}")
@@ -93,6 +351,81 @@ class ETFDetailsParser:
             )
             return None
     
+    def _load_cached(self, ticker: str, filepath: Path) -> Dict:
+        """
+        Liefert die geparste Datei aus dem Cache oder liest sie neu ein
+        
+        Neu eingelesen wird bevorzugt aus der Sidecar-Datei, sofern sie zur aktuellen
+        CSV-Fassung (mtime, Größe) gehört; sonst aus der CSV (Sidecar wird neu geschrieben).
+        """
+        signature = _file_signature(filepath)
+        if signature is None:
+            raise FileNotFoundError(filepath)
+        cache_key = os.path.abspath(filepath)
+        etf = _file_cache.get(cache_key, signature)
+        if etf is None:
+            etf = read_sidecar(filepath, signature)
+            if etf is not None:
+                etf.update({'ticker': ticker, 'file': str(filepath)})
+            else:
+                etf = self._read_etf_file(ticker, filepath)
+                self._write_sidecar(filepath, signature, etf)
+            _file_cache.put(cache_key, signature, etf)
+        return etf
+    
+    @staticmethod
+    def _write_sidecar(filepath: Path, signature: Tuple[int, int], etf: Dict) -> bool:
+        """Sidecar-Datei schreiben; Fehler (z.B. schreibgeschütztes Verzeichnis) sind unkritisch"""
+        try:
+            write_sidecar(filepath, signature, etf)
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️  Sidecar für {filepath} konnte nicht geschrieben werden: {e}")
+            return False
+    
+    def _read_etf_file(self, ticker: str, filepath: Path) -> Dict:
+        """Liest und parst eine ETF-Detail-Datei (ohne Cache)"""
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+        
+        # Parse Sections
+        sections = self._split_sections(content)
+        
+        # Metadata
+        metadata = self._parse_metadata(sections.get('metadata', ''))
+        
+        # Country Allocation
+        country_allocation = self._parse_allocation(sections.get('country', ''))
+        
+        # Sector Allocation
+        sector_allocation = self._parse_allocation(sections.get('sector', ''))
+        
+        # Currency Allocation (optional)
+        currency_allocation = self._parse_allocation(sections.get('currency', ''))
+        
+        # Top Holdings
+        holdings = self._parse_holdings(sections.get('holdings', ''))
+        
+        return {
+            'ticker': ticker,
+            'isin': metadata.get('ISIN'),
+            'name': metadata.get('Name'),
+            'type': metadata.get('Type', 'Stock'),
+            'index': metadata.get('Index', ''),
+            'region': metadata.get('Region'),
+            'currency': metadata.get('Currency'),
+            'ter': metadata.get('TER'),
+            'last_updated': metadata.get('Last Updated'),
+            'proxy_isin': metadata.get('Proxy ISIN', ''),
+            'data_source': metadata.get('Source', ''),
+            'country_allocation': country_allocation,
+            'sector_allocation': sector_allocation,
+            'currency_allocation': currency_allocation,
+            'holdings': holdings,
+            'source': 'etf_details_csv',
+            'file': str(filepath)
+        }
+    
     def _split_sections(self, content: str) -> Dict[str, str]:
         """
         Teilt CSV-Inhalt in Sections auf.
@@ -266,24 +599,27 @@ class ETFDetailsParser:
         
         return holdings
     
+    def file_version(self, ticker: str) -> Optional[Tuple[int, int]]:
+        """Version der ETF-Detail-Datei als (mtime in ns, Größe) oder None"""
+        return _file_signature(self.etf_details_dir / f"{ticker}.csv")
+    
     def is_file_stale(self, ticker: str, max_days: int) -> bool:
         """
         True wenn die ETF-Detail-Datei nicht existiert oder älter als max_days ist.
+        
+        Nutzt die gecachten Metadaten, ein anschließendes parse_etf_file()
+        liest die Datei daher nicht erneut.
         """
         filepath = self.etf_details_dir / f"{ticker}.csv"
         if not filepath.exists():
             return True
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if 'Last Updated' in line and ',' in line:
-                        parts = line.split(',', 1)
-                        if len(parts) >= 2:
-                            date_str = parts[1].strip()
-                            last_updated = datetime.strptime(date_str, '%Y-%m-%d')
-                            return (datetime.now() - last_updated).days > max_days
-                        break
-        except (ValueError, OSError):
+            date_str = self._load_cached(ticker, filepath)['last_updated']
+            if date_str:
+                last_updated = datetime.strptime(date_str, '%Y-%m-%d')
+                return (datetime.now() - last_updated).days > max_days
+        except (ValueError, OSError, csv.Error):
+            # Nicht lesbar/parsbar oder ungültiges Datum; andere Fehler sind Programmfehler
             pass
         return True  # Bei Fehler als veraltet behandeln
 
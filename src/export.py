@@ -3,14 +3,31 @@ Export Module
 Exportiert Risiko-Daten nach Excel/LibreOffice
 """
 
+import math
+import threading
+import zipfile
 import pandas as pd
+from collections import OrderedDict
 from io import BytesIO
-from typing import Dict
+from typing import Dict, List, Optional
 from datetime import datetime
 
+from .snapshot_codec import risk_fingerprint
+
 
 _FORMULA_PREFIXES = ('=', '+', '-', '@', '|', '%')
 
+# Ab dieser Zeilenzahl (größtes Sheet) wird .xlsx im Streaming-Modus geschrieben
+_STREAMING_ROW_THRESHOLD = 5000
+
+# Obergrenze für zwischengespeicherte Export-Dateien (Summe der Bytes)
+_EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _sanitize_value(v):
+    """Einzelwert wie _sanitize_df absichern (für zeilenweises Schreiben)"""
+    return f"'{v}" if isinstance(v, str) and v.startswith(_FORMULA_PREFIXES) else v
+
 
 def _sanitize_df(df: pd.DataFrame) -> pd.DataFrame:
     """Prefix string cells that start with formula characters with a literal apostrophe.
@@ -26,19 +43,26 @@ def _sanitize_df(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def export_to_calc(risk_data: Dict, format: str = 'xlsx') -> bytes:
+def export_to_calc(risk_data: Dict, format: str = 'xlsx', streaming: Optional[bool] = None) -> bytes:
     """
     Exportiert Risiko-Daten nach Excel oder LibreOffice
     
     Args:
         risk_data: Risiko-Daten Dict
         format: 'xlsx' oder 'ods'
+        streaming: Nur .xlsx – Workbook im write-only Modus zeilenweise schreiben
+                   (konstanter Speicher, Formatierung beim Schreiben).
+                   None = automatisch ab _STREAMING_ROW_THRESHOLD Zeilen.
     
     Returns:
         Bytes der exportierten Datei
     """
     
     if format == 'xlsx':
+        if streaming is None:
+            streaming = _max_sheet_rows(risk_data) >= _STREAMING_ROW_THRESHOLD
+        if streaming:
+            return _export_to_xlsx_streaming(risk_data)
         return _export_to_xlsx(risk_data)
     elif format == 'ods':
         return _export_to_ods(risk_data)
@@ -46,6 +70,74 @@ def export_to_calc(risk_data: Dict, format: str = 'xlsx') -> bytes:
         raise ValueError(f"Unbekanntes Format: {format}")
 
 
+class _ExportCache:
+    """LRU-Cache (Fingerprint, Format) -> Export-Bytes, begrenzt über die Gesamtgröße (thread-sicher)"""
+    
+    def __init__(self, max_bytes: int = _EXPORT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+    
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+            self._entries[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+_export_cache = _ExportCache()
+
+
+def get_export(risk_data: Dict, format: str = 'xlsx', fingerprint: Optional[str] = None) -> bytes:
+    """
+    Export mit Cache: gleiche Risk-Ergebnisse werden pro Format nur einmal erzeugt
+    
+    Args:
+        risk_data: Risiko-Daten Dict
+        format: 'xlsx' / 'ods' (export_to_calc) oder 'csv' / 'parquet' (export_bundle)
+        fingerprint: Vorab berechneter risk_fingerprint(risk_data), spart das erneute Hashen
+    
+    Returns:
+        Bytes der exportierten Datei
+    """
+    if format not in ('xlsx', 'ods', 'csv', 'parquet'):
+        raise ValueError(f"Unbekanntes Format: {format}")
+    key = (fingerprint or risk_fingerprint(risk_data), format)
+    data = _export_cache.get(key)
+    if data is None:
+        if format in ('csv', 'parquet'):
+            data = export_bundle(risk_data, format=format)
+        else:
+            data = export_to_calc(risk_data, format=format)
+        _export_cache.put(key, data)
+    return data
+
+
+def clear_export_cache():
+    """Lösche zwischengespeicherte Exporte"""
+    _export_cache.clear()
+
+
 _SHEET_NAMES = {
     'asset_class': 'Anlageklasse',
     'sector': 'Branche_Sektor',
@@ -56,9 +148,7 @@ _SHEET_NAMES = {
 
 def _write_category_sheets(risk_data: Dict, writer, apply_formatting: bool = False) -> None:
     """Write one sanitized sheet per risk category; optionally apply xlsx formatting."""
-    for category, df in risk_data.items():
-        if category == 'total_value' or not isinstance(df, pd.DataFrame):
-            continue
+    for category, df in _category_frames(risk_data):
         sheet_name = _SHEET_NAMES.get(category, category)
         _sanitize_df(df).to_excel(writer, sheet_name=sheet_name, index=False)
         if apply_formatting:
@@ -85,9 +175,48 @@ def _export_to_ods(risk_data: Dict) -> bytes:
     return output.getvalue()
 
 
-def _create_overview_sheet(risk_data: Dict, writer):
+def export_bundle(risk_data: Dict, format: str = 'csv') -> bytes:
     """
-    Erstellt ein Übersichts-Sheet mit Zusammenfassung
+    Exportiert alle Risiko-Dimensionen als ZIP mit einer Datei pro Dimension
+    (für Weiterverarbeitung ohne Tabellenkalkulation)
+    
+    Args:
+        risk_data: Risiko-Daten Dict
+        format: 'csv' (UTF-8, Komma-getrennt) oder 'parquet' (benötigt pyarrow)
+    
+    Returns:
+        Bytes der ZIP-Datei
+    """
+    if format not in ('csv', 'parquet'):
+        raise ValueError(f"Unbekanntes Format: {format}")
+    
+    output = BytesIO()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        for category, df in _category_frames(risk_data):
+            if format == 'csv':
+                bundle.writestr(f"{category}.csv", _sanitize_df(df).to_csv(index=False))
+            else:
+                buffer = BytesIO()
+                df.to_parquet(buffer, index=False)
+                bundle.writestr(f"{category}.parquet", buffer.getvalue())
+    return output.getvalue()
+
+
+def _category_frames(risk_data: Dict) -> List:
+    """(Kategorie, DataFrame) aller Risiko-Dimensionen in Dict-Reihenfolge"""
+    return [
+        (category, df) for category, df in risk_data.items()
+        if category != 'total_value' and isinstance(df, pd.DataFrame)
+    ]
+
+
+def _max_sheet_rows(risk_data: Dict) -> int:
+    return max((len(df) for _, df in _category_frames(risk_data)), default=0)
+
+
+def _overview_rows(risk_data: Dict) -> List[list]:
+    """
+    Zeilen des Übersichts-Sheets (Zusammenfassung)
     """
     overview_data = []
     
@@ -118,7 +247,14 @@ def _create_overview_sheet(risk_data: Dict, writer):
                 f"{df.head(5)['Anteil (%)'].sum():.1f}%"
             ])
     
-    overview_df = pd.DataFrame(overview_data)
+    return overview_data
+
+
+def _create_overview_sheet(risk_data: Dict, writer):
+    """
+    Erstellt ein Übersichts-Sheet mit Zusammenfassung
+    """
+    overview_df = pd.DataFrame(_overview_rows(risk_data))
     overview_df.to_excel(writer, sheet_name='Übersicht', index=False, header=False)
 
 
@@ -159,3 +295,78 @@ def _format_worksheet(worksheet, df: pd.DataFrame):
                 cell.fill = PatternFill(start_color='FFCCCC', end_color='FFCCCC', fill_type='solid')
             elif cell.value and float(str(cell.value).replace('%', '').replace(',', '.')) > 5:
                 cell.fill = PatternFill(start_color='FFF9CC', end_color='FFF9CC', fill_type='solid')
+
+
+def _column_widths(df: pd.DataFrame) -> List[float]:
+    """Spaltenbreiten wie in _format_worksheet (längster Wert + 2, max. 50)"""
+    widths = []
+    for col in range(len(df.columns)):
+        max_length = max(
+            len(str(df.columns[col])),
+            df.iloc[:, col].astype(str).str.len().max()
+        )
+        widths.append(min(max_length + 2, 50))
+    return widths
+
+
+def _export_to_xlsx_streaming(risk_data: Dict) -> bytes:
+    """
+    Exportiert nach Excel (.xlsx) mit write-only Workbook
+    
+    Zeilen werden direkt geschrieben und dabei formatiert (Header, Spaltenbreiten,
+    Risiko-Farben der Anteil-Spalte) – kein nachträgliches Durchlaufen der Zellen.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    from openpyxl.utils import get_column_letter
+    
+    header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+    header_font = Font(bold=True, color='FFFFFF')
+    header_alignment = Alignment(horizontal='center')
+    thin = Side(style='thin')
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    high_fill = PatternFill(start_color='FFCCCC', end_color='FFCCCC', fill_type='solid')
+    medium_fill = PatternFill(start_color='FFF9CC', end_color='FFF9CC', fill_type='solid')
+    
+    workbook = Workbook(write_only=True)
+    
+    overview = workbook.create_sheet('Übersicht')
+    for row in _overview_rows(risk_data):
+        overview.append(row)
+    
+    for category, df in _category_frames(risk_data):
+        worksheet = workbook.create_sheet(_SHEET_NAMES.get(category, category))
+        
+        # Spaltenbreiten müssen im write-only Modus vor den Zeilen gesetzt werden
+        for col, width in enumerate(_column_widths(df), start=1):
+            worksheet.column_dimensions[get_column_letter(col)].width = width
+        
+        header = []
+        for name in df.columns:
+            cell = WriteOnlyCell(worksheet, value=_sanitize_value(name))
+            cell.fill = header_fill
+            cell.font = header_font
+            cell.alignment = header_alignment
+            cell.border = header_border
+            header.append(cell)
+        worksheet.append(header)
+        
+        pct_col = df.columns.get_loc('Anteil (%)') if 'Anteil (%)' in df.columns else None
+        for values in df.itertuples(index=False, name=None):
+            row = [
+                None if isinstance(v, float) and math.isnan(v) else _sanitize_value(v)
+                for v in values
+            ]
+            if pct_col is not None and row[pct_col]:
+                # Farbe basierend auf Risiko
+                pct = float(row[pct_col])
+                if pct > 5:
+                    cell = WriteOnlyCell(worksheet, value=row[pct_col])
+                    cell.fill = high_fill if pct > 10 else medium_fill
+                    row[pct_col] = cell
+            worksheet.append(row)
+    
+    output = BytesIO()
+    workbook.save(output)
+    return output.getvalue()
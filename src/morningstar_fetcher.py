@@ -14,67 +14,241 @@ Wichtige Hinweise:
 
 from __future__ import annotations
 
+import base64
+import json
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .refresh_engine import backoff_delay, get_rate_limiter
 
 
 MORNINGSTAR_DOMAIN_DEFAULT = "de"
 MORNINGSTAR_ECINT_BASE = "https://www.emea-api.morningstar.com/ecint/v1"
 
-_BEARER_TOKEN: Optional[str] = None
-_BEARER_DOMAIN: Optional[str] = None
+_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/122.0 Safari/537.36"
+)
+
+# Fallback-Lebensdauer des Tokens, falls kein JWT-"exp" auslesbar ist
+_TOKEN_TTL_SECONDS = 30 * 60
+# Token so viele Sekunden vor Ablauf erneuern
+_TOKEN_EXPIRY_MARGIN = 60
+# Wiederholungen bei Verbindungsfehlern, 429 und 5xx
+_MAX_RETRIES = 2
+_RETRY_BACKOFF_SECONDS = 0.5
+
 
+def _token_expiry(token: str) -> Optional[float]:
+    """Ablaufzeitpunkt (Unix-Zeit) aus dem JWT-Payload oder None"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
 
-def _get_bearer_token(domain: str = MORNINGSTAR_DOMAIN_DEFAULT) -> str:
+
+class MorningstarClient:
     """
-    Holt das Bearer-Token aus der öffentlichen Morningstar-Webseite.
+    Client für die Morningstar EMEA API.
 
-    Nach Vorbild von pp-portfolio-classifier:
-    - Aufruf von https://www.morningstar.{domain}/Common/funds/snapshot/PortfolioSAL.aspx
-    - Regex auf `const maasToken = "..."`.
+    - Gepoolte Keep-Alive-Session (eine TCP/TLS-Verbindung für viele Anfragen)
+    - Bearer-Token mit Ablaufzeit; Erneuerung bei Ablauf oder 401
+    - ITsnapshot und Top25 einer ISIN werden parallel abgefragt
+    - Zähler für Anfragen, Wiederholungen und Latenz (get_stats)
     """
-    global _BEARER_TOKEN, _BEARER_DOMAIN
-
-    if _BEARER_TOKEN and _BEARER_DOMAIN == domain:
-        return _BEARER_TOKEN
-
-    url = f"https://www.morningstar.{domain}/Common/funds/snapshot/PortfolioSAL.aspx"
-    headers = {
-        "accept": "*/*",
-        "accept-encoding": "gzip, deflate, br",
-        "user-agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/122.0 Safari/537.36"
-        ),
-    }
-    resp = requests.get(url, headers=headers, timeout=10)
-    resp.raise_for_status()
 
-    m = re.search(r'const maasToken\s*=\s*\"(.+?)\"', resp.text)
-    if not m:
-        raise RuntimeError("Konnte maasToken auf der Morningstar-Seite nicht finden.")
+    def __init__(self, domain: str = MORNINGSTAR_DOMAIN_DEFAULT, pool_size: int = 10):
+        self.domain = domain
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "accept": "*/*",
+            "accept-encoding": "gzip, deflate, br",
+            "user-agent": _USER_AGENT,
+        })
+        self._pool_size = pool_size
+        self.rate_limiter = get_rate_limiter('morningstar')
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "token_refreshes": 0,
+            "errors": 0,
+            "latency_total": 0.0,
+        }
+
+    def _count(self, key: str, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def get_stats(self) -> Dict:
+        """Zähler inkl. mittlerer Latenz in Sekunden"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["latency_avg"] = stats["latency_total"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def _get_token(self, force_refresh: bool = False) -> str:
+        """
+        Holt das Bearer-Token aus der öffentlichen Morningstar-Webseite.
+
+        Nach Vorbild von pp-portfolio-classifier:
+        - Aufruf von https://www.morningstar.{domain}/Common/funds/snapshot/PortfolioSAL.aspx
+        - Regex auf `const maasToken = "..."`.
+        """
+        with self._token_lock:
+            if (
+                not force_refresh
+                and self._token
+                and time.time() < self._token_expires_at - _TOKEN_EXPIRY_MARGIN
+            ):
+                return self._token
+
+            url = f"https://www.morningstar.{self.domain}/Common/funds/snapshot/PortfolioSAL.aspx"
+            resp = self._request(url, timeout=10)
+            resp.raise_for_status()
+
+            m = re.search(r'const maasToken\s*=\s*\"(.+?)\"', resp.text)
+            if not m:
+                raise RuntimeError("Konnte maasToken auf der Morningstar-Seite nicht finden.")
+
+            self._token = m.group(1)
+            self._token_expires_at = _token_expiry(self._token) or (time.time() + _TOKEN_TTL_SECONDS)
+            self._count("token_refreshes")
+            return self._token
+
+    def _request(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+                 timeout: int = 15) -> requests.Response:
+        """GET über die Session mit Wiederholung bei Verbindungsfehlern, 429 und 5xx"""
+        for attempt in range(_MAX_RETRIES + 1):
+            if attempt:
+                self._count("retries")
+                time.sleep(backoff_delay(attempt, base=_RETRY_BACKOFF_SECONDS))
+            self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                resp = self.session.get(url, params=params, headers=headers, timeout=timeout)
+            except requests.RequestException:
+                self._count("requests")
+                self._count("latency_total", time.perf_counter() - started)
+                self._count("errors")
+                if attempt == _MAX_RETRIES:
+                    raise
+                continue
+            self._count("requests")
+            self._count("latency_total", time.perf_counter() - started)
+            if (resp.status_code == 429 or resp.status_code >= 500) and attempt < _MAX_RETRIES:
+                continue
+            return resp
+
+    def _api_get(self, url: str, params: Dict) -> requests.Response:
+        """API-Aufruf mit Bearer-Token; bei 401 einmal mit neuem Token wiederholen"""
+        token = self._get_token()
+        resp = self._request(url, params=params, headers={"authorization": f"Bearer {token}"})
+        if resp.status_code == 401:
+            self._count("retries")
+            token = self._get_token(force_refresh=True)
+            resp = self._request(url, params=params, headers={"authorization": f"Bearer {token}"})
+        return resp
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._pool_size, thread_name_prefix="morningstar"
+                )
+            return self._executor
+
+    def get_etf_details(self, isin: str) -> Optional[Dict]:
+        """ETF-Details einer ISIN (Format siehe get_etf_details_from_morningstar)"""
+        try:
+            self._get_token()
+        except Exception as e:
+            print(f"⚠️  Morningstar-Token konnte nicht geholt werden: {e}")
+            return None
+
+        url = f"{MORNINGSTAR_ECINT_BASE}/securities/{isin}"
+        base_params = {
+            "idtype": "ISIN",
+            "currencyId": "EUR",
+            "responseViewFormat": "json",
+            "languageId": "en-UK",
+        }
+
+        # ITsnapshot (volle Struktur, nur 10 Holdings) und Top25 (25 Holdings) parallel
+        executor = self._get_executor()
+        snapshot_future = executor.submit(self._api_get, url, {**base_params, "viewid": "ITsnapshot"})
+        top25_future = executor.submit(self._api_get, url, {**base_params, "viewid": "Top25"})
+
+        # 1. ITsnapshot: volle Struktur (Country, Sector, AssetAllocations) – aber nur 10 Holdings
+        try:
+            resp = snapshot_future.result()
+        except Exception as e:
+            print(f"⚠️  Fehler beim Abruf der Morningstar-API für {isin}: {e}")
+            return None
+
+        if resp.status_code != 200:
+            print(f"⚠️  Morningstar-API {resp.status_code} für {isin}")
+            return None
 
-    _BEARER_TOKEN = m.group(1)
-    _BEARER_DOMAIN = domain
-    return _BEARER_TOKEN
+        try:
+            data = resp.json()
+        except Exception as e:
+            print(f"⚠️  Ungültige JSON-Antwort von Morningstar für {isin}: {e}")
+            return None
 
+        if not isinstance(data, list) or not data:
+            return None
 
-def _get_headers(domain: str = MORNINGSTAR_DOMAIN_DEFAULT) -> Dict[str, str]:
-    token = _get_bearer_token(domain)
-    return {
-        "accept": "*/*",
-        "accept-encoding": "gzip, deflate, br",
-        "authorization": f"Bearer {token}",
-        "user-agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/122.0 Safari/537.36"
-        ),
-    }
+        sec = data[0]
+        portfolios = sec.get("Portfolios") or []
+        portfolio = portfolios[0] if portfolios else {}
+
+        # 2. Top25: mehr Holdings (25 statt 10); ITsnapshot liefert keine Country/Sector
+        try:
+            resp2 = top25_future.result()
+            if resp2.status_code == 200:
+                data2 = resp2.json()
+                if isinstance(data2, list) and data2:
+                    p2 = (data2[0].get("Portfolios") or [{}])[0]
+                    extra_holdings = p2.get("PortfolioHoldings", [])
+                    if len(extra_holdings) > len(portfolio.get("PortfolioHoldings", [])):
+                        portfolio["PortfolioHoldings"] = extra_holdings
+        except Exception:
+            pass  # First request already succeeded; proceed with up to 10 holdings.
+
+        return _build_etf_details(isin, sec, portfolio)
+
+
+_clients: Dict[str, MorningstarClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_morningstar_client(domain: str = MORNINGSTAR_DOMAIN_DEFAULT) -> MorningstarClient:
+    """Singleton-Client je Morningstar-Domain"""
+    with _clients_lock:
+        client = _clients.get(domain)
+        if client is None:
+            client = MorningstarClient(domain)
+            _clients[domain] = client
+        return client
 
 
 def _asset_type_to_etf_type(allocations: Dict[str, float], security_name: str = "") -> str:
@@ -145,61 +319,11 @@ def get_etf_details_from_morningstar(
       bei uns aus Ländern abgeleitet)
     - 'holdings': [{'name','weight','currency','sector','country','isin'}]
     """
-    try:
-        headers = _get_headers(domain)
-    except Exception as e:
-        print(f"⚠️  Morningstar-Token konnte nicht geholt werden: {e}")
-        return None
-
-    url = f"{MORNINGSTAR_ECINT_BASE}/securities/{isin}"
-    base_params = {
-        "idtype": "ISIN",
-        "currencyId": "EUR",
-        "responseViewFormat": "json",
-        "languageId": "en-UK",
-    }
+    return get_morningstar_client(domain).get_etf_details(isin)
 
-    # 1. ITsnapshot: volle Struktur (Country, Sector, AssetAllocations) – aber nur 10 Holdings
-    try:
-        resp = requests.get(
-            url, params={**base_params, "viewid": "ITsnapshot"}, headers=headers, timeout=15
-        )
-    except Exception as e:
-        print(f"⚠️  Fehler beim Abruf der Morningstar-API für {isin}: {e}")
-        return None
-
-    if resp.status_code != 200:
-        print(f"⚠️  Morningstar-API {resp.status_code} für {isin}")
-        return None
-
-    try:
-        data = resp.json()
-    except Exception as e:
-        print(f"⚠️  Ungültige JSON-Antwort von Morningstar für {isin}: {e}")
-        return None
-
-    if not isinstance(data, list) or not data:
-        return None
-
-    sec = data[0]
-    portfolios = sec.get("Portfolios") or []
-    portfolio = portfolios[0] if portfolios else {}
-
-    # 2. Top25: mehr Holdings (25 statt 10); ITsnapshot liefert keine Country/Sector
-    try:
-        resp2 = requests.get(
-            url, params={**base_params, "viewid": "Top25"}, headers=headers, timeout=15
-        )
-        if resp2.status_code == 200:
-            data2 = resp2.json()
-            if isinstance(data2, list) and data2:
-                p2 = (data2[0].get("Portfolios") or [{}])[0]
-                extra_holdings = p2.get("PortfolioHoldings", [])
-                if len(extra_holdings) > len(portfolio.get("PortfolioHoldings", [])):
-                    portfolio["PortfolioHoldings"] = extra_holdings
-    except Exception:
-        pass  # First request already succeeded; proceed with up to 10 holdings.
 
+def _build_etf_details(isin: str, sec: Dict, portfolio: Dict) -> Optional[Dict]:
+    """Wandelt die Morningstar-Antwort (Security + Portfolio) ins ClusterRisk-Format"""
     # Asset-Type → ETF-Typ
     asset_type_alloc: Dict[str, float] = {}
     for entry in portfolio.get("AssetAllocations", []):
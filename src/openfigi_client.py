@@ -0,0 +1,160 @@
+"""
+OpenFIGI Client
+Gebündelte Mapping-Anfragen (ISIN→Ticker, Ticker→Sektor) mit Cache und Rate-Limit-Beachtung
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+OPENFIGI_MAPPING_URL = "https://api.openfigi.com/v3/mapping"
+
+# Jobs pro Anfrage laut OpenFIGI: 100 mit API-Key, 10 ohne
+_MAX_JOBS_WITH_KEY = 100
+_MAX_JOBS_WITHOUT_KEY = 10
+# Wartezeit bei 429 ohne ratelimit-reset Header
+_DEFAULT_RETRY_AFTER = 6.0
+_MAX_RETRIES = 3
+
+
+class OpenFIGIClient:
+    """
+    Client für die OpenFIGI Mapping-API.
+
+    Aufrufer übergeben Mapping-Jobs (z.B. {"idType": "ID_ISIN", "idValue": "..."});
+    der Client fasst sie zu Bulk-Anfragen zusammen, beachtet die ratelimit-Header
+    und cacht die Ergebnisse im Speicher.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, url: str = OPENFIGI_MAPPING_URL,
+                 max_jobs_per_request: Optional[int] = None, timeout: int = 10):
+        self.api_key = api_key if api_key is not None else os.environ.get('OPENFIGI_API_KEY')
+        self.url = url
+        self.max_jobs_per_request = max_jobs_per_request or (
+            _MAX_JOBS_WITH_KEY if self.api_key else _MAX_JOBS_WITHOUT_KEY
+        )
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Content-Type'] = 'application/json'
+        if self.api_key:
+            self.session.headers['X-OPENFIGI-APIKEY'] = self.api_key
+        # Job-Schlüssel -> Liste der Treffer ([] = kein Treffer)
+        self._cache: Dict[str, List[Dict]] = {}
+        self._cache_lock = threading.Lock()
+        # Anfragen seriell, damit das Rate-Limit über alle Threads gilt
+        self._request_lock = threading.Lock()
+        self._blocked_until = 0.0
+        self.requests_sent = 0
+
+    @staticmethod
+    def _job_key(job: Dict) -> str:
+        return json.dumps(job, sort_keys=True)
+
+    def map_job(self, job: Dict) -> Optional[List[Dict]]:
+        """Mapping für einen einzelnen Job (siehe map_jobs)"""
+        return self.map_jobs([job])[0]
+
+    def map_jobs(self, jobs: List[Dict]) -> List[Optional[List[Dict]]]:
+        """
+        Führt Mapping-Jobs gebündelt aus.
+
+        Returns:
+            Pro Job (gleiche Reihenfolge): Liste der Treffer, [] wenn OpenFIGI keinen
+            Treffer kennt, None bei Fehlern (wird nicht gecacht)
+        """
+        keys = [self._job_key(job) for job in jobs]
+        with self._cache_lock:
+            missing = {}
+            for key, job in zip(keys, jobs):
+                if key not in self._cache and key not in missing:
+                    missing[key] = job
+
+        missing_items = list(missing.items())
+        for start in range(0, len(missing_items), self.max_jobs_per_request):
+            chunk = missing_items[start:start + self.max_jobs_per_request]
+            results = self._post([job for _, job in chunk])
+            if results is None:
+                continue
+            with self._cache_lock:
+                for (key, _), result in zip(chunk, results):
+                    if 'data' in result:
+                        self._cache[key] = result['data']
+                    elif 'warning' in result:
+                        self._cache[key] = []  # z.B. "No identifier found."
+                    else:
+                        logger.debug("OpenFIGI Fehler für %s: %s", key, result.get('error'))
+
+        with self._cache_lock:
+            return [self._cache.get(key) for key in keys]
+
+    def _post(self, jobs: List[Dict]) -> Optional[List[Dict]]:
+        """Eine Bulk-Anfrage; wartet bei erschöpftem Rate-Limit und wiederholt bei 429"""
+        with self._request_lock:
+            for _ in range(_MAX_RETRIES + 1):
+                wait = self._blocked_until - time.monotonic()
+                if wait > 0:
+                    logger.debug("OpenFIGI Rate-Limit: warte %.1fs", wait)
+                    time.sleep(wait)
+                try:
+                    response = self.session.post(self.url, json=jobs, timeout=self.timeout)
+                except requests.RequestException as e:
+                    logger.warning("OpenFIGI Anfrage fehlgeschlagen: %s", e)
+                    return None
+                self.requests_sent += 1
+                self._update_rate_limit(response)
+
+                if response.status_code == 429:
+                    if self._blocked_until <= time.monotonic():
+                        self._blocked_until = time.monotonic() + _DEFAULT_RETRY_AFTER
+                    continue
+                if response.status_code != 200:
+                    logger.warning("OpenFIGI HTTP %s", response.status_code)
+                    return None
+                try:
+                    data = response.json()
+                except ValueError as e:
+                    logger.warning("Ungültige OpenFIGI-Antwort: %s", e)
+                    return None
+                if not isinstance(data, list) or len(data) != len(jobs):
+                    logger.warning("Unerwartete OpenFIGI-Antwort (%d Jobs)", len(jobs))
+                    return None
+                return data
+
+        logger.warning("OpenFIGI Rate-Limit: Anfrage nach %d Versuchen abgebrochen", _MAX_RETRIES + 1)
+        return None
+
+    def _update_rate_limit(self, response: requests.Response):
+        """Liest ratelimit-remaining/-reset und sperrt bis zum Reset, wenn nichts mehr übrig ist"""
+        remaining = response.headers.get('ratelimit-remaining')
+        reset = response.headers.get('ratelimit-reset')
+        try:
+            if reset is not None and (response.status_code == 429 or (remaining is not None and int(remaining) <= 0)):
+                self._blocked_until = time.monotonic() + float(reset)
+        except ValueError:
+            pass
+
+    def clear_cache(self):
+        """Lösche gecachte Mapping-Ergebnisse"""
+        with self._cache_lock:
+            self._cache = {}
+
+
+# Globale Instanz für einfachen Import
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_openfigi_client() -> OpenFIGIClient:
+    """Hole globale OpenFIGI-Client-Instanz (Singleton)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenFIGIClient()
+        return _client
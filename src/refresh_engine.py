@@ -0,0 +1,168 @@
+"""
+Refresh Engine
+Asynchrone Bulk-Aktualisierung mit Token-Bucket je Quelle, begrenzter Parallelität und Retry
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Höflichkeitsbudget je Quelle: (Anfragen pro Sekunde, Burst)
+SOURCE_RATE_LIMITS = {
+    'justetf': (2.0, 4),
+    'morningstar': (5.0, 10),
+}
+_DEFAULT_RATE_LIMIT = (1.0, 2)
+
+# Gleichzeitig laufende Jobs und Wiederholungen bei Ausnahmen
+_DEFAULT_MAX_CONCURRENCY = 4
+_DEFAULT_RETRIES = 2
+_BACKOFF_BASE_SECONDS = 1.0
+_BACKOFF_MAX_SECONDS = 30.0
+
+
+class TransientRefreshError(Exception):
+    """Vorübergehender Fehler (Netzwerk, 429, 5xx): Worker werfen ihn, _run_job wiederholt"""
+
+
+class TokenBucket:
+    """
+    Token-Bucket (thread-sicher): rate Tokens pro Sekunde, höchstens burst auf Vorrat.
+
+    Wartende reservieren ihr Token sofort (Warteschlange in Ankunftsreihenfolge) und
+    schlafen danach ohne Lock – synchron (acquire) oder im Event-Loop (acquire_async).
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Reserviert Tokens und gibt die nötige Wartezeit in Sekunden zurück"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1.0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(source: str) -> TokenBucket:
+    """Globaler Token-Bucket einer Quelle (gilt für alle Threads und Aufrufer)"""
+    key = source.lower()
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(*SOURCE_RATE_LIMITS.get(key, _DEFAULT_RATE_LIMIT))
+        return _limiters[key]
+
+
+def backoff_delay(attempt: int, base: float = _BACKOFF_BASE_SECONDS,
+                  cap: float = _BACKOFF_MAX_SECONDS) -> float:
+    """Exponentielles Backoff mit Jitter (attempt ab 1): zufällig in [0.5, 1.0] × base · 2^(attempt-1)"""
+    delay = min(cap, base * (2 ** (attempt - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def _run_job(job: Dict, worker: Callable[[Dict], Dict], semaphore: asyncio.Semaphore,
+                   retries: int) -> Dict:
+    async with semaphore:
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt))
+            try:
+                # Worker sind blockierend (requests) → Thread, Event-Loop bleibt frei
+                return await asyncio.to_thread(worker, job)
+            except Exception as e:
+                logger.warning("Refresh %s fehlgeschlagen (Versuch %d/%d): %s",
+                               job.get('key'), attempt + 1, retries + 1, e)
+                error = e
+        return {'success': False, 'message': f"Fehler nach {retries + 1} Versuchen: {error}"}
+
+
+async def run_jobs_async(
+    jobs: Sequence[Dict],
+    worker: Callable[[Dict], Dict],
+    max_concurrency: int = _DEFAULT_MAX_CONCURRENCY,
+    retries: int = _DEFAULT_RETRIES,
+    progress_callback=None,
+) -> List[Dict]:
+    """
+    Führt Jobs nebenläufig aus.
+
+    Args:
+        jobs: Dicts mit 'key' (für Fortschritt/Logs) und beliebigen Worker-Parametern
+        worker: Blockierende Funktion job -> Ergebnis-Dict, läuft in einem Thread. HTTP-Anfragen
+                drosselt der Worker über get_rate_limiter(quelle); Ausnahmen werden mit
+                Backoff wiederholt
+        max_concurrency: Höchstzahl gleichzeitig laufender Jobs
+        retries: Wiederholungen pro Job nach einer Ausnahme
+        progress_callback: Optional - Callback(done, total, key) nach jedem fertigen Job
+                           (läuft im Thread des Event-Loops, nicht in den Worker-Threads)
+
+    Returns:
+        Ergebnisse in Job-Reihenfolge
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    tasks = [asyncio.create_task(_run_job(job, worker, semaphore, retries)) for job in jobs]
+    index = {task: i for i, task in enumerate(tasks)}
+    results: List[Optional[Dict]] = [None] * len(tasks)
+
+    done = 0
+    pending = set(tasks)
+    while pending:
+        finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            i = index[task]
+            results[i] = task.result()
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(tasks), jobs[i].get('key'))
+    return results
+
+
+def run_jobs(jobs: Sequence[Dict], worker: Callable[[Dict], Dict], **kwargs) -> List[Dict]:
+    """Synchroner Einstieg für run_jobs_async (eigener Event-Loop, auch aus laufendem Loop heraus)"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run_jobs_async(jobs, worker, **kwargs))
+
+    # Bereits in einem Event-Loop (z.B. Notebook) → in separatem Thread ausführen
+    result: Dict = {}
+
+    def target():
+        try:
+            result['value'] = asyncio.run(run_jobs_async(jobs, worker, **kwargs))
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target, name='refresh-engine')
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
@@ -4,8 +4,12 @@ Berechnet Klumpenrisiken über verschiedene Dimensionen
 """
 
 import logging
+import threading
+from functools import lru_cache
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from src.etf_data_fetcher import ETFDataFetcher
 
@@ -14,6 +18,24 @@ from src.etf_details_parser import get_etf_details_parser
 from src.diagnostics import get_diagnostics
 from src.morningstar_fetcher import get_etf_details_from_morningstar
 from src.etf_detail_writer import save_etf_detail_file
+from src.security_master import CASH_SECURITY_ID, get_security_master
+
+# Inkrementeller Modus: Expansion je ETF bei Wert 1.0, wird pro Lauf skaliert
+# {(isin, ticker_for_file, position_name): (version, rows)}
+_exposure_templates: Dict[Tuple[str, str, str], Tuple[tuple, List[Dict]]] = {}
+_exposure_templates_lock = threading.Lock()
+
+# Full-Holdings-Modus: kompilierte ETF-Vektoren (Gewichte + Holding-IDs) bei Wert 1.0
+# {(isin, ticker_for_file, position_name): (version, _HoldingVector)}
+_holding_vectors: Dict[Tuple[str, str, str], Tuple[tuple, '_HoldingVector']] = {}
+_holding_vectors_lock = threading.Lock()
+
+# Auflösung veralteter/fehlender ETFs: Worker-Pool und Parallelität je Host
+_RESOLVE_MAX_WORKERS = 8
+_HOST_LIMITS = {
+    'morningstar': threading.BoundedSemaphore(4),
+    'fetcher': threading.BoundedSemaphore(2),  # justETF + Yahoo
+}
 
 
 def _load_isin_ticker_map() -> Dict[str, str]:
@@ -35,6 +57,9 @@ def _load_isin_ticker_map() -> Dict[str, str]:
 def calculate_cluster_risks(
     portfolio_data: Dict,
     etf_update_interval_days: int = 30,
+    columnar: bool = False,
+    incremental: bool = False,
+    full_holdings: bool = False,
 ) -> Dict:
     """
     Berechnet Klumpenrisiken über alle Dimensionen
@@ -43,6 +68,15 @@ def calculate_cluster_risks(
         portfolio_data: Geparste Portfolio-Daten
         etf_update_interval_days: Nach wie vielen Tagen ETF-Daten (Dateien + API-Cache)
             aktualisiert werden (1–90). Steuert sowohl ETF-Detail-Dateien als auch Fetcher-Cache.
+        columnar: Spaltenweise Engine verwenden (NumPy-Spalten statt Liste von Dicts).
+            Liefert identische DataFrames, ist aber bei sehr vielen Holdings deutlich schneller.
+        incremental: ETF-Expansionen je (ISIN, Detail-Datei-Version) zwischen Aufrufen cachen
+            und nur mit den neuen Positionswerten skalieren. Nur neue oder geänderte ETFs
+            werden neu expandiert (z.B. bei wiederholtem Upload mit neuen Kursen).
+        full_holdings: Für vollständige Bestandslisten (tausende Holdings je ETF). Jeder ETF
+            wird einmal je Datei-Version zu einem Gewichts-Array über Wertpapier-IDs des
+            Security Masters kompiliert; Überschneidungen zwischen ETFs
+            ergeben sich als Summe dieser Vektoren. Impliziert die spaltenweise Engine.
 
     Returns:
         Dict mit Risiko-Analysen für alle Dimensionen
@@ -52,12 +86,19 @@ def calculate_cluster_risks(
 
     fetcher = ETFDataFetcher(cache_days=etf_update_interval_days)
     isin_ticker_map = _load_isin_ticker_map()
+    expanded = _ExposureColumns() if columnar or full_holdings else None
     expanded_positions, etf_resolution = _expand_etf_holdings(
-        portfolio_data, fetcher, isin_ticker_map, etf_update_interval_days
+        portfolio_data, fetcher, isin_ticker_map, etf_update_interval_days,
+        expanded=expanded,
+        incremental=incremental,
+        full_holdings=full_holdings,
     )
     
     # Validierung: Summe der expandierten Positionen = Portfolio-Gesamtwert
-    expanded_sum = sum(p['value'] for p in expanded_positions)
+    if expanded is not None:
+        expanded_sum = expanded_positions.total_value()
+    else:
+        expanded_sum = sum(p['value'] for p in expanded_positions)
     portfolio_total = portfolio_data['total_value']
     if abs(expanded_sum - portfolio_total) > max(1.0, portfolio_total * 0.001):
         diagnostics = get_diagnostics()
@@ -68,16 +109,22 @@ def calculate_cluster_risks(
         )
     
     # Klumpenrisiken berechnen
-    risk_data = {
-        'asset_class': _calculate_asset_class_risk(expanded_positions, portfolio_data),
-        'sector': _calculate_sector_risk(expanded_positions),
-        'currency': _calculate_currency_risk(expanded_positions),
-        'currency_with_commodities': _calculate_currency_risk_with_commodities(expanded_positions),
-        'country': _calculate_country_risk(expanded_positions),
-        'positions': _calculate_position_risk(expanded_positions),
-        'total_value': portfolio_data['total_value'],
-        'etf_resolution': etf_resolution,
-    }
+    if expanded is not None:
+        risk_data = expanded_positions.to_risk_frames()
+    else:
+        risk_data = {
+            'asset_class': _calculate_asset_class_risk(expanded_positions, portfolio_data),
+            'sector': _calculate_sector_risk(expanded_positions),
+            'currency': _calculate_currency_risk(expanded_positions),
+            'currency_with_commodities': _calculate_currency_risk_with_commodities(expanded_positions),
+            'country': _calculate_country_risk(expanded_positions),
+            'positions': _calculate_position_risk(expanded_positions),
+        }
+    risk_data['total_value'] = portfolio_data['total_value']
+    risk_data['etf_resolution'] = etf_resolution
+
+    # Neu gesehene Wertpapiere persistieren
+    get_security_master().flush()
     
     return risk_data
 
@@ -87,101 +134,49 @@ def _expand_etf_holdings(
     fetcher: ETFDataFetcher,
     isin_ticker_map: Dict[str, str],
     etf_update_interval_days: int = 30,
+    expanded=None,
+    incremental: bool = False,
+    full_holdings: bool = False,
 ) -> tuple:
     """
     Expandiert ETF-Positionen in ihre einzelnen Holdings.
 
     Datei-First: Lokale ETF-Detail-CSV wird genutzt. Wenn veraltet oder fehlend,
     werden Daten von Morningstar (oder Fetcher als Fallback) geholt und in eine
-    CSV-Datei gespeichert.
+    CSV-Datei gespeichert. Die Auflösung läuft vorab parallel (_resolve_etfs), die
+    Expansion danach in Portfolio-Reihenfolge.
+
+    Args:
+        expanded: Optionales Ziel für expandierte Positionen (Liste oder _ExposureColumns).
+            Standard: neue Liste.
+        incremental: Gecachte ETF-Expansionen skalieren statt neu zu expandieren.
+        full_holdings: ETFs als kompilierte Holding-Vektoren einfügen (expanded muss eine
+            _ExposureColumns sein).
 
     Returns:
-        (expanded: List[Dict], etf_resolution: List[Dict])
+        (expanded: List[Dict] | _ExposureColumns, etf_resolution: List[Dict])
         etf_resolution: [{'isin','ticker','name','source'}] mit source in file|morningstar|fetcher|failed
     """
-    expanded = []
+    if expanded is None:
+        expanded = []
     etf_resolution: List[Dict] = []
-    etf_parser = get_etf_details_parser()
+    resolved = _resolve_etfs(portfolio_data, fetcher, isin_ticker_map, etf_update_interval_days)
 
     for position in portfolio_data['positions']:
         if position['type'] == 'ETF' and position.get('isin'):
             isin = position['isin']
-            ticker = isin_ticker_map.get(isin) or position.get('ticker_symbol', '') or '?'
             name = position.get('name', '')
-            ticker_for_file = ticker if ticker and ticker != '?' else f"ETF_{isin.replace(' ', '')[:12]}"
-
-            etf_details = None
-            source = 'failed'
-
-            # 1. Lokale Datei: nutzen wenn vorhanden und nicht veraltet
-            if ticker_for_file and not etf_parser.is_file_stale(ticker_for_file, etf_update_interval_days):
-                etf_details = etf_parser.parse_etf_file(ticker_for_file)
-                if etf_details:
-                    source = 'file'
-
-            # 2. Morningstar: holen, speichern, nutzen
-            if not etf_details:
-                ms_details = get_etf_details_from_morningstar(isin)
-                if ms_details:
-                    try:
-                        save_etf_detail_file(ms_details, ticker_for_file, source_label="Morningstar (auto)")
-                    except Exception as e:
-                        logger.warning("Konnte ETF-Detail-Datei nicht speichern: %s", e)
-                    etf_details = ms_details
-                    source = 'morningstar'
-
-            # 3. Fetcher-Fallback: holen, in unser Format konvertieren, speichern, nutzen
-            if not etf_details:
-                holdings_data = fetcher.get_etf_holdings(
-                    isin, use_cache=True, ticker_symbol=position.get('ticker_symbol', '')
-                )
-                if holdings_data and holdings_data.get('holdings'):
-                    # Typ ableiten: Commodity (XGDU), Money Market (XEON)
-                    fetcher_type = 'Stock'
-                    fetcher_name = holdings_data.get('name', name)
-                    fetcher_holdings = holdings_data['holdings']
-                    if any('physical gold' in (h.get('name') or '').lower() for h in fetcher_holdings):
-                        fetcher_type = 'Commodity'
-                    elif any(kw in (fetcher_name or '').lower() for kw in ('gold', 'physical gold', 'etc ', 'commodity')):
-                        fetcher_type = 'Commodity'
-                    elif any(kw in (h.get('name') or '').lower() for h in fetcher_holdings for kw in ('overnight', 'swap', 'rate')):
-                        fetcher_type = 'Money Market'
-                    elif any(kw in (fetcher_name or '').lower() for kw in ('overnight', 'money market', 'geldmarkt', 'xeon')):
-                        fetcher_type = 'Money Market'
-                    fetcher_details = {
-                        'isin': isin,
-                        'name': fetcher_name,
-                        'type': fetcher_type,
-                        'region': '',
-                        'currency': 'EUR',
-                        'ter': '',
-                        'country_allocation': [],
-                        'sector_allocation': [],
-                        'currency_allocation': [],
-                        'holdings': [
-                            {
-                                'name': h['name'],
-                                'weight': h['weight'],
-                                'currency': h.get('currency') or ('None' if fetcher_type == 'Commodity' else ('EUR' if fetcher_type == 'Money Market' else 'USD')),
-                                'sector': h.get('sector') or ('Commodity' if fetcher_type == 'Commodity' else ('Cash' if fetcher_type == 'Money Market' else 'Unknown')),
-                                'country': h.get('country', ''),
-                                'isin': h.get('isin', ''),
-                            }
-                            for h in fetcher_holdings
-                        ],
-                    }
-                    try:
-                        save_etf_detail_file(
-                            fetcher_details, ticker_for_file, source_label=f"{holdings_data.get('source', 'Fetcher')} (Fallback)"
-                        )
-                    except Exception as e:
-                        logger.warning("Konnte ETF-Detail-Datei nicht speichern: %s", e)
-                    etf_details = fetcher_details
-                    source = 'fetcher'
+            ticker_for_file = _etf_file_ticker(position, isin_ticker_map)
+            etf_details, source = resolved[_etf_resolution_key(position, ticker_for_file)]
 
             if etf_details:
                 etf_resolution.append({'isin': isin, 'ticker': ticker_for_file, 'name': name, 'source': source})
-                _expand_positions_using_etf_details(etf_details, position, portfolio_data, expanded, ticker_for_file)
+                if full_holdings:
+                    _expand_from_vector(etf_details, source, position, expanded, ticker_for_file)
+                elif incremental:
+                    _expand_from_template(etf_details, source, position, portfolio_data, expanded, ticker_for_file)
+                else:
+                    _expand_positions_using_etf_details(etf_details, position, portfolio_data, expanded, ticker_for_file)
             else:
                 etf_resolution.append({'isin': isin, 'ticker': ticker_for_file, 'name': name, 'source': 'failed'})
                 diagnostics = get_diagnostics()
@@ -262,6 +257,146 @@ def _expand_etf_holdings(
     return expanded, etf_resolution
 
 
+def _etf_file_ticker(position: Dict, isin_ticker_map: Dict[str, str]) -> str:
+    """Ticker bzw. Dateiname der ETF-Detail-Datei für eine ETF-Position"""
+    isin = position['isin']
+    ticker = isin_ticker_map.get(isin) or position.get('ticker_symbol', '') or '?'
+    return ticker if ticker and ticker != '?' else f"ETF_{isin.replace(' ', '')[:12]}"
+
+
+def _etf_resolution_key(position: Dict, ticker_for_file: str) -> Tuple[str, str, str]:
+    """Schlüssel der Auflösung; gleiche ETFs werden nur einmal aufgelöst"""
+    return position['isin'], ticker_for_file, position.get('ticker_symbol', '')
+
+
+def _resolve_etfs(
+    portfolio_data: Dict,
+    fetcher: ETFDataFetcher,
+    isin_ticker_map: Dict[str, str],
+    etf_update_interval_days: int = 30,
+    max_workers: int = _RESOLVE_MAX_WORKERS,
+) -> Dict[Tuple[str, str, str], Tuple[Optional[Dict], str]]:
+    """
+    Löst alle ETFs des Portfolios vor der Expansion auf.
+
+    Aktuelle lokale Dateien werden direkt gelesen. Veraltete oder fehlende ETFs werden
+    parallel über Morningstar bzw. Fetcher geholt, begrenzt durch max_workers und
+    _HOST_LIMITS. Die Expansion bleibt davon unberührt in Portfolio-Reihenfolge.
+
+    Returns:
+        {(isin, ticker_for_file, ticker_symbol): (etf_details | None, source)}
+    """
+    etf_parser = get_etf_details_parser()
+    resolved: Dict[Tuple[str, str, str], Tuple[Optional[Dict], str]] = {}
+    pending: Dict[Tuple[str, str, str], Tuple[Dict, str]] = {}
+
+    for position in portfolio_data['positions']:
+        if position['type'] != 'ETF' or not position.get('isin'):
+            continue
+        ticker_for_file = _etf_file_ticker(position, isin_ticker_map)
+        key = _etf_resolution_key(position, ticker_for_file)
+        if key in resolved or key in pending:
+            continue
+
+        # 1. Lokale Datei: nutzen wenn vorhanden und nicht veraltet
+        if ticker_for_file and not etf_parser.is_file_stale(ticker_for_file, etf_update_interval_days):
+            etf_details = etf_parser.parse_etf_file(ticker_for_file)
+            if etf_details:
+                resolved[key] = (etf_details, 'file')
+                continue
+        pending[key] = (position, ticker_for_file)
+
+    if pending:
+        # ISIN→Ticker (Yahoo-Fallback ohne PP-Ticker) vorab gebündelt über OpenFIGI
+        fetcher.prefetch_isin_tickers([
+            position['isin'] for position, _ in pending.values() if not position.get('ticker_symbol')
+        ])
+        workers = max(1, min(max_workers, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='etf-resolve') as pool:
+            futures = {
+                key: pool.submit(_fetch_etf_details, position, ticker_for_file, fetcher)
+                for key, (position, ticker_for_file) in pending.items()
+            }
+            for key, future in futures.items():
+                try:
+                    resolved[key] = future.result()
+                except Exception as e:
+                    logger.warning("ETF-Auflösung fehlgeschlagen (%s): %s", key[0], e)
+                    resolved[key] = (None, 'failed')
+
+    return resolved
+
+
+def _fetch_etf_details(
+    position: Dict,
+    ticker_for_file: str,
+    fetcher: ETFDataFetcher,
+) -> Tuple[Optional[Dict], str]:
+    """Holt ETF-Details online (Morningstar, sonst Fetcher) und speichert sie als Datei"""
+    isin = position['isin']
+    name = position.get('name', '')
+
+    # 2. Morningstar: holen, speichern, nutzen
+    with _HOST_LIMITS['morningstar']:
+        ms_details = get_etf_details_from_morningstar(isin)
+    if ms_details:
+        try:
+            save_etf_detail_file(ms_details, ticker_for_file, source_label="Morningstar (auto)")
+        except Exception as e:
+            logger.warning("Konnte ETF-Detail-Datei nicht speichern: %s", e)
+        return ms_details, 'morningstar'
+
+    # 3. Fetcher-Fallback: holen, in unser Format konvertieren, speichern, nutzen
+    with _HOST_LIMITS['fetcher']:
+        holdings_data = fetcher.get_etf_holdings(
+            isin, use_cache=True, ticker_symbol=position.get('ticker_symbol', '')
+        )
+    if holdings_data and holdings_data.get('holdings'):
+        # Typ ableiten: Commodity (XGDU), Money Market (XEON)
+        fetcher_type = 'Stock'
+        fetcher_name = holdings_data.get('name', name)
+        fetcher_holdings = holdings_data['holdings']
+        if any('physical gold' in (h.get('name') or '').lower() for h in fetcher_holdings):
+            fetcher_type = 'Commodity'
+        elif any(kw in (fetcher_name or '').lower() for kw in ('gold', 'physical gold', 'etc ', 'commodity')):
+            fetcher_type = 'Commodity'
+        elif any(kw in (h.get('name') or '').lower() for h in fetcher_holdings for kw in ('overnight', 'swap', 'rate')):
+            fetcher_type = 'Money Market'
+        elif any(kw in (fetcher_name or '').lower() for kw in ('overnight', 'money market', 'geldmarkt', 'xeon')):
+            fetcher_type = 'Money Market'
+        fetcher_details = {
+            'isin': isin,
+            'name': fetcher_name,
+            'type': fetcher_type,
+            'region': '',
+            'currency': 'EUR',
+            'ter': '',
+            'country_allocation': [],
+            'sector_allocation': [],
+            'currency_allocation': [],
+            'holdings': [
+                {
+                    'name': h['name'],
+                    'weight': h['weight'],
+                    'currency': h.get('currency') or ('None' if fetcher_type == 'Commodity' else ('EUR' if fetcher_type == 'Money Market' else 'USD')),
+                    'sector': h.get('sector') or ('Commodity' if fetcher_type == 'Commodity' else ('Cash' if fetcher_type == 'Money Market' else 'Unknown')),
+                    'country': h.get('country', ''),
+                    'isin': h.get('isin', ''),
+                }
+                for h in fetcher_holdings
+            ],
+        }
+        try:
+            save_etf_detail_file(
+                fetcher_details, ticker_for_file, source_label=f"{holdings_data.get('source', 'Fetcher')} (Fallback)"
+            )
+        except Exception as e:
+            logger.warning("Konnte ETF-Detail-Datei nicht speichern: %s", e)
+        return fetcher_details, 'fetcher'
+
+    return None, 'failed'
+
+
 def _expand_positions_using_etf_details(
     etf_details: Dict,
     position: Dict,
@@ -330,6 +465,7 @@ def _expand_positions_using_etf_details(
             'weight_in_portfolio': holding_value / portfolio_data['total_value'],
             'currency': holding_currency,
             'country': holding_country,
+            'isin': holding.get('isin', ''),
             'source_etf': position['name'],
             'source_etf_ticker': source_etf_ticker,
             'original_type': 'ETF_Holding',
@@ -407,66 +543,243 @@ def _expand_positions_using_etf_details(
         else:
             country_weights = [('Other', 1.0)]
 
-        # Eine Zeile pro (Sektor, Währung, Land) – alle drei Ansichten (Branche, Währung, Land) korrekt
-        logger.debug("Other Holdings: %d×%d×%d Kombinationen (Sektor×Währung×Land)",
+        # Faktorisiert statt Sektor×Währung×Land-Kreuzprodukt: ein Eintrag mit den drei
+        # Randverteilungen, jede Dimension projiziert auf ihre eigene (siehe _project)
+        logger.debug("Other Holdings: %d+%d+%d Randgewichte (Sektor, Währung, Land)",
                      len(sector_weights), len(currency_weights), len(country_weights))
-        for (sector_name_norm, s_w) in sector_weights:
-            for (currency_name, c_w) in currency_weights:
-                for (country_code, country_w) in country_weights:
-                    part_value = other_value * s_w * c_w * country_w
-                    if part_value < 0.001:  # Rundungsrausch vermeiden, aber keine Werte verlieren
-                        continue
-                    holding_info = {
-                        'name': other_holdings_entry['name'],
-                        'type': etf_details.get('type', 'Stock'),
-                        'value': part_value,
-                        'weight_in_portfolio': part_value / portfolio_data['total_value'],
-                        'currency': currency_name,
-                        'country': country_code,
-                        'source_etf': position['name'],
-                        'source_etf_ticker': source_etf_ticker,
-                        'original_type': 'ETF_Holding',
-                        'sector': sector_name_norm,
-                        'industry': sector_name_norm,
-                        'sector_source': 'etf_details',
-                        'etf_type': etf_details.get('type', 'Stock')
-                    }
-                    expanded.append(holding_info)
+        expanded.append({
+            'name': other_holdings_entry['name'],
+            'type': etf_details.get('type', 'Stock'),
+            'value': other_value,
+            'weight_in_portfolio': other_value / portfolio_data['total_value'],
+            'currency': currency_weights[0][0],
+            'country': country_weights[0][0],
+            'source_etf': position['name'],
+            'source_etf_ticker': source_etf_ticker,
+            'original_type': 'ETF_Holding',
+            'sector': sector_weights[0][0],
+            'industry': sector_weights[0][0],
+            'sector_source': 'etf_details',
+            'etf_type': etf_details.get('type', 'Stock'),
+            'marginals': {
+                'sector': sector_weights,
+                'currency': currency_weights,
+                'country': country_weights,
+            },
+        })
 
 
-def _calculate_asset_class_risk(expanded_positions: List[Dict], portfolio_data: Dict) -> pd.DataFrame:
+def _expand_from_template(
+    etf_details: Dict,
+    source: str,
+    position: Dict,
+    portfolio_data: Dict,
+    expanded,
+    source_etf_ticker: str = '',
+) -> None:
     """
-    Berechnet Klumpenrisiko nach Anlageklasse
-    Verwendet expanded_positions, damit ETFs nach ihrem Inhalt klassifiziert werden
+    Inkrementelle Variante von _expand_positions_using_etf_details.
+
+    Die Expansion eines ETFs wird einmal bei Positionswert 1.0 berechnet und unter
+    (ISIN, Ticker, Positionsname) mit der Version der Detail-Datei (mtime, Größe, Quelle)
+    gecacht. Weitere Aufrufe skalieren nur die gecachten Zeilen mit dem aktuellen Wert.
+    Ohne lesbare Detail-Datei wird direkt expandiert.
     """
-    asset_classes = {}
-    total_value = sum(pos['value'] for pos in expanded_positions)
+    file_version = get_etf_details_parser().file_version(source_etf_ticker)
+    if file_version is None:
+        _expand_positions_using_etf_details(etf_details, position, portfolio_data, expanded, source_etf_ticker)
+        return
+
+    key = (position['isin'], source_etf_ticker, position['name'])
+    version = (file_version, source)
+    with _exposure_templates_lock:
+        cached = _exposure_templates.get(key)
+    if cached is not None and cached[0] == version:
+        rows = cached[1]
+    else:
+        rows = []
+        _expand_positions_using_etf_details(
+            etf_details, {**position, 'value': 1.0}, {'total_value': 1.0}, rows, source_etf_ticker
+        )
+        with _exposure_templates_lock:
+            _exposure_templates[key] = (version, rows)
+        logger.debug("ETF-Expansion neu berechnet: %s (%d Zeilen)", position['name'], len(rows))
+
+    position_value = position['value']
+    total_value = portfolio_data['total_value']
+    for row in rows:
+        value = row['value'] * position_value
+        expanded.append({**row, 'value': value, 'weight_in_portfolio': value / total_value})
+
+
+def _expand_from_vector(
+    etf_details: Dict,
+    source: str,
+    position: Dict,
+    expanded: '_ExposureColumns',
+    source_etf_ticker: str = '',
+) -> None:
+    """
+    Full-Holdings-Variante von _expand_from_template.
+
+    Die Expansion bei Positionswert 1.0 wird zu einem _HoldingVector kompiliert und wie die
+    Templates je Datei-Version gecacht; pro Lauf wird der Vektor nur skaliert eingefügt.
+    Ohne lesbare Detail-Datei wird der Vektor ohne Cache kompiliert.
+    """
+    file_version = get_etf_details_parser().file_version(source_etf_ticker)
+    if file_version is None:
+        vector = _compile_holding_vector(etf_details, position, source_etf_ticker)
+    else:
+        key = (position['isin'], source_etf_ticker, position['name'])
+        version = (file_version, source)
+        with _holding_vectors_lock:
+            cached = _holding_vectors.get(key)
+        if cached is not None and cached[0] == version:
+            vector = cached[1]
+        else:
+            vector = _compile_holding_vector(etf_details, position, source_etf_ticker)
+            with _holding_vectors_lock:
+                _holding_vectors[key] = (version, vector)
+            logger.debug("ETF-Vektor neu kompiliert: %s (%d Holdings)", position['name'], len(vector.ids))
+
+    expanded.extend(vector, position['value'])
+
+
+def _compile_holding_vector(etf_details: Dict, position: Dict, source_etf_ticker: str) -> '_HoldingVector':
+    """Expandiert einen ETF bei Positionswert 1.0 und kompiliert ihn zu einem _HoldingVector"""
+    rows: List[Dict] = []
+    _expand_positions_using_etf_details(
+        etf_details, {**position, 'value': 1.0}, {'total_value': 1.0}, rows, source_etf_ticker
+    )
+    # Projektionen erst beim Einfügen (mit echtem Wert) gegen die Mindestgröße prüfen
+    columns = _ExposureColumns(capacity=max(len(rows), 16), min_part_value=0.0)
+    for row in rows:
+        columns.append(row)
+    return columns.to_vector()
+
+
+def _project(position: Dict, dimension: str, min_value: float = 0.001):
+    """
+    Liefert (Positions-Sicht, Wert)-Paare einer expandierten Position für eine Dimension.
+
+    Normale Positionen liefern sich selbst. Faktorisierte "Other Holdings" (mit 'marginals')
+    werden auf die Randverteilung der Dimension ('sector', 'currency', 'country') projiziert.
+    Länder ohne bekannten Namen fallen in _country_key auf die Währung zurück und werden
+    daher zusätzlich auf die Währungs-Randverteilung verteilt.
+    """
+    marginals = position.get('marginals')
+    if not marginals or dimension not in marginals:
+        yield position, position['value']
+        return
+
+    for label, weight in marginals[dimension]:
+        if dimension == 'country' and _country_code_to_name(label).startswith('Unbekannt'):
+            parts = [
+                ({'country': label, 'currency': currency}, weight * c_w)
+                for currency, c_w in marginals['currency']
+            ]
+        else:
+            parts = [({dimension: label}, weight)]
+        for fields, part_weight in parts:
+            part_value = position['value'] * part_weight
+            if part_value < min_value:  # Rundungsrausch: Anteile unter min_value (0.001 €) entfallen
+                continue
+            yield {**position, **fields}, part_value
+
+
+def _asset_class_key(position: Dict) -> str:
+    """Anlageklasse einer expandierten Position (ETFs sind bereits aufgelöst)"""
+    asset_class = position.get('type', 'Unknown')
     
-    for position in expanded_positions:
-        # Verwende den Typ aus expanded_positions (ETFs sind bereits aufgelöst)
-        asset_class = position.get('type', 'Unknown')
-        
-        # ETF-Holdings: Anlageklasse aus etf_type (Bond → Bond, Money Market → Cash, Stock → Stock)
-        if asset_class == 'ETF_Holding':
-            asset_class = position.get('etf_type', 'Stock')
-        
-        # Money Market ETFs werden als Cash dargestellt
-        if position.get('etf_type') == 'Money Market':
-            asset_class = 'Cash'
-        
-        if asset_class not in asset_classes:
-            asset_classes[asset_class] = 0.0
-        
-        asset_classes[asset_class] += position['value']
+    # ETF-Holdings: Anlageklasse aus etf_type (Bond → Bond, Money Market → Cash, Stock → Stock)
+    if asset_class == 'ETF_Holding':
+        asset_class = position.get('etf_type', 'Stock')
+    
+    # Money Market ETFs werden als Cash dargestellt
+    if position.get('etf_type') == 'Money Market':
+        asset_class = 'Cash'
+    
+    return asset_class
+
+
+def _sector_key(position: Dict) -> Optional[str]:
+    """Branche einer expandierten Position oder None, wenn sie keine echte Branche ist"""
+    sector = position.get('sector', 'Unknown')
+    # Money-Market-Holdings (z.B. TRS €STR) mit Unknown → Cash (für Cash-Checkbox-Filter)
+    if sector == 'Unknown' and position.get('etf_type') == 'Money Market':
+        sector = 'Cash'
+
+    # Skip cash collateral within non-Money-Market ETFs (Morningstar reports swap/repo
+    # positions as sector 'cash' inside stock ETFs — not real cash, just a technical artifact)
+    etf_type = position.get('etf_type')
+    if sector == 'Cash' and etf_type is not None and etf_type != 'Money Market':
+        return None
+
+    # Überspringe "Diversified" und "ETF" - diese sind keine echten Branchen
+    if sector in ['Diversified', 'ETF']:
+        return None
+    
+    return sector
+
+
+def _currency_key(position: Dict) -> Optional[str]:
+    """Währung einer expandierten Position oder None für Commodities (kein Währungsrisiko)"""
+    if position.get('type') == 'Commodity':
+        return None
+    return position.get('currency', 'EUR')
+
+
+def _country_key(position: Dict) -> Optional[str]:
+    """Land einer expandierten Position oder None für nicht aufgelöste ETFs"""
+    # Skip unresolved ETFs — they have no country information
+    if position.get('sector') == 'ETF':
+        return None
+    
+    # Land ermitteln (Priorität: explizit > ISIN > Währung)
+    country_name = None
+    
+    # 1. Prüfe explizites Country-Feld (aus User CSV / ETF-Holdings)
+    #    Morningstar liefert hier Klarnamen ("United States") oder ISO-3 ("USA"),
+    #    daher erst durch _allocation_country_name_to_code normalisieren.
+    if 'country' in position and position['country']:
+        country_code = _allocation_country_name_to_code(position['country'])
+        country_name = _country_code_to_name(country_code)
     
-    # DataFrame erstellen
+    # 2. Für Cash und Geldmarkt-ETFs: IMMER Währung verwenden (nicht ISIN!)
+    #    Cash hat oft keine ISIN, oder eine LU-ISIN die irreführend ist
+    if not country_name and position.get('type') == 'Cash':
+        currency = position.get('currency', 'EUR')
+        country_name = _currency_to_country(currency)
+    
+    # 3. Versuche aus ISIN (für direkte Positionen wie Aktien)
+    if not country_name or country_name.startswith('Unbekannt'):
+        isin = position.get('isin', '')
+        if isin and len(isin) >= 2:
+            country_code = isin[:2]
+            country_name = _country_code_to_name(country_code)
+    
+    # 4. Für ETF-Holdings ohne explizites Land: Verwende Währung als Proxy
+    if not country_name or country_name.startswith('Unbekannt'):
+        currency = position.get('currency', '') or (
+            'EUR' if position.get('etf_type') == 'Money Market' else ''
+        )
+        country_name = _currency_to_country(currency)
+    
+    if not country_name or country_name == 'Unbekannt':
+        country_name = 'Unbekannt'
+    
+    return country_name
+
+
+def _share_frame(label_col: str, values: Dict[str, float], total_value: float) -> pd.DataFrame:
+    """DataFrame (Label, Wert, Anteil) aus aggregierten Werten, absteigend sortiert"""
     df = pd.DataFrame([
         {
-            'Anlageklasse': asset_class,
+            label_col: label,
             'Wert (€)': value,
             'Anteil (%)': round((value / total_value) * 100, 1)
         }
-        for asset_class, value in asset_classes.items()
+        for label, value in values.items()
     ])
     
     df = df.sort_values('Wert (€)', ascending=False).reset_index(drop=True)
@@ -474,74 +787,48 @@ def _calculate_asset_class_risk(expanded_positions: List[Dict], portfolio_data:
     return df
 
 
-def _calculate_sector_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
+def _calculate_asset_class_risk(expanded_positions: List[Dict], portfolio_data: Dict) -> pd.DataFrame:
     """
-    Berechnet Klumpenrisiko nach Branche/Sektor
+    Berechnet Klumpenrisiko nach Anlageklasse
+    Verwendet expanded_positions, damit ETFs nach ihrem Inhalt klassifiziert werden
     """
-    sectors = {}
+    asset_classes = {}
     total_value = sum(pos['value'] for pos in expanded_positions)
     
     for position in expanded_positions:
-        sector = position.get('sector', 'Unknown')
-        # Money-Market-Holdings (z.B. TRS €STR) mit Unknown → Cash (für Cash-Checkbox-Filter)
-        if sector == 'Unknown' and position.get('etf_type') == 'Money Market':
-            sector = 'Cash'
-
-        # Skip cash collateral within non-Money-Market ETFs (Morningstar reports swap/repo
-        # positions as sector 'cash' inside stock ETFs — not real cash, just a technical artifact)
-        etf_type = position.get('etf_type')
-        if sector == 'Cash' and etf_type is not None and etf_type != 'Money Market':
-            continue
-
-        # Überspringe "Diversified" und "ETF" - diese sind keine echten Branchen
-        if sector in ['Diversified', 'ETF']:
-            continue
+        asset_class = _asset_class_key(position)
         
-        if sector not in sectors:
-            sectors[sector] = 0.0
+        if asset_class not in asset_classes:
+            asset_classes[asset_class] = 0.0
         
-        sectors[sector] += position['value']
-    
-    # DataFrame erstellen
-    df = pd.DataFrame([
-        {
-            'Sektor': sector,
-            'Wert (€)': value,
-            'Anteil (%)': round((value / total_value) * 100, 1)
-        }
-        for sector, value in sectors.items()
-    ])
-    
-    df = df.sort_values('Wert (€)', ascending=False).reset_index(drop=True)
+        asset_classes[asset_class] += position['value']
     
-    return df
+    return _share_frame('Anlageklasse', asset_classes, total_value)
 
 
-def _calculate_currency_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
+def _calculate_sector_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
     """
-    Berechnet Klumpenrisiko nach Währung
-    
-    WICHTIG: Commodities (Gold, Silber, etc.) haben KEIN Währungsrisiko
-    und werden daher nicht in die Berechnung einbezogen.
+    Berechnet Klumpenrisiko nach Branche/Sektor
     """
-    currencies = {}
-    total_value_with_currency_risk = 0.0  # Nur Positionen mit echtem Währungsrisiko
+    sectors = {}
+    total_value = sum(pos['value'] for pos in expanded_positions)
     
     for position in expanded_positions:
-        # Überspringe Commodities - sie haben kein Währungsrisiko
-        if position.get('type') == 'Commodity':
-            logger.debug("Währungsrisiko: %s (Commodity) übersprungen", position['name'])
-            continue
-        
-        currency = position.get('currency', 'EUR')
-        
-        if currency not in currencies:
-            currencies[currency] = 0.0
-        
-        currencies[currency] += position['value']
-        total_value_with_currency_risk += position['value']
+        for row, value in _project(position, 'sector'):
+            sector = _sector_key(row)
+            if sector is None:
+                continue
+            
+            if sector not in sectors:
+                sectors[sector] = 0.0
+            
+            sectors[sector] += value
     
-    # DataFrame erstellen (Prozentsätze basierend nur auf Positionen mit Währungsrisiko)
+    return _share_frame('Sektor', sectors, total_value)
+
+
+def _currency_frame(currencies: Dict[str, float], total_value_with_currency_risk: float) -> pd.DataFrame:
+    """Währungs-DataFrame; Prozentsätze nur bezogen auf Positionen mit Währungsrisiko"""
     df = pd.DataFrame([
         {
             'Währung': currency,
@@ -555,31 +842,37 @@ def _calculate_currency_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
     return df
 
 
-def _calculate_currency_risk_with_commodities(expanded_positions: List[Dict]) -> pd.DataFrame:
+def _calculate_currency_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
     """
-    Berechnet Klumpenrisiko nach Währung INKLUSIVE Commodities
+    Berechnet Klumpenrisiko nach Währung
     
-    Commodities werden als separate Kategorie "Commodity (kein Währungsrisiko)" angezeigt.
-    Dies ist optional für die Visualisierung.
+    WICHTIG: Commodities (Gold, Silber, etc.) haben KEIN Währungsrisiko
+    und werden daher nicht in die Berechnung einbezogen.
     """
     currencies = {}
-    commodity_value = 0.0
-    total_value = sum(pos['value'] for pos in expanded_positions)
+    total_value_with_currency_risk = 0.0  # Nur Positionen mit echtem Währungsrisiko
     
     for position in expanded_positions:
-        # Commodities separat sammeln
-        if position.get('type') == 'Commodity':
-            commodity_value += position['value']
-            continue
-        
-        currency = position.get('currency', 'EUR')
-        
-        if currency not in currencies:
-            currencies[currency] = 0.0
-        
-        currencies[currency] += position['value']
+        for row, value in _project(position, 'currency'):
+            currency = _currency_key(row)
+            # Überspringe Commodities - sie haben kein Währungsrisiko
+            if currency is None:
+                logger.debug("Währungsrisiko: %s (Commodity) übersprungen", row['name'])
+                continue
+            
+            if currency not in currencies:
+                currencies[currency] = 0.0
+            
+            currencies[currency] += value
+            total_value_with_currency_risk += value
     
-    # DataFrame erstellen
+    return _currency_frame(currencies, total_value_with_currency_risk)
+
+
+def _currency_with_commodities_frame(
+    currencies: Dict[str, float], commodity_value: float, total_value: float
+) -> pd.DataFrame:
+    """Währungs-DataFrame mit Commodities als eigener Kategorie"""
     rows = [
         {
             'Währung': currency,
@@ -603,6 +896,33 @@ def _calculate_currency_risk_with_commodities(expanded_positions: List[Dict]) ->
     return df
 
 
+def _calculate_currency_risk_with_commodities(expanded_positions: List[Dict]) -> pd.DataFrame:
+    """
+    Berechnet Klumpenrisiko nach Währung INKLUSIVE Commodities
+    
+    Commodities werden als separate Kategorie "Commodity (kein Währungsrisiko)" angezeigt.
+    Dies ist optional für die Visualisierung.
+    """
+    currencies = {}
+    commodity_value = 0.0
+    total_value = sum(pos['value'] for pos in expanded_positions)
+    
+    for position in expanded_positions:
+        for row, value in _project(position, 'currency'):
+            currency = _currency_key(row)
+            # Commodities separat sammeln
+            if currency is None:
+                commodity_value += value
+                continue
+            
+            if currency not in currencies:
+                currencies[currency] = 0.0
+            
+            currencies[currency] += value
+    
+    return _currency_with_commodities_frame(currencies, commodity_value, total_value)
+
+
 def _calculate_country_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
     """
     Berechnet Klumpenrisiko nach Land (basierend auf ISIN oder Handelsplatz)
@@ -611,61 +931,19 @@ def _calculate_country_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
     total_value = sum(pos['value'] for pos in expanded_positions)
     
     for position in expanded_positions:
-        # Skip unresolved ETFs — they have no country information
-        if position.get('sector') == 'ETF':
-            continue
-        
-        # Land ermitteln (Priorität: explizit > ISIN > Währung)
-        country_name = None
-        
-        # 1. Prüfe explizites Country-Feld (aus User CSV / ETF-Holdings)
-        #    Morningstar liefert hier Klarnamen ("United States") oder ISO-3 ("USA"),
-        #    daher erst durch _allocation_country_name_to_code normalisieren.
-        if 'country' in position and position['country']:
-            country_code = _allocation_country_name_to_code(position['country'])
-            country_name = _country_code_to_name(country_code)
-        
-        # 2. Für Cash und Geldmarkt-ETFs: IMMER Währung verwenden (nicht ISIN!)
-        #    Cash hat oft keine ISIN, oder eine LU-ISIN die irreführend ist
-        if not country_name and position.get('type') == 'Cash':
-            currency = position.get('currency', 'EUR')
-            country_name = _currency_to_country(currency)
-        
-        # 3. Versuche aus ISIN (für direkte Positionen wie Aktien)
-        if not country_name or country_name.startswith('Unbekannt'):
-            isin = position.get('isin', '')
-            if isin and len(isin) >= 2:
-                country_code = isin[:2]
-                country_name = _country_code_to_name(country_code)
-        
-        # 4. Für ETF-Holdings ohne explizites Land: Verwende Währung als Proxy
-        if not country_name or country_name.startswith('Unbekannt'):
-            currency = position.get('currency', '') or (
-                'EUR' if position.get('etf_type') == 'Money Market' else ''
-            )
-            country_name = _currency_to_country(currency)
-        
-        if not country_name or country_name == 'Unbekannt':
-            country_name = 'Unbekannt'
-        
-        if country_name not in countries:
-            countries[country_name] = 0.0
-        countries[country_name] += position['value']
-    
-    df = pd.DataFrame([
-        {
-            'Land': country,
-            'Wert (€)': value,
-            'Anteil (%)': round((value / total_value) * 100, 1)
-        }
-        for country, value in countries.items()
-    ])
-    
-    df = df.sort_values('Wert (€)', ascending=False).reset_index(drop=True)
+        for row, value in _project(position, 'country'):
+            country_name = _country_key(row)
+            if country_name is None:
+                continue
+            
+            if country_name not in countries:
+                countries[country_name] = 0.0
+            countries[country_name] += value
     
-    return df
+    return _share_frame('Land', countries, total_value)
 
 
+@lru_cache(maxsize=1024)
 def _currency_to_country(currency: str) -> str:
     """
     Mapped Währung zu wahrscheinlichstem Land
@@ -698,6 +976,7 @@ def _currency_to_country(currency: str) -> str:
     return currency_country_map.get(currency, 'Unbekannt')
 
 
+@lru_cache(maxsize=1024)
 def _allocation_country_name_to_code(name: str) -> str:
     """
     Normalizes any country identifier (full English/German name, ISO-3, ISO-2)
@@ -750,6 +1029,7 @@ def _allocation_country_name_to_code(name: str) -> str:
     return allocation_to_code.get(name_clean, 'Other')
 
 
+@lru_cache(maxsize=1024)
 def _country_code_to_name(code: str) -> str:
     """
     Konvertiert ISO 3166-1 Alpha-2 Ländercode (oder 3-Buchstaben) zu Ländername
@@ -805,85 +1085,104 @@ def _country_code_to_name(code: str) -> str:
     return country_map.get(code, f'Unbekannt ({code})')
 
 
-def _calculate_position_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
+def _merge_position_entry(positions: Dict[int, Dict], position: Dict) -> int:
     """
-    Berechnet Klumpenrisiko nach Einzelpositionen
-    Dies ist die wichtigste Analyse - zeigt echte Exposition inkl. ETF-Durchschau
+    Führt eine expandierte Position in die Einzelpositions-Aggregation ein
+    (Anzeigename, Ticker, Quellen, Sektor-Konfliktauflösung) – ohne den Wert.
+
+    Returns:
+        Wertpapier-ID der Position (siehe _security_id)
     """
-    # Positionen nach Namen gruppieren (normalisiert für besseres Matching)
-    positions = {}
-    total_value = sum(pos['value'] for pos in expanded_positions)
+    name = position['name']
+    security_id = _security_id(position)
     
-    for position in expanded_positions:
-        # Normalisiere Namen für besseres Matching
-        name = position['name']
-        name_normalized = _normalize_position_name(name)
-        
-        # Spezialfall: Alle Cash-Positionen zusammenfassen
-        if position.get('type') == 'Cash':
-            name_normalized = 'cash_all'  # Einheitlicher Key für alle Cash
-            display_name = 'Cash'  # Einheitlicher Anzeigename
-        # Money-Market-Holdings mit kryptischem Namen (TRS, Swap, €STR): Ticker statt Name
-        elif (position.get('etf_type') == 'Money Market'
-              and position.get('source_etf_ticker')
-              and _is_cryptic_money_market_holding(name)):
-            display_name = position['source_etf_ticker']
-        else:
-            display_name = name
-        
-        sector_for_pos = position.get('sector', 'Unknown')
-        if sector_for_pos == 'Unknown' and position.get('etf_type') == 'Money Market':
-            sector_for_pos = 'Cash'
-        if name_normalized not in positions:
-            ticker_val = position.get('ticker_symbol', '') or (
-                position.get('source_etf_ticker', '') if (
-                    position.get('etf_type') == 'Money Market' and _is_cryptic_money_market_holding(name)
-                ) else ''
-            )
-            positions[name_normalized] = {
-                'display_name': display_name,
-                'ticker': ticker_val,
-                'value': 0.0,
-                'sources': [],
-                'sector': sector_for_pos,
-                'type': position.get('type', 'Unknown'),
-                'sector_priority': 0  # 0=niedrig (ETF), 1=mittel (ISIN), 2=hoch (CSV)
-            }
-        
-        # Ticker-Symbol aktualisieren wenn vorhanden und noch nicht gesetzt
-        if position.get('ticker_symbol') and not positions[name_normalized]['ticker']:
-            positions[name_normalized]['ticker'] = position.get('ticker_symbol', '')
-        elif (position.get('source_etf_ticker') and not positions[name_normalized]['ticker']
-              and position.get('etf_type') == 'Money Market' and _is_cryptic_money_market_holding(name)):
-            positions[name_normalized]['ticker'] = position['source_etf_ticker']
-        
-        positions[name_normalized]['value'] += position['value']
-        
-        # Source ETF hinzufügen wenn vorhanden
-        if position.get('source_etf'):
-            if position['source_etf'] not in positions[name_normalized]['sources']:
-                positions[name_normalized]['sources'].append(position['source_etf'])
-        
-        # KONFLIKTRESOLUTION: Höchste Priorität gewinnt
-        # Priorität 2: Direktposition aus CSV (sector_source == 'csv')
-        # Priorität 1: ISIN-basiert oder ETF-Details (sector_source == 'isin' oder 'etf_details')
-        # Priorität 0: Aus ETF-Holdings (sector_source == 'etf' oder None)
-        current_priority = positions[name_normalized]['sector_priority']
-        new_priority = 0  # Default: ETF
-        
-        # Prüfe ob Position aus CSV stammt (höchste Priorität)
-        if position.get('sector_source') == 'csv':
-            new_priority = 2
-        elif position.get('sector_source') in ['isin', 'etf_details']:
-            new_priority = 1
-        
-        # Wenn neue Position höhere Priorität hat, überschreibe Sektor
-        if new_priority > current_priority:
-            positions[name_normalized]['sector'] = sector_for_pos
-            positions[name_normalized]['sector_priority'] = new_priority
-            logger.debug("Sektor-Override: %s -> %s (Priorität %d)", name, position.get('sector'), new_priority)
+    # Spezialfall: Alle Cash-Positionen zusammenfassen (eine ID, siehe _security_id)
+    if position.get('type') == 'Cash':
+        display_name = 'Cash'  # Einheitlicher Anzeigename
+    # Money-Market-Holdings mit kryptischem Namen (TRS, Swap, €STR): Ticker statt Name
+    elif (position.get('etf_type') == 'Money Market'
+          and position.get('source_etf_ticker')
+          and _is_cryptic_money_market_holding(name)):
+        display_name = position['source_etf_ticker']
+    else:
+        display_name = name
+    
+    sector_for_pos = position.get('sector', 'Unknown')
+    if sector_for_pos == 'Unknown' and position.get('etf_type') == 'Money Market':
+        sector_for_pos = 'Cash'
+    if security_id not in positions:
+        ticker_val = position.get('ticker_symbol', '') or (
+            position.get('source_etf_ticker', '') if (
+                position.get('etf_type') == 'Money Market' and _is_cryptic_money_market_holding(name)
+            ) else ''
+        )
+        positions[security_id] = {
+            'display_name': display_name,
+            'ticker': ticker_val,
+            'value': 0.0,
+            'sources': [],
+            'sector': sector_for_pos,
+            'type': position.get('type', 'Unknown'),
+            'sector_priority': 0  # 0=niedrig (ETF), 1=mittel (ISIN), 2=hoch (CSV)
+        }
+    
+    # Ticker-Symbol aktualisieren wenn vorhanden und noch nicht gesetzt
+    if position.get('ticker_symbol') and not positions[security_id]['ticker']:
+        positions[security_id]['ticker'] = position.get('ticker_symbol', '')
+    elif (position.get('source_etf_ticker') and not positions[security_id]['ticker']
+          and position.get('etf_type') == 'Money Market' and _is_cryptic_money_market_holding(name)):
+        positions[security_id]['ticker'] = position['source_etf_ticker']
+    
+    # Source ETF hinzufügen wenn vorhanden
+    if position.get('source_etf'):
+        if position['source_etf'] not in positions[security_id]['sources']:
+            positions[security_id]['sources'].append(position['source_etf'])
     
-    # DataFrame erstellen
+    # KONFLIKTRESOLUTION: Höchste Priorität gewinnt
+    # Priorität 2: Direktposition aus CSV (sector_source == 'csv')
+    # Priorität 1: ISIN-basiert oder ETF-Details (sector_source == 'isin' oder 'etf_details')
+    # Priorität 0: Aus ETF-Holdings (sector_source == 'etf' oder None)
+    current_priority = positions[security_id]['sector_priority']
+    new_priority = 0  # Default: ETF
+    
+    # Prüfe ob Position aus CSV stammt (höchste Priorität)
+    if position.get('sector_source') == 'csv':
+        new_priority = 2
+    elif position.get('sector_source') in ['isin', 'etf_details']:
+        new_priority = 1
+    
+    # Wenn neue Position höhere Priorität hat, überschreibe Sektor
+    if new_priority > current_priority:
+        positions[security_id]['sector'] = sector_for_pos
+        positions[security_id]['sector_priority'] = new_priority
+        logger.debug("Sektor-Override: %s -> %s (Priorität %d)", name, position.get('sector'), new_priority)
+    
+    return security_id
+
+
+def _merge_position_entries(target: Dict, entry: Dict) -> None:
+    """
+    Führt einen aggregierten Eintrag (aus _merge_position_entry) in einen bestehenden ein –
+    gleiches Ergebnis, als wären die Positionen von entry einzeln eingeführt worden.
+    """
+    if entry['ticker'] and not target['ticker']:
+        target['ticker'] = entry['ticker']
+    for source in entry['sources']:
+        if source not in target['sources']:
+            target['sources'].append(source)
+    if entry['sector_priority'] > target['sector_priority']:
+        target['sector'] = entry['sector']
+        target['sector_priority'] = entry['sector_priority']
+
+
+def _positions_frame(positions: Dict[int, Dict], total_value: float) -> pd.DataFrame:
+    """
+    Einzelpositions-DataFrame aus der Aggregation von _merge_position_entry
+
+    Die ISIN (aus dem Security Master, leer ohne ISIN) identifiziert die Position auch
+    in der Historie (siehe database.label_key).
+    """
+    master = get_security_master()
     df = pd.DataFrame([
         {
             'Position': data['display_name'],
@@ -892,9 +1191,10 @@ def _calculate_position_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
             'Anteil (%)': round((data['value'] / total_value) * 100, 1),
             'Sektor': data['sector'],
             'Typ': data['type'],
-            'Quellen': ', '.join(data['sources']) if data['sources'] else 'Direkt'
+            'Quellen': ', '.join(data['sources']) if data['sources'] else 'Direkt',
+            'ISIN': master.isin(security_id) or '',
         }
-        for name, data in positions.items()
+        for security_id, data in positions.items()
     ])
     
     df = df.sort_values('Wert (€)', ascending=False).reset_index(drop=True)
@@ -902,6 +1202,282 @@ def _calculate_position_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
     return df
 
 
+def _calculate_position_risk(expanded_positions: List[Dict]) -> pd.DataFrame:
+    """
+    Berechnet Klumpenrisiko nach Einzelpositionen
+    Dies ist die wichtigste Analyse - zeigt echte Exposition inkl. ETF-Durchschau
+    """
+    # Positionen nach Wertpapier-ID gruppieren (ISIN, sonst normalisierter Name)
+    positions = {}
+    total_value = sum(pos['value'] for pos in expanded_positions)
+    
+    for position in expanded_positions:
+        security_id = _merge_position_entry(positions, position)
+        positions[security_id]['value'] += position['value']
+    
+    return _positions_frame(positions, total_value)
+
+
+_MISSING = object()
+
+
+class _ExposureColumns:
+    """
+    Spaltenweiser Speicher für expandierte Positionen (columnar Engine).
+
+    Ersetzt die Liste von Dicts: Jede per append() übergebene Position wird sofort
+    in vorallokierte NumPy-Spalten geschrieben – Wert plus ein Kategorie-Code pro
+    Risiko-Dimension. Die Codes werden in Reihenfolge des ersten Auftretens vergeben,
+    die Gruppensummen per np.bincount sequentiell gebildet. Dadurch entsprechen die
+    DataFrames aus to_risk_frames() exakt denen der _calculate_*_risk-Funktionen.
+
+    Faktorisierte "Other Holdings" belegen eine Zeile für Anlageklasse/Einzelposition
+    plus je eine Zeile pro Randgewicht, die nur in ihrer Dimension einen Code trägt.
+
+    Einzelpositionen tragen als Label ihre Wertpapier-ID; kompilierte ETF-Vektoren
+    (Full-Holdings-Modus) lassen sich per extend() ohne Zeilen-Dicts einfügen.
+    """
+
+    _EXCLUDED = -1       # Position gehört nicht in die Dimension (z.B. Commodity bei Währung)
+    _NOT_PROJECTED = -2  # Zeile ist eine Projektion für eine andere Dimension
+
+    # Dimension -> Positionsfelder, von denen der Schlüssel abhängt (für Memoization)
+    _KEY_FIELDS = {
+        'asset_class': ('type', 'etf_type'),
+        'sector': ('sector', 'etf_type'),
+        'currency': ('type', 'currency'),
+        'country': ('sector', 'country', 'type', 'currency', 'isin', 'etf_type'),
+    }
+    _KEY_FUNCS = {
+        'asset_class': _asset_class_key,
+        'sector': _sector_key,
+        'currency': _currency_key,
+        'country': _country_key,
+    }
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        min_part_value: float = 0.001,
+    ):
+        self._size = 0
+        self._values = np.empty(capacity, dtype=np.float64)
+        self._codes = {
+            dim: np.empty(capacity, dtype=np.int32)
+            for dim in (*self._KEY_FIELDS, 'positions')
+        }
+        self._labels: Dict[str, Dict] = {dim: {} for dim in self._codes}
+        self._key_cache: Dict[str, Dict[tuple, Optional[str]]] = {dim: {} for dim in self._KEY_FIELDS}
+        self._positions: Dict[int, Dict] = {}
+        # Wertpapier-ID -> Positions-Code in diesem Speicher (-1 = noch nicht enthalten)
+        self._security_codes = np.full(0, -1, dtype=np.int32)
+        self._min_part_value = min_part_value
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self) -> None:
+        capacity = len(self._values) * 2
+        self._values = np.resize(self._values, capacity)
+        for dim, codes in self._codes.items():
+            self._codes[dim] = np.resize(codes, capacity)
+
+    def _code(self, dim: str, position: Dict) -> int:
+        """Kategorie-Code einer Position in einer Dimension (Schlüssel memoisiert je Feldkombination)"""
+        get = position.get
+        cache_key = tuple([get(f, _MISSING) for f in self._KEY_FIELDS[dim]])
+        cache = self._key_cache[dim]
+        if cache_key in cache:
+            label = cache[cache_key]
+        else:
+            label = cache[cache_key] = self._KEY_FUNCS[dim](position)
+        return self._label_code(dim, label)
+
+    def _label_code(self, dim: str, label: Optional[str]) -> int:
+        if label is None:
+            return self._EXCLUDED
+        labels = self._labels[dim]
+        code = labels.get(label)
+        if code is None:
+            code = labels[label] = len(labels)
+        return code
+
+    def _position_code(self, security_id: int) -> int:
+        code = self._label_code('positions', security_id)
+        self._reserve_security_codes(security_id + 1)
+        self._security_codes[security_id] = code
+        return code
+
+    def _reserve_security_codes(self, size: int) -> None:
+        missing = size - len(self._security_codes)
+        if missing > 0:
+            self._security_codes = np.concatenate([
+                self._security_codes, np.full(max(missing, len(self._security_codes)), -1, dtype=np.int32)
+            ])
+
+    def _append_row(self, value: float, codes: Dict[str, int]) -> None:
+        if self._size == len(self._values):
+            self._grow()
+        i = self._size
+        self._values[i] = value
+        for dim, code in codes.items():
+            self._codes[dim][i] = code
+        self._size += 1
+
+    def append(self, position: Dict) -> None:
+        """Schreibt eine expandierte Position in die Spalten (gleiche Dicts wie die Listen-Variante)"""
+        marginals = position.get('marginals') or {}
+        codes = {
+            dim: self._NOT_PROJECTED if dim in marginals else self._code(dim, position)
+            for dim in self._KEY_FIELDS
+        }
+        security_id = _merge_position_entry(self._positions, position)
+        codes['positions'] = self._position_code(security_id)
+        self._append_row(position['value'], codes)
+
+        for projected_dim in marginals:
+            for row, value in _project(position, projected_dim, self._min_part_value):
+                codes = {dim: self._NOT_PROJECTED for dim in self._codes}
+                codes[projected_dim] = self._code(projected_dim, row)
+                self._append_row(value, codes)
+
+    def to_vector(self) -> '_HoldingVector':
+        """Inhalt als _HoldingVector (Werte unskaliert)"""
+        security_ids = list(self._labels['positions'])
+        return _HoldingVector(
+            values=self._values[:self._size].copy(),
+            codes={dim: codes[:self._size].copy() for dim, codes in self._codes.items()},
+            labels={dim: list(self._labels[dim]) for dim in self._KEY_FIELDS},
+            ids=np.array(security_ids, dtype=np.int64),
+            entries=[self._positions[security_id] for security_id in security_ids],
+        )
+
+    def _first_seen(self, local: np.ndarray) -> np.ndarray:
+        """Verwendete lokale Codes (>= 0) in Reihenfolge ihres ersten Auftretens"""
+        used, first = np.unique(local[local >= 0], return_index=True)
+        return used[np.argsort(first, kind='stable')]
+
+    def extend(self, vector: '_HoldingVector', scale: float) -> None:
+        """
+        Fügt einen kompilierten ETF-Vektor mit Positionswert scale ein (Full-Holdings-Modus)
+
+        Entspricht append() für jede expandierte Zeile: Werte werden als Array skaliert,
+        lokale Codes über kleine Abbildungs-Arrays übersetzt; Holdings, die schon aus
+        anderen ETFs enthalten sind, erhalten denselben Positions-Code (dünne Vektorsumme).
+        """
+        values = vector.values * scale
+        local_codes = vector.codes
+        # Projektionen unter der Mindestgröße verwerfen (wie _project mit echtem Wert)
+        keep = (local_codes['positions'] != self._NOT_PROJECTED) | (values >= self._min_part_value)
+        if not keep.all():
+            values = values[keep]
+            local_codes = {dim: codes[keep] for dim, codes in local_codes.items()}
+
+        n = len(values)
+        while self._size + n > len(self._values):
+            self._grow()
+        rows = slice(self._size, self._size + n)
+        self._values[rows] = values
+
+        for dim in self._KEY_FIELDS:
+            labels = vector.labels[dim]
+            mapping = np.zeros(max(len(labels), 1), dtype=np.int32)
+            for code in self._first_seen(local_codes[dim]).tolist():
+                mapping[code] = self._label_code(dim, labels[code])
+            local = local_codes[dim]
+            self._codes[dim][rows] = np.where(local >= 0, mapping[np.maximum(local, 0)], local)
+
+        # Einzelpositionen: neue Holdings anhängen, bekannte zusammenführen
+        used = self._first_seen(local_codes['positions'])
+        ids = vector.ids[used]
+        if len(ids):
+            self._reserve_security_codes(int(ids.max()) + 1)
+        position_codes = self._security_codes[ids]
+        new = position_codes < 0
+        position_labels = self._labels['positions']
+        position_codes[new] = np.arange(len(position_labels), len(position_labels) + int(new.sum()))
+        self._security_codes[ids[new]] = position_codes[new]
+        for local_code, security_id, is_new in zip(used.tolist(), ids.tolist(), new.tolist()):
+            entry = vector.entries[local_code]
+            if is_new:
+                position_labels[security_id] = len(position_labels)
+                self._positions[security_id] = {**entry, 'sources': list(entry['sources'])}
+            else:
+                _merge_position_entries(self._positions[security_id], entry)
+
+        mapping = np.zeros(max(len(vector.ids), 1), dtype=np.int32)
+        mapping[used] = position_codes
+        local = local_codes['positions']
+        self._codes['positions'][rows] = np.where(local >= 0, mapping[np.maximum(local, 0)], local)
+        self._size += n
+
+    def total_value(self) -> float:
+        """Summe aller Werte (gleiche Summationsreihenfolge wie sum() über die Liste)"""
+        values = self._values[:self._size]
+        return sum(values[self._codes['asset_class'][:self._size] >= 0].tolist())
+
+    def _group_sums(self, dim: str) -> Dict:
+        """Wertsumme je Label in Reihenfolge des ersten Auftretens"""
+        codes = self._codes[dim][:self._size]
+        labels = self._labels[dim]
+        mask = codes >= 0
+        sums = np.bincount(codes[mask], weights=self._values[:self._size][mask], minlength=len(labels))
+        return dict(zip(labels, sums.tolist()))
+
+    def to_risk_frames(self) -> Dict[str, pd.DataFrame]:
+        """Alle Risiko-Dimensionen aus den Spalten (identisch zu den _calculate_*_risk-Funktionen)"""
+        values = self._values[:self._size]
+        total_value = self.total_value()
+
+        currency_codes = self._codes['currency'][:self._size]
+        currencies = self._group_sums('currency')
+        total_value_with_currency_risk = sum(values[currency_codes >= 0].tolist())
+        commodity_value = sum(values[currency_codes == self._EXCLUDED].tolist())
+
+        for key, value in self._group_sums('positions').items():
+            self._positions[key]['value'] = value
+
+        return {
+            'asset_class': _share_frame('Anlageklasse', self._group_sums('asset_class'), total_value),
+            'sector': _share_frame('Sektor', self._group_sums('sector'), total_value),
+            'currency': _currency_frame(currencies, total_value_with_currency_risk),
+            'currency_with_commodities': _currency_with_commodities_frame(currencies, commodity_value, total_value),
+            'country': _share_frame('Land', self._group_sums('country'), total_value),
+            'positions': _positions_frame(self._positions, total_value),
+        }
+
+
+class _HoldingVector:
+    """
+    Kompilierte ETF-Expansion bei Positionswert 1.0 (Full-Holdings-Modus)
+
+    values: Gewichte je Zeile (inkl. Projektionszeilen von "Other Holdings")
+    codes: Lokale Codes je Dimension (siehe _ExposureColumns); 'positions' indiziert ids/entries
+    labels: Lokale Labels je Risiko-Dimension
+    ids: Wertpapier-IDs (Security Master) der enthaltenen Einzelpositionen
+    entries: Aggregierte Einzelpositions-Einträge (aus _merge_position_entry) je Wertpapier
+    """
+
+    __slots__ = ('values', 'codes', 'labels', 'ids', 'entries')
+
+    def __init__(self, values, codes, labels, ids, entries):
+        self.values = values
+        self.codes = codes
+        self.labels = labels
+        self.ids = ids
+        self.entries = entries
+
+
+def _security_id(position: Dict) -> int:
+    """
+    Wertpapier-ID einer Position im Security Master: über die ISIN, sonst den normalisierten
+    Namen. Alle Cash-Positionen teilen sich CASH_SECURITY_ID.
+    """
+    if position.get('type') == 'Cash':
+        return CASH_SECURITY_ID
+    return get_security_master().resolve(position.get('isin'), position['name'])
+
+
 def _is_cryptic_money_market_holding(name: str) -> bool:
     """Erkennt kryptische Money-Market-Holding-Namen (TRS, Swap, €STR, etc.)"""
     if not name:
@@ -910,34 +1486,6 @@ def _is_cryptic_money_market_holding(name: str) -> bool:
     return any(kw in n for kw in ('trs ', 'trs solactive', 'swap', 'overnight', '€str', 'estr', 'rate swap'))
 
 
-def _normalize_position_name(name: str) -> str:
-    """
-    Normalisiert Positionsnamen für besseres Matching
-    
-    Beispiel:
-    - "APPLE INC" -> "apple inc"
-    - "Apple Inc" -> "apple inc"
-    - "Apple Inc." -> "apple inc"
-    """
-    if not name:
-        return ''
-    
-    # Kleinschreibung, trimmen, mehrfache Leerzeichen entfernen
-    normalized = name.lower().strip()
-    normalized = ' '.join(normalized.split())
-    
-    # Entferne gängige Suffixe
-    suffixes = [' inc.', ' inc', ' corp.', ' corp', ' ltd.', ' ltd', 
-                ' plc', ' ag', ' se', ' sa', ' co.', ' co',
-                ' class a', ' class b', ' class c']
-    
-    for suffix in suffixes:
-        if normalized.endswith(suffix):
-            normalized = normalized[:-len(suffix)].strip()
-    
-    return normalized
-
-
 def _get_stock_currency(isin: str, default_currency: str) -> str:
     """
     Bestimmt die Handelswährung einer Aktie basierend auf der ISIN
@@ -1020,6 +1568,7 @@ def _assign_sectors_from_allocation(
     return assigned
 
 
+@lru_cache(maxsize=1024)
 def _normalize_sector_name(sector: str, etf_type: str = '') -> str:
     """
     Normalisiert Branchennamen zu einheitlichen Kategorien.
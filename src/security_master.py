@@ -0,0 +1,241 @@
+"""
+Security Master
+Persistente Zuordnung von ISINs und normalisierten Namen zu kanonischen Wertpapier-IDs
+"""
+
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Reservierte ID: alle Cash-Positionen werden zu einer Position zusammengefasst
+CASH_SECURITY_ID = 0
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS securities (
+        id INTEGER PRIMARY KEY,
+        isin TEXT UNIQUE,
+        name TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS security_names (
+        name_key TEXT PRIMARY KEY,
+        security_id INTEGER NOT NULL REFERENCES securities(id)
+    );
+"""
+
+
+def normalize_position_name(name: str) -> str:
+    """
+    Normalisiert Positionsnamen für besseres Matching
+
+    Beispiel:
+    - "APPLE INC" -> "apple inc"
+    - "Apple Inc" -> "apple inc"
+    - "Apple Inc." -> "apple inc"
+    """
+    if not name:
+        return ''
+
+    # Kleinschreibung, trimmen, mehrfache Leerzeichen entfernen
+    normalized = name.lower().strip()
+    normalized = ' '.join(normalized.split())
+
+    # Entferne gängige Suffixe
+    suffixes = [' inc.', ' inc', ' corp.', ' corp', ' ltd.', ' ltd',
+                ' plc', ' ag', ' se', ' sa', ' co.', ' co',
+                ' class a', ' class b', ' class c']
+
+    for suffix in suffixes:
+        if normalized.endswith(suffix):
+            normalized = normalized[:-len(suffix)].strip()
+
+    return normalized
+
+
+def normalize_isin(isin: Optional[str]) -> Optional[str]:
+    """ISIN in Großbuchstaben oder None, wenn keine plausible ISIN (12 Zeichen, Ländercode)"""
+    if not isin:
+        return None
+    isin = str(isin).strip().upper()
+    if len(isin) == 12 and isin[:2].isalpha() and isin.isalnum():
+        return isin
+    return None
+
+
+class SecurityMaster:
+    """
+    Kanonische Wertpapier-IDs für Einzelpositionen (SQLite: data/security_master.db)
+
+    Auflösung über die ISIN, ohne ISIN über den normalisierten Namen. Ein Name zeigt auf
+    das Wertpapier, mit dem er zuerst gesehen wurde; ein nur über den Namen bekanntes
+    Wertpapier übernimmt die ISIN, sobald es mit einer auftaucht. Verschiedene ISINs
+    (z.B. Alphabet Class A/C) bleiben getrennte Wertpapiere, auch bei gleichem Namen.
+
+    Die Zuordnung liegt vollständig im Speicher; neue Einträge werden gesammelt und per
+    flush() in einer Transaktion geschrieben. IDs werden nie neu vergeben.
+    """
+
+    def __init__(self, db_path: str = "data/security_master.db"):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._by_isin: Dict[str, int] = {}
+        self._by_name: Dict[str, int] = {}
+        self._isins: Dict[int, Optional[str]] = {}
+        self._names: Dict[int, str] = {}
+        # (ISIN, Name) wie übergeben -> ID, spart Normalisierung bei wiederholten Läufen
+        self._resolved: Dict[Tuple[str, str], int] = {}
+        self._next_id = CASH_SECURITY_ID + 1
+        self._dirty_securities = set()
+        self._dirty_names = set()
+        self._load()
+
+    def _load(self):
+        if not self.db_path.exists():
+            return
+        try:
+            with closing(sqlite3.connect(self.db_path)) as conn:
+                conn.executescript(_SCHEMA)
+                for security_id, isin, name in conn.execute("SELECT id, isin, name FROM securities"):
+                    self._isins[security_id] = isin
+                    self._names[security_id] = name
+                    if isin:
+                        self._by_isin[isin] = security_id
+                self._by_name.update(conn.execute("SELECT name_key, security_id FROM security_names"))
+        except sqlite3.Error as e:
+            logger.warning("Security Master konnte nicht geladen werden (%s): %s", self.db_path, e)
+            return
+        if self._names:
+            self._next_id = max(self._names) + 1
+        logger.debug("Security Master geladen: %d Wertpapiere, %d Namen", len(self._names), len(self._by_name))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def id_bound(self) -> int:
+        """Obergrenze (exklusiv) aller vergebenen IDs, z.B. als Größe von Lookup-Arrays"""
+        return self._next_id
+
+    def name(self, security_id: int) -> Optional[str]:
+        """Name, unter dem das Wertpapier zuerst gesehen wurde"""
+        return self._names.get(security_id)
+
+    def isin(self, security_id: int) -> Optional[str]:
+        return self._isins.get(security_id)
+
+    def resolve(self, isin: Optional[str], name: Optional[str]) -> int:
+        """
+        Kanonische ID für (ISIN, Name); legt das Wertpapier bei Bedarf an
+
+        Args:
+            isin: ISIN oder leer/ungültig (dann zählt nur der Name)
+            name: Anzeigename der Position
+        """
+        key = (isin or '', name or '')
+        security_id = self._resolved.get(key)
+        if security_id is not None:
+            return security_id
+        with self._lock:
+            security_id = self._resolve(normalize_isin(isin), normalize_position_name(name or ''), name or '')
+            self._resolved[key] = security_id
+        return security_id
+
+    def _resolve(self, isin: Optional[str], name_key: str, name: str) -> int:
+        if isin:
+            security_id = self._by_isin.get(isin)
+            if security_id is None:
+                security_id = self._by_name.get(name_key)
+                if security_id is not None and self._isins[security_id] is None:
+                    # Bisher nur über den Namen bekannt → ISIN übernehmen
+                    self._isins[security_id] = isin
+                    self._by_isin[isin] = security_id
+                    self._dirty_securities.add(security_id)
+                else:
+                    security_id = self._add(isin, name)
+            if name_key not in self._by_name:
+                self._add_name(name_key, security_id)
+            return security_id
+
+        security_id = self._by_name.get(name_key)
+        if security_id is None:
+            security_id = self._add(None, name)
+            self._add_name(name_key, security_id)
+        return security_id
+
+    def _add(self, isin: Optional[str], name: str) -> int:
+        security_id = self._next_id
+        self._next_id += 1
+        self._isins[security_id] = isin
+        self._names[security_id] = name
+        if isin:
+            self._by_isin[isin] = security_id
+        self._dirty_securities.add(security_id)
+        return security_id
+
+    def _add_name(self, name_key: str, security_id: int):
+        self._by_name[name_key] = security_id
+        self._dirty_names.add(name_key)
+
+    def register_holdings(self, holdings: Iterable[Dict]) -> int:
+        """
+        Trägt Holdings (Dicts mit 'name' und optional 'isin', z.B. aus ETFDetailsParser)
+        ein und speichert
+
+        Returns:
+            Anzahl neu angelegter Wertpapiere
+        """
+        before = len(self._names)
+        for holding in holdings:
+            name = holding.get('name', '')
+            if 'other holdings' in name.lower():
+                continue
+            self.resolve(holding.get('isin'), name)
+        self.flush()
+        return len(self._names) - before
+
+    def flush(self):
+        """Schreibt neue bzw. geänderte Einträge in die Datenbank (eine Transaktion)"""
+        with self._lock:
+            if not self._dirty_securities and not self._dirty_names:
+                return
+            securities = [
+                (security_id, self._isins[security_id], self._names[security_id])
+                for security_id in sorted(self._dirty_securities)
+            ]
+            names = [(name_key, self._by_name[name_key]) for name_key in self._dirty_names]
+            try:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.db_path)) as conn:
+                    with conn:
+                        conn.executescript(_SCHEMA)
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO securities (id, isin, name) VALUES (?, ?, ?)", securities
+                        )
+                        conn.executemany(
+                            "INSERT OR IGNORE INTO security_names (name_key, security_id) VALUES (?, ?)", names
+                        )
+            except sqlite3.Error as e:
+                logger.warning("Security Master konnte nicht gespeichert werden: %s", e)
+                return
+            self._dirty_securities.clear()
+            self._dirty_names.clear()
+            logger.debug("Security Master gespeichert: %d Wertpapiere, %d Namen", len(securities), len(names))
+
+
+# Globale Instanz (lazy, damit der Import keine Datenbank anlegt)
+_master = None
+_master_lock = threading.Lock()
+
+
+def get_security_master() -> SecurityMaster:
+    """Hole globale Security-Master-Instanz (Singleton)"""
+    global _master
+    if _master is None:
+        with _master_lock:
+            if _master is None:
+                _master = SecurityMaster()
+    return _master
@@ -0,0 +1,251 @@
+"""
+Snapshot Codec
+Kompaktes, spaltenweises Binärformat für DataFrames der Analyse-Historie
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Format-Kennungen (werden in snapshot_blobs.format gespeichert)
+SNAPSHOT_FORMAT = 'columnar-zlib-v1'
+DELTA_FORMAT = 'columnar-delta-v1'
+
+_HEADER_LENGTH = struct.Struct('<I')
+_COMPRESSION_LEVEL = 6
+
+
+def _codes_dtype(n_categories: int) -> np.dtype:
+    """Kleinster Integer-Typ für Dictionary-Codes (-1 = fehlender Wert)"""
+    if n_categories < 2 ** 7:
+        return np.dtype('<i1')
+    if n_categories < 2 ** 15:
+        return np.dtype('<i2')
+    return np.dtype('<i4')
+
+
+def _is_numeric(series: pd.Series) -> bool:
+    return pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series)
+
+
+def _encode_values(values, kind: str) -> Tuple[Dict, bytes]:
+    """Ein Array als Spalten-Metadaten + Buffer ('num' = Roh-Array, 'dict' = Kategorien + Codes)"""
+    if kind == 'num':
+        values = np.asarray(values)
+        if values.dtype.kind not in 'biuf':
+            values = values.astype(np.float64)
+        values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+        meta = {'kind': 'num'}
+    else:
+        codes, categories = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        values = codes.astype(_codes_dtype(len(categories)))
+        meta = {'kind': 'dict', 'categories': [str(c) for c in categories]}
+    meta['dtype'] = values.dtype.str
+    return meta, values.tobytes()
+
+
+def _decode_values(meta: Dict, payload: bytes, start: int) -> np.ndarray:
+    dtype = np.dtype(meta['dtype'])
+    values = np.frombuffer(payload, dtype=dtype, count=meta['nbytes'] // dtype.itemsize, offset=start)
+    if meta['kind'] == 'dict':
+        categories = np.array(meta['categories'] + [None], dtype=object)
+        # Code -1 (fehlend) zeigt auf das angehängte None
+        return categories[values]
+    return values.copy()
+
+
+def _pack(header: Dict, buffers: List[bytes]) -> bytes:
+    """Header (JSON) + Buffer zu einem unkomprimierten Payload zusammenfügen"""
+    header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    return b''.join([_HEADER_LENGTH.pack(len(header)), header] + buffers)
+
+
+def _unpack(payload) -> Tuple[Dict, int]:
+    (header_length,) = _HEADER_LENGTH.unpack_from(payload)
+    body_start = _HEADER_LENGTH.size + header_length
+    return json.loads(bytes(payload[_HEADER_LENGTH.size:body_start]).decode('utf-8')), body_start
+
+
+class _BufferWriter:
+    """Sammelt Spalten-Buffer und vergibt Offsets"""
+
+    def __init__(self):
+        self.buffers: List[bytes] = []
+        self.offset = 0
+
+    def add(self, values, kind: str) -> Dict:
+        meta, data = _encode_values(values, kind)
+        meta.update({'offset': self.offset, 'nbytes': len(data)})
+        self.buffers.append(data)
+        self.offset += len(data)
+        return meta
+
+
+def frame_payload(df: pd.DataFrame) -> bytes:
+    """
+    Kanonischer, unkomprimierter Payload eines DataFrames
+
+    Numerische Spalten als Roh-Arrays, Text-Spalten dictionary-kodiert (Kategorienliste +
+    Integer-Codes). Aufbau: 4 Byte Header-Länge, JSON-Header, Spalten-Buffer.
+    Gleiche DataFrames ergeben byte-gleiche Payloads (Grundlage für frame_digest).
+    """
+    writer = _BufferWriter()
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        kind = 'num' if _is_numeric(series) else 'dict'
+        meta = writer.add(series.to_numpy(), kind)
+        meta['name'] = name
+        columns.append(meta)
+    return _pack({'rows': len(df), 'columns': columns}, writer.buffers)
+
+
+def frame_digest(payload: bytes, namespace: str = '') -> str:
+    """Inhaltsadresse (SHA-256) eines kanonischen Payloads, optional je Namensraum (z.B. Dimension)"""
+    return hashlib.sha256(namespace.encode('utf-8') + b'\0' + payload).hexdigest()
+
+
+def risk_fingerprint(risk_data: Dict) -> str:
+    """
+    Fingerprint eines Risk-Ergebnisses (z.B. als Cache-Schlüssel)
+
+    DataFrames gehen über ihren kanonischen Payload ein, alle übrigen Werte als JSON.
+    Gleiche Ergebnisse ergeben denselben Fingerprint, unabhängig von der Objekt-Identität.
+    """
+    parts = {}
+    for key in sorted(risk_data, key=str):
+        value = risk_data[key]
+        if isinstance(value, pd.DataFrame):
+            parts[str(key)] = frame_digest(frame_payload(value), str(key))
+        else:
+            parts[str(key)] = json.dumps(value, sort_keys=True, default=str)
+    canonical = json.dumps(parts, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def encode_frame(df: pd.DataFrame, payload: Optional[bytes] = None) -> bytes:
+    """Kodiert ein DataFrame vollständig (zlib-komprimierter frame_payload)"""
+    return zlib.compress(payload if payload is not None else frame_payload(df), _COMPRESSION_LEVEL)
+
+
+def decode_columns(payload) -> Dict[str, np.ndarray]:
+    """
+    Spalten eines frame_payload als Arrays (ohne DataFrame)
+
+    payload darf ein beliebiger Buffer sein (bytes, memoryview, mmap); die Arrays sind Kopien.
+    """
+    header, body_start = _unpack(payload)
+    return {
+        meta['name']: _decode_values(meta, payload, body_start + meta['offset'])
+        for meta in header['columns']
+    }
+
+
+def decode_frame(blob: bytes) -> pd.DataFrame:
+    """Dekodiert ein mit encode_frame erzeugtes DataFrame"""
+    data = decode_columns(zlib.decompress(blob))
+    return pd.DataFrame(data, columns=list(data))
+
+
+def _align_rows(df: pd.DataFrame, base: pd.DataFrame) -> np.ndarray:
+    """
+    Zeilenzuordnung über die erste Spalte (Label, bei Duplikaten nach Vorkommen)
+
+    Returns:
+        Für jede Zeile von df der Zeilenindex in base, -1 für neue Zeilen
+    """
+    base_rows: Dict[Tuple, int] = {}
+    seen: Dict = {}
+    for i, label in enumerate(base.iloc[:, 0].tolist()):
+        n = seen.get(label, 0)
+        seen[label] = n + 1
+        base_rows[(label, n)] = i
+
+    take = np.full(len(df), -1, dtype=np.int32)
+    seen = {}
+    for i, label in enumerate(df.iloc[:, 0].tolist()):
+        n = seen.get(label, 0)
+        seen[label] = n + 1
+        take[i] = base_rows.get((label, n), -1)
+    return take
+
+
+def _changed(new: np.ndarray, old: np.ndarray, kind: str) -> np.ndarray:
+    """Maske geänderter Zellen (NaN/None gelten als gleich)"""
+    if kind == 'num':
+        if new.dtype.kind == 'f':
+            return ~((new == old) | (np.isnan(new) & np.isnan(old)))
+        return new != old
+    new_na = pd.isna(new)
+    old_na = pd.isna(old)
+    return np.array([
+        (a_na != b_na) or (not a_na and a != b)
+        for a, b, a_na, b_na in zip(new, old, new_na, old_na)
+    ], dtype=bool)
+
+
+def encode_delta(df: pd.DataFrame, base: pd.DataFrame) -> Optional[bytes]:
+    """
+    Kodiert df als Differenz zu base: Zeilenzuordnung + pro Spalte nur geänderte Zellen
+
+    Returns:
+        Komprimierter Delta-Payload oder None, wenn Spalten/Typen nicht zu base passen
+    """
+    if list(df.columns) != list(base.columns) or len(base) == 0 or len(df.columns) == 0:
+        return None
+
+    take = _align_rows(df, base)
+    source = np.where(take >= 0, take, 0)
+    new_rows = take < 0
+
+    writer = _BufferWriter()
+    take_meta = writer.add(take, 'num')
+    patches = []
+    for name in df.columns:
+        kind = 'num' if _is_numeric(df[name]) else 'dict'
+        if kind != ('num' if _is_numeric(base[name]) else 'dict'):
+            return None
+        new_values = df[name].to_numpy()
+        base_values = base[name].to_numpy()
+        if kind == 'num' and new_values.dtype != base_values.dtype:
+            return None
+
+        changed = new_rows | _changed(new_values, base_values[source], kind)
+        index = np.flatnonzero(changed).astype(np.int32)
+        if len(index) == 0:
+            continue
+        patches.append({
+            'name': name,
+            'index': writer.add(index, 'num'),
+            'values': writer.add(new_values[index], kind),
+        })
+
+    header = {'rows': len(df), 'take': take_meta, 'patches': patches}
+    return zlib.compress(_pack(header, writer.buffers), _COMPRESSION_LEVEL)
+
+
+def decode_delta(blob: bytes, base: pd.DataFrame) -> pd.DataFrame:
+    """Dekodiert ein mit encode_delta erzeugtes DataFrame gegen dessen Basis"""
+    payload = zlib.decompress(blob)
+    header, body_start = _unpack(payload)
+    take = _decode_values(header['take'], payload, body_start + header['take']['offset'])
+    source = np.where(take >= 0, take, 0)
+
+    data = {}
+    for name in base.columns:
+        base_values = base[name].to_numpy()
+        if not _is_numeric(base[name]):
+            base_values = base_values.astype(object)
+        data[name] = base_values[source] if len(take) else base_values[:0].copy()
+
+    for patch in header['patches']:
+        index = _decode_values(patch['index'], payload, body_start + patch['index']['offset'])
+        values = _decode_values(patch['values'], payload, body_start + patch['values']['offset'])
+        data[patch['name']][index] = values
+
+    return pd.DataFrame(data, columns=list(base.columns))
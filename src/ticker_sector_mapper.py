@@ -2,26 +2,82 @@
 Ticker-zu-Sektor Mapping mit automatischem Caching und API-Fallback
 """
 
+import atexit
 import json
 import logging
-import requests
+import os
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from datetime import datetime, timedelta
 import yfinance as yf
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+from .openfigi_client import get_openfigi_client
 
 logger = logging.getLogger(__name__)
 
+# Anfragen pro Sekunde je Quelle (OpenFIGI regelt der Client über die ratelimit-Header)
+DEFAULT_RATE_LIMITS = {'yahoo': 4.0}
+
+# Lebende Mapper-Instanzen; ein atexit-Hook für alle statt einer Registrierung je Instanz
+_live_mappers: "weakref.WeakSet[TickerSectorMapper]" = weakref.WeakSet()
+
+
+def _flush_live_mappers():
+    """Ungespeicherte Änderungen aller Mapper beim Programmende schreiben"""
+    for mapper in list(_live_mappers):
+        mapper.flush()
+
+
+atexit.register(_flush_live_mappers)
+
+
+class _RateLimiter:
+    """Einfacher Rate-Limiter: höchstens rate Aufrufe pro Sekunde (threadsicher)"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
 class TickerSectorMapper:
     """
     Verwaltet Ticker-zu-Sektor-Zuordnungen mit lokalem Cache und API-Fallback
     """
     
-    def __init__(self, cache_file: str = "data/ticker_sector_cache.json"):
+    def __init__(self, cache_file: str = "data/ticker_sector_cache.json", flush_interval: float = 5.0,
+                 rate_limits: Optional[Dict[str, float]] = None):
         self.cache_file = Path(cache_file)
         self.cache_file.parent.mkdir(parents=True, exist_ok=True)
         self.cache = self._load_cache()
         
+        # Write-behind: neue Einträge nur als "dirty" markieren, gebündelt schreiben
+        # (Timer, Ende einer Batch-Abfrage, Programmende)
+        self.flush_interval = flush_interval
+        self._dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        self._lock = threading.RLock()
+        # Flush beim Programmende (_flush_live_mappers); hält die Instanz nicht am Leben
+        _live_mappers.add(self)
+        
+        # Rate-Limits je Quelle, gelten auch für parallele Batch-Abfragen
+        self._rate_limiters = {
+            source: _RateLimiter(rate)
+            for source, rate in (rate_limits if rate_limits is not None else DEFAULT_RATE_LIMITS).items()
+        }
+        
         # Sektor-Normalisierung (Yahoo Finance -> Standard)
         self.sector_mapping = {
             'Technology': 'Technology',
@@ -58,13 +114,45 @@ class TickerSectorMapper:
         return {}
     
     def _save_cache(self):
-        """Speichere Cache in JSON-Datei"""
-        try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache, f, indent=2, ensure_ascii=False)
-            logger.debug("Ticker-Sektor-Cache gespeichert: %d Einträge", len(self.cache))
-        except Exception as e:
-            logger.warning("Fehler beim Speichern des Caches: %s", e)
+        """
+        Speichere Cache in JSON-Datei.
+        
+        Schreibt in eine temporäre Datei und ersetzt die alte atomar, damit parallele
+        Sessions nie einen halb geschriebenen Cache lesen.
+        """
+        with self._lock:
+            self._dirty = False
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=self.cache_file.parent, prefix=f".{self.cache_file.name}.", suffix='.tmp'
+                )
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self.cache, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_path, self.cache_file)
+                logger.debug("Ticker-Sektor-Cache gespeichert: %d Einträge", len(self.cache))
+            except Exception as e:
+                logger.warning("Fehler beim Speichern des Caches: %s", e)
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    
+    def _mark_dirty(self):
+        """Merke ungespeicherte Änderungen vor und plane einen Flush per Timer"""
+        with self._lock:
+            self._dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def flush(self):
+        """Schreibe ungespeicherte Cache-Änderungen sofort"""
+        with self._lock:
+            if self._dirty:
+                self._save_cache()
     
     def _normalize_sector(self, sector: str) -> str:
         """Normalisiere Sektor-Namen"""
@@ -87,6 +175,7 @@ class TickerSectorMapper:
     
     def _fetch_from_yahoo(self, ticker: str) -> Optional[str]:
         """Hole Sektor von Yahoo Finance"""
+        self._throttle('yahoo')
         try:
             stock = yf.Ticker(ticker)
             info = stock.info
@@ -101,34 +190,35 @@ class TickerSectorMapper:
         
         return None
     
+    def _throttle(self, source: str):
+        """Warte, bis die Quelle laut Rate-Limit wieder angefragt werden darf"""
+        limiter = self._rate_limiters.get(source)
+        if limiter:
+            limiter.acquire()
+    
     def _fetch_from_openfigi(self, ticker: str) -> Optional[str]:
         """Hole Sektor von OpenFIGI API"""
-        try:
-            # OpenFIGI API
-            url = "https://api.openfigi.com/v3/mapping"
-            headers = {'Content-Type': 'application/json'}
-            
-            payload = [{
+        return self._fetch_from_openfigi_batch([ticker]).get(ticker)
+    
+    def _fetch_from_openfigi_batch(self, tickers: List[str]) -> Dict[str, Optional[str]]:
+        """Hole Sektoren für mehrere Ticker gebündelt von OpenFIGI (eine Anfrage pro 100 Ticker)"""
+        jobs = [
+            {
                 "idType": "TICKER",
                 "idValue": ticker,
                 "exchCode": "US"  # US Exchange als Standard
-            }]
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data and len(data) > 0 and 'data' in data[0]:
-                    figi_data = data[0]['data'][0]
-                    sector = figi_data.get('marketSector')
-                    if sector:
-                        logger.debug("OpenFIGI: %s -> %s", ticker, sector)
-                        return self._normalize_sector(sector)
-        
-        except Exception as e:
-            logger.warning("OpenFIGI Fehler für %s: %s", ticker, e)
-        
-        return None
+            }
+            for ticker in tickers
+        ]
+        results = {}
+        for ticker, figi_data in zip(tickers, get_openfigi_client().map_jobs(jobs)):
+            sector = figi_data[0].get('marketSector') if figi_data else None
+            if sector:
+                logger.debug("OpenFIGI: %s -> %s", ticker, sector)
+                results[ticker] = self._normalize_sector(sector)
+            else:
+                results[ticker] = None
+        return results
     
     def get_sector(self, ticker: str, use_cache: bool = True, max_age_days: int = 90) -> str:
         """
@@ -156,47 +246,130 @@ class TickerSectorMapper:
         
         # 2. Hole von Yahoo Finance
         sector = self._fetch_from_yahoo(ticker)
-        source = 'yahoo' if sector and sector != 'Unknown' else None
+        source = 'yahoo'
 
         # 3. Fallback: OpenFIGI
         if not sector or sector == 'Unknown':
             sector = self._fetch_from_openfigi(ticker)
-            if sector and sector != 'Unknown':
-                source = 'openfigi'
+            source = 'openfigi'
 
-        # 4. Fallback: Unknown
-        if not sector:
+        # 4./5. Im Cache speichern (Fallback: Unknown); Datei wird verzögert geschrieben
+        self._store_sector(ticker, sector, source)
+        
+        return self.cache[ticker]['sector']
+    
+    def _store_sector(self, ticker: str, sector: Optional[str], source: str):
+        """Speichere Ergebnis im Cache mit korrekter Quellen-Markierung (Datei: write-behind)"""
+        if not sector or sector == 'Unknown':
             sector = 'Unknown'
             source = 'unknown'
-
-        # 5. Speichere im Cache mit korrekter Quellen-Markierung
-        self.cache[ticker] = {
-            'sector': sector,
-            'timestamp': datetime.now().isoformat(),
-            'source': source or 'unknown',
-        }
-        self._save_cache()
-        
-        return sector
+        with self._lock:
+            self.cache[ticker] = {
+                'sector': sector,
+                'timestamp': datetime.now().isoformat(),
+                'source': source,
+            }
+            self._mark_dirty()
     
-    def get_sectors_batch(self, tickers: list, use_cache: bool = True) -> Dict[str, str]:
+    def get_sectors_batch(self, tickers: list, use_cache: bool = True, max_workers: int = 8,
+                          timeout: Optional[float] = None) -> Dict[str, str]:
         """
         Hole Sektoren für mehrere Tickers auf einmal
         
         Args:
             tickers: Liste von Ticker-Symbolen
             use_cache: Nutze Cache wenn verfügbar
+            max_workers: Parallele Abfragen für Cache-Misses
+            timeout: Maximale Gesamtdauer in Sekunden (None = unbegrenzt)
             
         Returns:
-            Dictionary mit Ticker -> Sektor Zuordnungen
+            Dictionary mit Ticker -> Sektor Zuordnungen (bei timeout ggf. unvollständig)
         """
-        results = {}
+        details = self.fetch_sectors(tickers, use_cache=use_cache, max_workers=max_workers, timeout=timeout)
+        return {ticker: info['sector'] for ticker, info in details.items() if info['status'] == 'ok'}
+    
+    def fetch_sectors(self, tickers: list, use_cache: bool = True, max_workers: int = 8,
+                      timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """
+        Batch-Abfrage mit Details je Ticker
         
-        for ticker in tickers:
-            if ticker:
-                results[ticker] = self.get_sector(ticker, use_cache=use_cache)
+        Cache-Treffer werden direkt beantwortet. Misses werden parallel (max_workers,
+        Rate-Limit je Quelle) von Yahoo Finance geholt; der OpenFIGI-Fallback läuft
+        gebündelt (eine Anfrage pro 100 Ticker). Was bis timeout nicht fertig ist,
+        wird mit status 'timeout' gemeldet und nicht gecacht.
         
-        return results
+        Returns:
+            {ticker: {'sector', 'source', 'status' ('ok'|'timeout'), 'seconds'}}
+            source: cache | yahoo | openfigi | unknown
+        """
+        keys = {ticker: ticker.upper().strip() for ticker in tickers if ticker}
+        details: Dict[str, Dict] = {}
+        misses = []
+        for key in dict.fromkeys(keys.values()):
+            if use_cache and self._is_cache_valid(key):
+                details[key] = {
+                    'sector': self.cache[key].get('sector', 'Unknown'),
+                    'source': 'cache',
+                    'status': 'ok',
+                    'seconds': 0.0,
+                }
+            else:
+                misses.append(key)
+        
+        if misses:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            executor = ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, len(misses))), thread_name_prefix='sector-fetch'
+            )
+            futures = {executor.submit(self._timed_fetch_from_yahoo, key): key for key in misses}
+            done, not_done = wait(futures, timeout=timeout)
+            executor.shutdown(wait=False, cancel_futures=True)
+            
+            yahoo: Dict[str, Tuple[Optional[str], float]] = {}
+            for future in done:
+                yahoo[futures[future]] = future.result()
+            for future in not_done:
+                details[futures[future]] = {
+                    'sector': 'Unknown', 'source': 'unknown', 'status': 'timeout', 'seconds': None,
+                }
+            
+            # OpenFIGI-Fallback gebündelt für alle, die Yahoo nicht auflösen konnte
+            figi_needed = [key for key, (sector, _) in yahoo.items() if not sector or sector == 'Unknown']
+            figi: Dict[str, Optional[str]] = {}
+            figi_seconds = 0.0
+            if figi_needed and (deadline is None or time.monotonic() < deadline):
+                started = time.perf_counter()
+                figi = self._fetch_from_openfigi_batch(figi_needed)
+                figi_seconds = time.perf_counter() - started
+            
+            for key, (yahoo_sector, seconds) in yahoo.items():
+                if key in figi_needed and key not in figi:
+                    # Fallback wegen timeout übersprungen: nicht als Unknown cachen
+                    details[key] = {
+                        'sector': 'Unknown', 'source': 'unknown', 'status': 'timeout', 'seconds': seconds,
+                    }
+                    continue
+                if key in figi:
+                    self._store_sector(key, figi[key], 'openfigi')
+                    seconds += figi_seconds
+                else:
+                    self._store_sector(key, yahoo_sector, 'yahoo')
+                entry = self.cache[key]
+                details[key] = {
+                    'sector': entry['sector'],
+                    'source': entry['source'],
+                    'status': 'ok',
+                    'seconds': seconds,
+                }
+            self.flush()
+        
+        return {ticker: details[key] for ticker, key in keys.items()}
+    
+    def _timed_fetch_from_yahoo(self, ticker: str) -> Tuple[Optional[str], float]:
+        """Yahoo-Abfrage mit Dauer in Sekunden (inkl. Wartezeit durch Rate-Limit)"""
+        started = time.perf_counter()
+        sector = self._fetch_from_yahoo(ticker)
+        return sector, time.perf_counter() - started
     
     def manual_update(self, ticker: str, sector: str):
         """
@@ -209,18 +382,20 @@ class TickerSectorMapper:
         ticker = ticker.upper().strip()
         sector = self._normalize_sector(sector)
         
-        self.cache[ticker] = {
-            'sector': sector,
-            'timestamp': datetime.now().isoformat(),
-            'source': 'manual'
-        }
-        self._save_cache()
+        with self._lock:
+            self.cache[ticker] = {
+                'sector': sector,
+                'timestamp': datetime.now().isoformat(),
+                'source': 'manual'
+            }
+            self._save_cache()
         logger.debug("Manual Update: %s -> %s", ticker, sector)
 
     def clear_cache(self):
         """Lösche kompletten Cache"""
-        self.cache = {}
-        self._save_cache()
+        with self._lock:
+            self.cache = {}
+            self._save_cache()
         logger.debug("Cache gelöscht")
     
     def get_cache_stats(self) -> Dict:
@@ -7,8 +7,71 @@ import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
 import pandas as pd
-from typing import Dict, Optional
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
 from config import RISK_THRESHOLDS
+from .snapshot_codec import frame_digest, frame_payload
+
+# Anzahl zwischengespeicherter Figuren/Tabellen (über alle Kategorien und Limits)
+_FIGURE_CACHE_SIZE = 64
+
+# Level-of-Detail-Treemap: Hierarchie-Spalten je Kategorie (über der Label-Spalte)
+_TREEMAP_HIERARCHY = {'positions': ('Typ', 'Sektor')}
+# Automatisch hierarchisch ab dieser Zeilenzahl
+_TREEMAP_LOD_MIN_ROWS = 1000
+# Knoten unter diesem Flächenanteil (% der Treemap) werden je Eltern-Knoten zu „Sonstige“
+_TREEMAP_LOD_MIN_SHARE = 0.5
+# Trennzeichen für Knoten-IDs (kommt in Labels nicht vor)
+_NODE_ID_SEP = '\x1f'
+
+
+class _FigureCache:
+    """
+    LRU-Cache für Figur-Spezifikationen, Farbzuordnungen und Tabellendaten (thread-sicher)
+    
+    Schlüssel: (Daten-Digest, Kategorie, Art, Parameter der jeweiligen Art). Jede Art hängt
+    nur von ihren eigenen Parametern ab, z.B. baut ein geändertes max_pie nur das Pie Chart neu.
+    
+    Der Cache ist prozessweit (alle Sessions); er hält daher keine veränderlichen Figure- oder
+    Styler-Objekte, sondern nur deren Eingaben – siehe _cached_figure und _table_frames.
+    """
+    
+    def __init__(self, max_entries: int = _FIGURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_or_build(self, key, build: Callable):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_figure_cache = _FigureCache()
+
+
+def clear_figure_cache():
+    """Lösche zwischengespeicherte Figuren"""
+    _figure_cache.clear()
+
+
+def _cached_figure(key, build: Callable[[], go.Figure]) -> go.Figure:
+    """Figur je Aufruf neu aus der gecachten Spezifikation (dict) – keine geteilten Figure-Objekte"""
+    spec = _figure_cache.get_or_build(key, lambda: build().to_dict())
+    return go.Figure(spec)
 
 
 def _cap_df_with_sonstige(df: pd.DataFrame, max_items: int, label_col: str, value_col: str) -> pd.DataFrame:
@@ -58,12 +121,7 @@ def _build_unified_color_map(df: pd.DataFrame, label_col: str) -> Dict[str, str]
     "Other Holdings" immer hellblau, alle anderen bunt aus der Palette (deterministisch).
     """
     # Reihenfolge: so wie im DataFrame, damit konsistent
-    seen = set()
-    unique_ordered = []
-    for v in df[label_col]:
-        if v not in seen:
-            seen.add(v)
-            unique_ordered.append(v)
+    unique_ordered = df[label_col].drop_duplicates().tolist()
     color_map = {}
     palette_idx = 0
     for label in unique_ordered:
@@ -75,7 +133,7 @@ def _build_unified_color_map(df: pd.DataFrame, label_col: str) -> Dict[str, str]
     return color_map
 
 
-def create_visualizations(risk_data: Dict, category: str, max_treemap: int = 30, max_pie: int = 10, max_bar: int = 30, risk_thresholds: Optional[Dict] = None):
+def create_visualizations(risk_data: Dict, category: str, max_treemap: int = 30, max_pie: int = 10, max_bar: int = 30, risk_thresholds: Optional[Dict] = None, treemap_lod: Optional[bool] = None):
     """
     Erstellt Visualisierungen für eine Risiko-Kategorie
     
@@ -86,6 +144,9 @@ def create_visualizations(risk_data: Dict, category: str, max_treemap: int = 30,
         max_pie: Maximale Anzahl Positionen in Pie Chart
         max_bar: Maximale Anzahl Positionen in Bar Chart
         risk_thresholds: Optional custom risk thresholds (None = use defaults from config)
+        treemap_lod: Treemap als serverseitig aggregierte Hierarchie (z.B. Anlageklasse → Sektor →
+                     Position, siehe _create_treemap_lod). None = automatisch ab
+                     _TREEMAP_LOD_MIN_ROWS Zeilen, nur für Kategorien mit Hierarchie-Spalten.
     """
     
     # Hole Schwellenwerte (custom oder defaults)
@@ -101,7 +162,12 @@ def create_visualizations(risk_data: Dict, category: str, max_treemap: int = 30,
         return
     
     label_col, _ = _get_column_names(category)
-    color_map = _build_unified_color_map(df, label_col)
+    # Inhaltsadresse der Daten: gleiche Daten -> Figuren aus dem Cache (auch über Reruns)
+    digest = frame_digest(frame_payload(df), category)
+    color_map = _figure_cache.get_or_build(
+        (digest, category, 'colors'),
+        lambda: _build_unified_color_map(df, label_col)
+    )
     
     # Layout: 2 Spalten
     col1, col2 = st.columns([2, 1])
@@ -109,23 +175,50 @@ def create_visualizations(risk_data: Dict, category: str, max_treemap: int = 30,
     with col1:
         # Treemap
         st.subheader("Treemap Visualisierung")
-        _create_treemap(df, category, max_items=max_treemap, color_map=color_map)
+        hierarchy = [col for col in _TREEMAP_HIERARCHY.get(category, ()) if col in df.columns]
+        if treemap_lod is None:
+            treemap_lod = len(df) >= _TREEMAP_LOD_MIN_ROWS
+        if treemap_lod and hierarchy:
+            fig = _cached_figure(
+                (digest, category, 'treemap_lod', max_treemap),
+                lambda: _create_treemap_lod(df, category, hierarchy, max_leaves=max_treemap, color_map=color_map)
+            )
+        else:
+            fig = _cached_figure(
+                (digest, category, 'treemap', max_treemap),
+                lambda: _create_treemap(df, category, max_items=max_treemap, color_map=color_map)
+            )
+        st.plotly_chart(fig, width='stretch', key=f"treemap_{category}")
     
     with col2:
         # Pie Chart
         st.subheader("Verteilung")
-        _create_pie_chart(df, category, max_items=max_pie, color_map=color_map)
+        fig = _cached_figure(
+            (digest, category, 'pie', max_pie),
+            lambda: _create_pie_chart(df, category, max_items=max_pie, color_map=color_map)
+        )
+        st.plotly_chart(fig, width='stretch', key=f"pie_{category}")
     
     # Volle Breite für Balkendiagramm
     st.subheader("Detaillierte Übersicht")
-    _create_bar_chart(df, category, thresholds, max_items=max_bar, color_map=color_map)
+    fig = _cached_figure(
+        (digest, category, 'bar', max_bar),
+        lambda: _create_bar_chart(df, category, thresholds, max_items=max_bar, color_map=color_map)
+    )
+    st.plotly_chart(fig, width='stretch', key=f"bar_{category}")
     
     # Tabelle
     st.subheader("Daten-Tabelle")
-    _display_table(df, category, thresholds)
+    high_threshold = thresholds.get('high', 10.0)
+    medium_threshold = thresholds.get('medium', 5.0)
+    df_display, styles = _figure_cache.get_or_build(
+        (digest, category, 'table', high_threshold, medium_threshold),
+        lambda: _table_frames(df, high_threshold, medium_threshold)
+    )
+    _display_table(df, _styler(df_display, styles))
 
 
-def _create_treemap(df: pd.DataFrame, category: str, max_items: int = 30, color_map: Optional[Dict[str, str]] = None):
+def _create_treemap(df: pd.DataFrame, category: str, max_items: int = 30, color_map: Optional[Dict[str, str]] = None) -> go.Figure:
     """
     Erstellt eine Treemap-Visualisierung.
     color_map: Einheitliche Label→Farbe (aus _build_unified_color_map).
@@ -199,10 +292,131 @@ def _create_treemap(df: pd.DataFrame, category: str, max_items: int = 30, color_
         showlegend=False
     )
     
-    st.plotly_chart(fig, width='stretch', key=f"treemap_{category}")
+    return fig
+
+
+def _treemap_lod_nodes(df: pd.DataFrame, label_col: str, value_col: str, hierarchy: List[str],
+                       max_leaves: int, min_share: float = _TREEMAP_LOD_MIN_SHARE) -> pd.DataFrame:
+    """
+    Aggregiert df serverseitig zu Treemap-Knoten (hierarchy → label_col)
+    
+    Pro Ebene werden nur Knoten mit mindestens min_share % der Gesamtfläche ausgegeben, Blätter
+    zusätzlich nur die max_leaves größten. Der Rest wird je Eltern-Knoten zu „Sonstige“ zusammengefasst.
+    Pro Ebene entstehen so höchstens 100 / min_share Knoten, unabhängig von der Portfolio-Größe.
+    
+    Returns:
+        DataFrame mit id, parent, label, name (voller Name), value, anteil, level, root, row
+        (Eltern vor Kindern; level = Index in hierarchy, len(hierarchy) für Blätter;
+        row = Index der Zeile in df für Blätter, sonst None)
+    """
+    df = df[[label_col, value_col] + list(hierarchy)].assign(**{
+        '_anteil': df['Anteil (%)'] if 'Anteil (%)' in df.columns else None
+    })
+    for col in hierarchy:
+        df[col] = df[col].fillna('Unknown').astype(str).replace('', 'Unknown')
+    total = float(df[value_col].sum()) or 1.0
+    if df['_anteil'].isna().all():
+        df['_anteil'] = df[value_col] / total * 100
+    df['_anteil'] = df['_anteil'].astype(float)
+    keep_leaf = (
+        (df[value_col].rank(method='first', ascending=False) <= max_leaves)
+        & (df[value_col] / total * 100 >= min_share)
+    )
+    
+    nodes = []
+    
+    def add(node_id, parent, label, name, value, anteil, level, root, row=None):
+        nodes.append({'id': node_id, 'parent': parent, 'label': label, 'name': name,
+                      'value': float(value), 'anteil': round(float(anteil), 1), 'level': level,
+                      'root': root, 'row': row})
+    
+    def add_others(parent, rest: pd.DataFrame, level, root):
+        if len(rest):
+            add(parent + _NODE_ID_SEP + 'Sonstige', parent, 'Sonstige', 'Sonstige',
+                rest[value_col].sum(), rest['_anteil'].sum(), level, root)
+    
+    def walk(sub: pd.DataFrame, level: int, parent: str, root: Optional[str]):
+        if level == len(hierarchy):
+            leaves = sub[keep_leaf.loc[sub.index]]
+            for idx, row in leaves.iterrows():
+                add(parent + _NODE_ID_SEP + str(idx), parent, row[label_col], row[label_col],
+                    row[value_col], row['_anteil'], level, root, idx)
+            add_others(parent, sub.drop(leaves.index), level, root)
+            return
+        col = hierarchy[level]
+        groups = sub.groupby(col, sort=False)
+        sums = groups[value_col].sum().sort_values(ascending=False, kind='stable')
+        small = []
+        for name, value in sums.items():
+            group = groups.get_group(name)
+            if value / total * 100 < min_share:
+                small.append(group)
+                continue
+            node_id = parent + _NODE_ID_SEP + name
+            add(node_id, parent, name, name, value, group['_anteil'].sum(), level, root or name)
+            walk(group, level + 1, node_id, root or name)
+        if small:
+            add_others(parent, pd.concat(small), level, root)
+    
+    walk(df, 0, '', None)
+    return pd.DataFrame(nodes, columns=['id', 'parent', 'label', 'name', 'value', 'anteil', 'level', 'root', 'row'])
+
+
+def _create_treemap_lod(df: pd.DataFrame, category: str, hierarchy: List[str], max_leaves: int = 30,
+                        color_map: Optional[Dict[str, str]] = None) -> go.Figure:
+    """
+    Level-of-Detail-Treemap: vorab aggregierte Hierarchie (siehe _treemap_lod_nodes).
+    Gruppen-Knoten in der Farbe ihres obersten Knotens, Blätter wie in _create_treemap.
+    """
+    label_col, value_col = _get_column_names(category)
+    nodes = _treemap_lod_nodes(df, label_col, value_col, hierarchy, max_leaves)
+    is_leaf = nodes['level'] == len(hierarchy)
+    
+    labels = nodes['label'].astype(str).tolist()
+    if category == 'positions' and 'Ticker' in df.columns:
+        # Blätter wie _add_display_label_positions: Ticker, sonst gekürzter Positionsname
+        for i, row in zip(nodes.index[is_leaf], nodes.loc[is_leaf, 'row']):
+            if row is None or pd.isna(row):
+                continue
+            ticker = df.at[row, 'Ticker']
+            labels[i] = ticker if ticker and str(ticker).strip() else str(df.at[row, label_col])[:25]
+    
+    root_colors = {}
+    for root in nodes.loc[nodes['level'] == 0, 'root']:
+        root_colors[root] = ITEM_PALETTE[len(root_colors) % len(ITEM_PALETTE)]
+    colors = []
+    for _, node in nodes.iterrows():
+        if node['level'] == len(hierarchy) and node['name'] in (color_map or {}):
+            colors.append(color_map[node['name']])
+        else:
+            colors.append(root_colors.get(node['root'], OTHER_HOLDINGS_COLOR))
+    
+    fig = go.Figure(go.Treemap(
+        ids=nodes['id'],
+        parents=nodes['parent'],
+        labels=labels,
+        values=nodes['value'],
+        branchvalues='total',
+        marker_colors=colors,
+        customdata=list(zip(nodes['name'].astype(str), nodes['anteil'])),
+        texttemplate="<b>%{label}</b><br>€ %{value:,.2f}<br>%{customdata[1]:.1f}%",
+        hovertemplate=(
+            '<b>%{customdata[0]}</b><br>Wert: €%{value:,.2f}<br>'
+            'Anteil: %{customdata[1]:.1f}%<extra></extra>'
+        ),
+        textfont_size=12
+    ))
+    
+    fig.update_layout(
+        height=500,
+        margin=dict(t=10, l=10, r=10, b=10),
+        showlegend=False
+    )
+    
+    return fig
 
 
-def _create_pie_chart(df: pd.DataFrame, category: str, max_items: int = 10, color_map: Optional[Dict[str, str]] = None):
+def _create_pie_chart(df: pd.DataFrame, category: str, max_items: int = 10, color_map: Optional[Dict[str, str]] = None) -> go.Figure:
     """
     Erstellt ein Kreisdiagramm.
     color_map: Einheitliche Label→Farbe (aus _build_unified_color_map).
@@ -294,10 +508,10 @@ def _create_pie_chart(df: pd.DataFrame, category: str, max_items: int = 10, colo
         margin=dict(t=10, l=10, r=10, b=10)
     )
     
-    st.plotly_chart(fig, width='stretch', key=f"pie_{category}")
+    return fig
 
 
-def _create_bar_chart(df: pd.DataFrame, category: str, thresholds: Dict, max_items: int = 30, color_map: Optional[Dict[str, str]] = None):
+def _create_bar_chart(df: pd.DataFrame, category: str, thresholds: Dict, max_items: int = 30, color_map: Optional[Dict[str, str]] = None) -> go.Figure:
     """
     Erstellt ein horizontales Balkendiagramm.
     color_map: Einheitliche Label→Farbe (aus _build_unified_color_map).
@@ -334,17 +548,22 @@ def _create_bar_chart(df: pd.DataFrame, category: str, thresholds: Dict, max_ite
         margin=dict(t=10, l=10, r=10, b=10)
     )
     
-    st.plotly_chart(fig, width='stretch', key=f"bar_{category}")
+    return fig
 
 
-def _display_table(df: pd.DataFrame, category: str, thresholds: Dict):
+def _styler(df_display: pd.DataFrame, styles: pd.DataFrame):
+    """Neuer Styler über vorberechneten Anzeige- und Style-Frames (günstig, wird lazy gerendert)"""
+    return df_display.style.apply(lambda _: styles, axis=None)
+
+
+def _table_frames(df: pd.DataFrame, high_threshold: float, medium_threshold: float):
     """
-    Zeigt eine formatierte Tabelle an
+    Formatierte Tabelle mit Risiko-Kennzeichnung als (Anzeige-Frame, Style-Frame), siehe _styler
     
     Args:
         df: DataFrame mit Daten
-        category: Kategorie der Daten
-        thresholds: Risiko-Schwellenwerte (dict mit 'high' und 'medium')
+        high_threshold: Schwelle für rote Markierung (Anteil in %)
+        medium_threshold: Schwelle für gelbe Markierung (Anteil in %)
     """
     # Formatierung mit korrektem Dtype-Handling
     df_display = df.copy()
@@ -357,22 +576,27 @@ def _display_table(df: pd.DataFrame, category: str, thresholds: Dict):
     df_display['Wert (€)'] = df['Wert (€)'].apply(lambda x: f'€ {x:,.2f}')
     df_display['Anteil (%)'] = df['Anteil (%)'].apply(lambda x: f'{x:.1f}%')
     
-    # Hole Schwellenwerte
-    high_threshold = thresholds.get('high', 10.0)
-    medium_threshold = thresholds.get('medium', 5.0)
-    
-    # Risiko-Kennzeichnung mit kategorie-spezifischen Schwellenwerten
-    def highlight_risk(row):
-        anteil = float(row['Anteil (%)'].replace('%', '').replace(',', '.'))
-        if anteil > high_threshold:
-            return ['background-color: #ffcccc'] * len(row)
-        elif anteil > medium_threshold:
-            return ['background-color: #fff9cc'] * len(row)
-        else:
-            return [''] * len(row)
+    # Risiko-Kennzeichnung einmal vorberechnen (angezeigter, gerundeter Anteil)
+    anteil = df_display['Anteil (%)'].str.rstrip('%').astype(float)
+    row_styles = pd.Series('', index=df_display.index, dtype=object)
+    row_styles[anteil > medium_threshold] = 'background-color: #fff9cc'
+    row_styles[anteil > high_threshold] = 'background-color: #ffcccc'
+    styles = pd.DataFrame(
+        {col: row_styles for col in df_display.columns},
+        index=df_display.index
+    )
     
-    styled_df = df_display.style.apply(highlight_risk, axis=1)
+    return df_display, styles
+
+
+def _display_table(df: pd.DataFrame, styled_df):
+    """
+    Zeigt eine formatierte Tabelle an
     
+    Args:
+        df: DataFrame mit Daten
+        styled_df: Formatierte Tabelle (Styler aus _table_frames/_styler)
+    """
     st.dataframe(styled_df, width='stretch', height=400)
     
     # Statistiken (ohne Risiko-Ausweis)